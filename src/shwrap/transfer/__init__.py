@@ -1 +1,2 @@
 from .transfer import SecureCopyProtocol
+from .async_transfer import AsyncSecureCopyProtocol
@@ -3,11 +3,13 @@
 _scp() {
     # Default values
     local PORT=22
-    local SOURCE_PATH=""
+    local SOURCE_PATHS=()
     local SAVE_PATH=""
     local USER=""
     local IP=""
     local PEM_FILE=""
+    local SSH_OPTIONS=()
+    local SCP_OPTIONS=()
 
     # Parse arguments
     while [[ $# -gt 0 ]]
@@ -21,7 +23,7 @@ _scp() {
         shift # past value
         ;;
         --source-path)
-        SOURCE_PATH="$2"
+        SOURCE_PATHS+=("$2")
         shift # past argument
         shift # past value
         ;;
@@ -45,6 +47,16 @@ _scp() {
         shift # past argument
         shift # past value
         ;;
+        --ssh-option)
+        SSH_OPTIONS+=(-o "$2")
+        shift # past argument
+        shift # past value
+        ;;
+        --scp-option)
+        SCP_OPTIONS+=("$2")
+        shift # past argument
+        shift # past value
+        ;;
         *)
         echo "Unknown argument: $1"
         return 1
@@ -53,16 +65,24 @@ _scp() {
     done
 
     # Check if all required parameters are set
-    if [[ -z "$SOURCE_PATH" || -z "$SAVE_PATH" || -z "$USER" || -z "$IP" ]]; then
+    if [[ ${#SOURCE_PATHS[@]} -eq 0 || -z "$SAVE_PATH" || -z "$USER" || -z "$IP" ]]; then
         echo "Required parameters missing."
         return 1
     fi
 
+    # OpenSSH 9.0 and later copy over SFTP by default. The original protocol
+    # is asked for where scp knows -O, so that the output that is followed 
+    # is the same as on linux and on older versions
+    local PROTOCOL=()
+    if ! scp -O 2>&1 | grep -Eq "option -- '?O"; then
+        PROTOCOL=(-O)
+    fi
+
     # If a PEM file is provided, use it with the -i option
     if [[ ! -z "$PEM_FILE" ]]; then
-        script -q /dev/null scp -v -r -P "$PORT" -i "$PEM_FILE" "$SOURCE_PATH" "${USER}@${IP}:${SAVE_PATH}"
+        script -q /dev/null scp -v -r -P "$PORT" "${PROTOCOL[@]}" "${SSH_OPTIONS[@]}" "${SCP_OPTIONS[@]}" -i "$PEM_FILE" "${SOURCE_PATHS[@]}" "${USER}@${IP}:${SAVE_PATH}"
     else
-        script -q /dev/null scp -v -r -P "$PORT" "$SOURCE_PATH" "${USER}@${IP}:${SAVE_PATH}"
+        script -q /dev/null scp -v -r -P "$PORT" "${PROTOCOL[@]}" "${SSH_OPTIONS[@]}" "${SCP_OPTIONS[@]}" "${SOURCE_PATHS[@]}" "${USER}@${IP}:${SAVE_PATH}"
     fi
 }
 
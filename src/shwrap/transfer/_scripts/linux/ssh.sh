@@ -0,0 +1,84 @@
+#! /bin/bash
+
+_ssh() {
+    # Default values
+    local PORT=22
+    local USER=""
+    local IP=""
+    local PEM_FILE=""
+    local SSH_OPTIONS=()
+    local COMMAND=""
+    local CONTROL=""
+
+    # Parse arguments
+    while [[ $# -gt 0 ]]
+    do
+    key="$1"
+
+    case $key in
+        --port)
+        PORT="$2"
+        shift # past argument
+        shift # past value
+        ;;
+        --user)
+        USER="$2"
+        shift # past argument
+        shift # past value
+        ;;
+        --ip)
+        IP="$2"
+        shift # past argument
+        shift # past value
+        ;;
+        --pem)
+        PEM_FILE="$2"
+        shift # past argument
+        shift # past value
+        ;;
+        --control)
+        CONTROL="$2"
+        shift # past argument
+        shift # past value
+        ;;
+        --command)
+        COMMAND="$2"
+        shift # past argument
+        shift # past value
+        ;;
+        --ssh-option)
+        SSH_OPTIONS+=(-o "$2")
+        shift # past argument
+        shift # past value
+        ;;
+        *)
+        echo "Unknown argument: $1"
+        return 1
+        ;;
+    esac
+    done
+
+    # Check if all required parameters are set
+    if [[ ( -z "$COMMAND" && -z "$CONTROL" ) || -z "$USER" || -z "$IP" ]]; then
+        echo "Required parameters missing."
+        return 1
+    fi
+
+    # If a PEM file is provided, use it with the -i option
+    if [[ ! -z "$PEM_FILE" ]]; then
+        SSH_OPTIONS+=(-i "$PEM_FILE")
+    fi
+
+    # Start, check or stop a master connection instead of running a command
+    if [[ "$CONTROL" == "start" ]]; then
+        ssh -p "$PORT" "${SSH_OPTIONS[@]}" -M -N -f "${USER}@${IP}"
+        return $?
+    elif [[ ! -z "$CONTROL" ]]; then
+        ssh -p "$PORT" "${SSH_OPTIONS[@]}" -O "$CONTROL" "${USER}@${IP}"
+        return $?
+    fi
+
+    ssh -p "$PORT" "${SSH_OPTIONS[@]}" "${USER}@${IP}" "$COMMAND"
+}
+
+_ssh "$@"
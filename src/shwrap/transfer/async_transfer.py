@@ -0,0 +1,243 @@
+import asyncio
+import inspect
+import os
+import re
+import signal
+from typing import Callable, Optional
+from .transfer import SecureCopyProtocol
+from .logfile import open_log
+from .events import TransferParser, FileFinished, AuthFailed, ConnectionFailed
+
+
+# How much of the output of `scp` is read at a time
+_READ_SIZE = 1 << 16
+
+_LINE_BREAK = re.compile(rb"\r\n|\r|\n")
+
+
+class AsyncSecureCopyProtocol(SecureCopyProtocol):
+    """
+    A call to `scp` that runs on the asyncio event loop instead of blocking
+    the calling thread, so that one loop can drive many transfers at once.
+
+    The parameters are the same as for `SecureCopyProtocol`. Sessions are
+    opened with `async with`. `sync`, `autotune` and `list_remote` are
+    coroutines too, which run the blocking versions on a worker thread.
+
+    Example
+    -------
+    >>> import asyncio
+    >>> from shwrap.transfer import AsyncSecureCopyProtocol
+    >>>
+    >>> async def main():
+    >>>     scp = AsyncSecureCopyProtocol(user, ip, port, pem)
+    >>>     await asyncio.gather(
+    >>>         scp.put("/path/to/folder1", save_path),
+    >>>         scp.put("/path/to/folder2", save_path),
+    >>>     )
+    >>>
+    >>> asyncio.run(main())
+    """
+    async def __aenter__(self):
+        await asyncio.to_thread(self.open)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await asyncio.to_thread(self.close)
+
+    async def put(self,
+                  source_path: str,
+                  save_path: str,
+                  progress: Optional[Callable]=None,
+                  generate_logfile_to: Optional[str]=None):
+        """
+        Send `source_path` to `save_path` on the remote machine.
+
+        Parameters
+        ----------
+        source_path: str
+            Either a path to a file or a folder contating files.
+
+        save_path: str
+            The location on the remote host where you want the files moved to.
+
+        progress: Optional[Callable]=None
+            Called as `progress(current_file, file_size)` for every finished 
+            file. It may be a plain function or a coroutine function. The 
+            typed events are also published to the subscribers added with 
+            `subscribe`.
+
+        generate_logfile_to: Optional[str]=None
+            The path you would like a complete log file of the output of `scp`.
+
+        Cancelling the task kills `scp` before the cancellation is passed on.
+        An Exception is raised if `scp` fails.
+        """
+        await self._transfer(
+            self._path_to_bash('send.sh'), source_path, save_path, progress, 
+            generate_logfile_to
+        )
+
+    async def get(self,
+                  source_path: str,
+                  save_path: str,
+                  progress: Optional[Callable]=None,
+                  generate_logfile_to: Optional[str]=None):
+        """
+        Receive `source_path` from the remote machine into `save_path`. The
+        parameters are the same as for `put`.
+        """
+        await self._transfer(
+            self._path_to_bash('receive.sh'), source_path, save_path, progress,
+            generate_logfile_to
+        )
+
+    async def run(self, command: str):
+        """
+        Run `command` on the remote machine and return what it printed.
+        """
+        p = await asyncio.create_subprocess_exec(
+            *self._ssh_command("--command", command, *self._ssh_options()),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        try:
+            stdout, stderr = await p.communicate()
+        except asyncio.CancelledError:
+            await self._kill(p)
+            raise
+
+        if p.returncode != 0:
+            raise Exception(f"Remote command failed: {stderr.decode().strip()}")
+
+        return stdout.decode()
+
+    async def sync(self, *args, **kwargs):
+        """
+        `SecureCopyProtocol.sync` on a worker thread.
+        """
+        return await asyncio.to_thread(super().sync, *args, **kwargs)
+
+    async def autotune(self, *args, **kwargs):
+        """
+        `SecureCopyProtocol.autotune` on a worker thread.
+        """
+        return await asyncio.to_thread(super().autotune, *args, **kwargs)
+
+    async def list_remote(self, *args, **kwargs):
+        """
+        `SecureCopyProtocol.list_remote` on a worker thread.
+        """
+        return await asyncio.to_thread(super().list_remote, *args, **kwargs)
+
+    async def _transfer(self, path_to_bash, source_path, save_path, progress, 
+                        generate_logfile_to):
+        """
+        Run `send.sh` or `receive.sh` and follow its output without blocking.
+        """
+        with self.job.active():
+            # waiting for a turn under the cap must not block the loop
+            reservation = await asyncio.to_thread(self.job.reserve)
+            with reservation:
+                command = self._scp_command(
+                    path_to_bash, [source_path], save_path, 
+                    scp_options=self._limit_options(reservation.rate)
+                )
+                await self._follow_async(command, progress, generate_logfile_to)
+
+    async def _follow_async(self, command, progress, generate_logfile_to):
+        """
+        Run `command` and follow its output without blocking.
+        """
+        p = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+
+        # darwin runs scp under `script`, which puts everything on stdout
+        if self._system == "Darwin":
+            stream, other = p.stdout, p.stderr
+        else:
+            stream, other = p.stderr, p.stdout
+
+        drain = asyncio.ensure_future(other.read())
+        parser = TransferParser(self._system)
+        message = None
+
+        async def handle(events):
+            nonlocal message
+            for event in events:
+                self._publish(event)
+                if isinstance(event, FileFinished) and progress is not None:
+                    result = progress(event.name, event.size)
+                    if inspect.isawaitable(result):
+                        await result
+                elif isinstance(event, AuthFailed):
+                    message = "Permission denied. Check the pem file."
+                elif isinstance(event, ConnectionFailed) and message is None:
+                    message = event.message
+
+        log = open_log(generate_logfile_to, self.log_max_bytes)
+        try:
+            async for raw_line in _read_lines(stream):
+                line = raw_line.decode(errors="replace")
+                await handle(parser.feed(line))
+
+                if log is not None:
+                    log.write(line + "\n")
+
+            await drain
+            await p.wait()
+            await handle(parser.close(p.returncode == 0))
+
+        except asyncio.CancelledError:
+            drain.cancel()
+            await self._kill(p)
+            raise
+
+        finally:
+            if log is not None:
+                log.close()
+
+        if message is None and p.returncode != 0:
+            message = f"scp exited with status {p.returncode}"
+        if message is not None:
+            raise Exception(message)
+
+    @staticmethod
+    async def _kill(p):
+        """
+        Kill the bash script together with the `scp` or `ssh` it started.
+        """
+        try:
+            os.killpg(p.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        await p.wait()
+
+
+async def _read_lines(stream):
+    """
+    Yield the lines of `stream` without their line breaks, splitting at the
+    carriage returns that progress meters redraw themselves with, so that no
+    line grows past the limit of `StreamReader.readline`.
+    """
+    pending = b""
+    while True:
+        chunk = await stream.read(_READ_SIZE)
+        if not chunk:
+            break
+        pending += chunk
+        # a "\r" at the end may be the first half of a "\r\n"
+        cut = len(pending) - 1 if pending.endswith(b"\r") else len(pending)
+        *lines, rest = _LINE_BREAK.split(pending[:cut])
+        pending = rest + pending[cut:]
+        for line in lines:
+            yield line
+    if pending.rstrip(b"\r"):
+        yield pending.rstrip(b"\r")
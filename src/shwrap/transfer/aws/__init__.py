@@ -1 +1,5 @@
-from .aws import cp_recursive, sync, fast_upload, fast_download
+from .aws import cp_recursive, sync, fast_sync, fast_upload, fast_download
+from .session import S3TransferSession
+from .manifest import Manifest
+from .shards import ShardReader
+from .tuning import TransferTuner
@@ -1,12 +1,13 @@
 import subprocess
 import os
-from typing import Optional
-import botocore
+from typing import Callable, Iterable, Optional, Union
 import boto3
-import boto3.s3.transfer as s3transfer
 from tqdm import tqdm
 from platform import system
 import importlib.resources as pkg
+from ..logfile import open_log
+from .manifest import Manifest
+from .session import S3TransferSession
 
 
 def cp_recursive(
@@ -14,6 +15,7 @@ def cp_recursive(
     save_dir: str,
     profile: str,
     generate_logfile_to: Optional[str]=None,
+    log_max_bytes: Optional[int]=None,
     ):
 
     """
@@ -37,6 +39,10 @@ def cp_recursive(
         output of the `aws s3 cp` function. If None, then no log file will be 
         generated
 
+    log_max_bytes: Optional[int]=None
+        Rotate the log file once it would grow past this many bytes, keeping
+        the last one as `.1`.
+
     Returns
     -------
     None
@@ -65,6 +71,7 @@ def cp_recursive(
     else:
         raise Exception("Operating system in not supported")
 
+    log = open_log(generate_logfile_to, log_max_bytes)
     try:
         # Call the Bash script with specified parameters
         with subprocess.Popen(
@@ -99,9 +106,8 @@ def cp_recursive(
                     print('\033[1A', end='\x1b[2K')
                     print('\033[1A', end='\x1b[2K')
 
-                if generate_logfile_to is not None:
-                    with open(generate_logfile_to, "a") as log:
-                        _ = log.write(line + "\n")
+                if log is not None:
+                    log.write(line + "\n")
 
     except subprocess.CalledProcessError as e:
         print(f"Error calling the Bash script: {e}")
@@ -109,6 +115,10 @@ def cp_recursive(
     except FileNotFoundError as e:
         print(f"Bash script not found: {e}")
 
+    finally:
+        if log is not None:
+            log.close()
+
     return None
 
 
@@ -117,13 +127,21 @@ def sync(
     save_dir: str,
     profile: str,
     generate_logfile_to: Optional[str]=None,
+    delete: bool=False,
+    dry_run: bool=False,
+    checksum: bool=False,
+    workers: int=20,
+    manifest: Optional[str]=None,
+    trusted: bool=False,
+    log_max_bytes: Optional[int]=None,
     ):
 
     """
-    A python function that calls a bash function that applies 
-    aws s3 cp --recurisve on a whole local directory. According to the internet
-    aws s3 cp is faster aws s3 sync and I believe both of these are faster than
-    using boto3 functions directly to move files from local to s3.
+    Make a folder in a bucket a copy of a local directory, like 
+    `aws s3 sync`, with boto3 instead of the aws cli. The remote listing is 
+    paged concurrently, compared with one scan of the local directory on size 
+    and modification time (or ETag, with `checksum`) and only the files that
+    are missing or differ are uploaded.
 
     Parameters
     ----------
@@ -132,24 +150,45 @@ def sync(
         moved.
 
     save_dir: str
-        Full path of the dir being saved to.
+        Full path of the dir being saved to, for example 
+        "s3://celeba-demo-bucket/imgs".
 
     profile: str
         The name of the profile that is configured with aws configure
 
     generate_log_file: str, default None
-        The full path to where a log file will be created give the full stdout
-        output of the `aws s3 sync` function. If None, then no log file will be 
-        generated
+        The full path to where a log file will be created with an 
+        "upload: ..." or "delete: ..." line for each file, written as soon as
+        the file is done, or an "upload failed: ..." or "delete failed: ..."
+        line with the error. If None, then no log file will be generated
+
+    delete: bool, default=False
+        Also delete the objects in `save_dir` that have no local file.
+
+    dry_run: bool, default=False
+        Only print what would be uploaded and deleted.
+
+    checksum: bool, default=False
+        Compare files of equal size by ETag instead of by modification time.
+
+    workers: int, default=20
+        The number of concurrent listings and uploads.
 
-    path_to_bash: Optional[str]=None
-        The path to the underlying bash script being called. If None then it 
-        assumes that the `pyaws` module is located where python looks for the libraries,
-        ie in the same folder that `pip show pip | awk '/Location/ {print $2}'`.
+    manifest: Optional[str]=None
+        The path of a `Manifest` that records what was uploaded, so that later
+        syncs only check a sample of objects instead of listing the bucket.
+
+    trusted: bool, default=False
+        Trust the manifest without checking it against the bucket.
+
+    log_max_bytes: Optional[int]=None
+        Rotate the log file once it would grow past this many bytes, keeping
+        the last one as `.1`.
 
     Returns
     -------
-    None
+    dict
+        The plan, see `S3TransferSession.sync`.
     
     Example
     -------
@@ -168,71 +207,117 @@ def sync(
 
     """
 
-    if system() == "Linux":
-        path_to_bash = None
-        with pkg.path('shwrap.transfer.aws._scripts.linux', 'awssync.sh') as p:
-            path_to_bash = str(p)
-    else:
-        raise Exception("Operating system in not supported")
-    
+    if not save_dir.startswith("s3://"):
+        raise Exception("save_dir must be of the form s3://<bucket>/<dir>")
+    bucketname, _, s3dir = save_dir[len("s3://"):].partition("/")
 
-    try:
-        # Call the Bash script with specified parameters
-        with subprocess.Popen(
-            [
-                path_to_bash, 
-                "--source-dir", 
-                source_dir, 
-                "--save-dir", 
-                save_dir, 
-                "--profile", 
-                profile, 
-            ],
-            stdout=subprocess.PIPE,
-            bufsize=1,
-            universal_newlines=True
-        ) as p:
+    prefix = f"s3://{bucketname}/{s3dir.rstrip('/') + '/' if s3dir else ''}"
+    failures = []
 
-            last_status = "None"
-            last_file_uploaded = "None"
-            for i, line in enumerate(p.stdout):
-                line = line[:-1]
+    def describe(action, rel_path):
+        if action == "upload":
+            return f"{os.path.join(source_dir, rel_path)} to {prefix}{rel_path}"
+        return f"{prefix}{rel_path}"
 
-                if line.startswith("Completed"):
-                    last_status = line
-                    output = f"{last_status}\n{last_file_uploaded}"
-                    print(f"{output}")
-                    print('\033[1A', end='\x1b[2K')
-                    print('\033[1A', end='\x1b[2K')
-                    
-                else:
-                    last_file_uploaded = line
-                    output = f"{last_status}\n{last_file_uploaded}"
-                    print(f"{output}")
-                    print('\033[1A', end='\x1b[2K')
-                    print('\033[1A', end='\x1b[2K')
+    log = open_log(generate_logfile_to, log_max_bytes)
+    try:
+        # every file is logged as soon as it is done, and failures are also
+        # printed right away
+        def on_done(action, rel_path, error):
+            if error is None:
+                line = f"{action}: {describe(action, rel_path)}"
+            else:
+                line = f"{action} failed: {describe(action, rel_path)} {error}"
+                failures.append(line)
+                tqdm.write(line)
+            if log is not None:
+                log.write(line + "\n")
+
+        session = boto3.Session(profile_name=profile)
+        with tqdm(desc='sync', ncols=60, unit='B', unit_scale=1) as pbar:
+            plan = fast_sync(
+                session, source_dir, bucketname, s3dir, pbar,
+                workers=workers, delete=delete, dry_run=dry_run, 
+                checksum=checksum, manifest=manifest, trusted=trusted, 
+                on_done=on_done
+            )
 
-                if generate_logfile_to is not None:
-                    with open(generate_logfile_to, "a") as log:
-                        _ = log.write(line + "\n")
+        changes = plan["new"] + plan["changed"]
+        if dry_run:
+            lines = [
+                f"(dryrun) upload: {describe('upload', rel_path)}" 
+                for rel_path in changes
+            ]
+            if delete:
+                lines += [
+                    f"(dryrun) delete: {describe('delete', rel_path)}" 
+                    for rel_path in plan["remote_only"]
+                ]
+            for line in lines:
+                if log is not None:
+                    log.write(line + "\n")
+    finally:
+        if log is not None:
+            log.close()
+
+    num_changes = len(changes) + (len(plan["remote_only"]) if delete else 0)
+    print(
+        f"\n \n {num_changes} changes, {len(failures)} failed, "
+        f"{len(plan['unchanged'])} files up to date"
+    )
+    return plan
 
 
-    except subprocess.CalledProcessError as e:
-        print(f"Error calling the Bash script: {e}")
+def fast_sync(
+    session: boto3.Session, 
+    source_dir: str, 
+    bucketname: str, 
+    s3dir: str, 
+    progress_func: Optional[tqdm]=None, 
+    workers: int=20,
+    delete: bool=False,
+    dry_run: bool=False,
+    checksum: bool=False,
+    manifest: Optional[Union[str, Manifest]]=None,
+    trusted: bool=False,
+    weight: float=1.0,
+    priority: int=0,
+    on_done: Optional[Callable]=None,
+    ):
+    """
+    Sync the local folder `source_dir` to `s3dir` in the bucket `bucketname`
+    and return the plan. This is `S3TransferSession.sync` on a session of its
+    own, see there for the parameters.
 
-    except FileNotFoundError as e:
-        print(f"Bash script not found: {e}")
+    Example
+    -------
+    >>> with tqdm(desc='sync', unit='B', unit_scale=1) as pbar:
+    >>>     plan = fast_sync(session, source_dir, bucketname, "imgs", pbar)
+    """
 
-    return None
+    with S3TransferSession(session, workers, weight, priority) as s3:
+        return s3.sync(
+            source_dir, bucketname, s3dir, progress_func, 
+            delete=delete, dry_run=dry_run, checksum=checksum,
+            manifest=manifest, trusted=trusted, on_done=on_done
+        )
 
 
 def fast_upload(
     session: boto3.Session, 
     bucketname: str, 
     s3dir: str, 
-    filelist: list, 
+    filelist: Union[str, Iterable[str]], 
     progress_func: tqdm, 
     workers: int=20,
+    weight: float=1.0,
+    priority: int=0,
+    verify: bool=False,
+    root: Optional[str]=None,
+    max_in_flight: Optional[int]=None,
+    pack: bool=False,
+    shard_size: int=256 << 20,
+    adaptive: bool=False,
     ):
     """
     This is a uploder that can be used to move all files within a folder to a 
@@ -250,16 +335,55 @@ def fast_upload(
     s3dir: str
         the folder path within the bucket
     filelist:
-        list of local files to be moved to the bucket
+        the local files to be moved to the bucket, as a list or any iterable,
+        which is read lazily as uploads finish, or a folder, all of whose 
+        files are uploaded with their paths relative to it
     progress_func: tqdm
         An instance of a tqdm class
     workers: int
         The number of workers to work in parallel and move the data to AWS
+    weight: float
+        The share of the process wide cap of 
+        `shwrap.transfer.ratelimit.limiter` that this upload gets, relative 
+        to the other running jobs of the same priority
+    priority: int
+        Jobs of a higher priority are served first under the cap
+    verify: bool
+        Have every file checked by S3. botocore computes the sha256 of each 
+        part while reading it for the upload and S3 rejects any part whose
+        bytes do not match it, so no second read of the files is needed. 
+        Files that failed are reported and uploaded once more.
+    root: Optional[str]
+        Keys are `s3dir/<path relative to root>`, so nested folders keep 
+        their structure. When `filelist` is a folder it is the default 
+        root, otherwise keys are `s3dir/<file name>`
+    max_in_flight: Optional[int]
+        The most uploads handed to the transfer manager at once, by default 
+        8 per worker. The next file is only taken from `filelist` once an 
+        upload finishes, so memory stays flat however many files there are
+    pack: bool
+        Pack the files into tar shards of about `shard_size` bytes, each with
+        a sidecar index, instead of uploading them one by one, which saves a
+        PUT request per file. Read them back with `ShardReader`. With `pack`,
+        `max_in_flight` counts shards and defaults to 4
+    shard_size: int
+        The size of the shards with `pack`, 256 MiB by default
+    adaptive: bool
+        The multipart threshold, part size and I/O queue of every file are
+        chosen from its size. With `adaptive` they are also adjusted to the
+        throughput measured during the upload, see `TransferTuner`
+
+    Returns
+    -------
+    Optional[list]
+        With `verify`, the files that could not be uploaded intact, else None.
+        With `pack`, the names of the files in shards that failed
 
     Example
     -------
     >>> from tqdm import tqdm
     >>> import pyaws
+    >>> from shwrap.transfer.utils import scan_tree
     >>> import os
     >>> import time
     >>> import os
@@ -281,9 +405,9 @@ def fast_upload(
     >>> )
     >>> bucketname = 'celeba-demo-bucket'
     >>> s3dir = 'imgs'
-    >>> filelist = [os.path.join(source_dir, f) for f in os.listdir(source_dir)]
-    >>> totalsize = sum([os.stat(f).st_size for f in filelist])
+    >>> totalsize = sum(entry.size for entry in scan_tree(source_dir))
     >>> 
+    >>> # the folder is read as the upload goes and keeps its structure
     >>> with tqdm(
     >>>     desc='upload', ncols=60, total=totalsize, unit='B', unit_scale=1
     >>> ) as pbar:
@@ -291,37 +415,37 @@ def fast_upload(
                 session, 
                 bucketname, 
                 s3dir, 
-                filelist, 
+                source_dir, 
                 pbar, 
                 workers=50
             )
     """
 
-    botocore_config = botocore.config.Config(max_pool_connections=workers)
-    s3client = session.client('s3', config=botocore_config)
-    transfer_config = s3transfer.TransferConfig(
-        use_threads=True,
-        max_concurrency=workers,
-    )
-    s3t = s3transfer.create_transfer_manager(s3client, transfer_config)
-    for src in filelist:
-        dst = os.path.join(s3dir, os.path.basename(src))
-        s3t.upload(
-            src, bucketname, dst,
-            subscribers=[
-                s3transfer.ProgressCallbackInvoker(progress_func.update),
-            ],
+    with S3TransferSession(session, workers, weight, priority, adaptive) as s3:
+        if pack:
+            return s3.upload_shards(
+                bucketname, s3dir, filelist, progress_func, root=root, 
+                shard_size=shard_size, verify=verify, 
+                max_in_flight=max_in_flight
+            )
+        return s3.upload(
+            bucketname, s3dir, filelist, progress_func, root=root, 
+            verify=verify, max_in_flight=max_in_flight
         )
-    s3t.shutdown()  # wait for all the upload tasks to finish
 
 
 def fast_download(
     session: boto3.Session, 
     bucketname: str, 
-    keylist: list, 
+    keylist: Union[str, Iterable[str]], 
     localdir: str, 
     progress_func: tqdm, 
     workers: int=20,
+    weight: float=1.0,
+    priority: int=0,
+    root: Optional[str]=None,
+    max_in_flight: Optional[int]=None,
+    adaptive: bool=False,
     ):
     """
     This is a downloader that can be used to move all files within a folder 
@@ -336,12 +460,27 @@ def fast_download(
     session: boto3.Session
     bucketname: str
         Just the name of the bucket, not the full bucket path 
-    keylist: list
-        list of keys from the s3 bucket to be moved to the local computer
+    keylist:
+        the keys from the s3 bucket to be moved to the local computer, as a
+        list or any iterable, or a prefix, all of whose keys are downloaded 
+        with their paths relative to it. A prefix is listed in parallel, one
+        folder per worker, and the downloads start while it is listed
     progress_func: tqdm
         An instance of a tqdm class
     workers: int
         The number of workers to work in parallel and move the data to AWS
+    weight: float
+        The same as for `fast_upload`
+    priority: int
+        The same as for `fast_upload`
+    root: Optional[str]
+        keep the path of each key relative to this prefix below `localdir`,
+        making the folders as needed, instead of only its basename
+    max_in_flight: Optional[int]
+        The same as for `fast_upload`
+    adaptive: bool
+        The same as for `fast_upload`. The part sizes can only be chosen for
+        keys listed from a prefix, whose sizes are known
 
     Example
     -------
@@ -393,21 +532,14 @@ def fast_download(
     >>>         pbar, 
     >>>         workers=50
     >>>    )
+    >>>
+    >>> # or everything below "imgs/", keeping its folders
+    >>> with tqdm(desc='download', unit='B', unit_scale=1) as pbar:
+    >>>     fast_download(session, bucketname, "imgs", localdir, pbar)
     """
 
-    botocore_config = botocore.config.Config(max_pool_connections=workers)
-    s3client = session.client('s3', config=botocore_config)
-    transfer_config = s3transfer.TransferConfig(
-        use_threads=True,
-        max_concurrency=workers,
-    )
-    s3t = s3transfer.create_transfer_manager(s3client, transfer_config)
-    for src in keylist:
-        dst = os.path.join(localdir, os.path.basename(src))
-        s3t.download(
-            bucketname, src, dst,
-            subscribers=[
-                s3transfer.ProgressCallbackInvoker(progress_func.update),
-            ],
+    with S3TransferSession(session, workers, weight, priority, adaptive) as s3:
+        s3.download(
+            bucketname, keylist, localdir, progress_func, 
+            root=root, max_in_flight=max_in_flight
         )
-    s3t.shutdown()  # wait for all the upload tasks to finish
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+from typing import Optional
+
+
+class Manifest:
+    """
+    A local record of what `S3TransferSession.sync` last uploaded, so that a
+    later sync can diff against it instead of listing the bucket, and a cache
+    of the ETags computed from local files, so that a file is only hashed
+    again once it changes.
+
+    The file is append only and every line is flushed as it is written, like
+    `shwrap.transfer.journal.Journal`. Each line is a json object, either an
+    uploaded object with the `bucket`, `key`, `size`, the local `mtime` at
+    upload and the `etag` when it is known, a removed object with `bucket`,
+    `key` and `deleted`, or a computed ETag with the local `path`, `size`,
+    `mtime` and `etag`. Later lines win, and a line cut short by an
+    interruption is ignored. The file is rewritten without the stale lines
+    when they make up more than half of it.
+
+    Parameters
+    ----------
+    path: str
+        Where the manifest is kept. It is created if it does not exist.
+
+    Example
+    -------
+    >>> with Manifest("/home/nicholas/.shwrap/celeba.manifest") as manifest:
+    >>>     s3.sync(source_dir, bucketname, "imgs", manifest=manifest)
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._objects = {}
+        self._etags = {}
+
+        lines = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._load(entry)
+                    lines += 1
+
+        self._lock = threading.Lock()
+        self._file = None
+        if lines > 2 * len(self):
+            self.compact()
+        else:
+            self._file = open(path, "a")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return (
+            sum(len(objects) for objects in self._objects.values())
+            + len(self._etags)
+        )
+
+    def _load(self, entry):
+        if "key" in entry:
+            objects = self._objects.setdefault(entry["bucket"], {})
+            if entry.get("deleted"):
+                objects.pop(entry["key"], None)
+            else:
+                objects[entry["key"]] = (
+                    entry["size"], entry["mtime"], entry.get("etag")
+                )
+        else:
+            self._etags[entry["path"]] = (
+                entry["size"], entry["mtime"], entry["etag"]
+            )
+
+    def _write(self, entry):
+        # the caller holds `self._lock`
+        self._load(entry)
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def objects(self, bucketname: str, prefix: str = ""):
+        """
+        The recorded objects of `bucketname` below `prefix`, by the rest of
+        their key, each as a dict with the "Size", the local "mtime" at upload
+        and the "ETag", which is None when it is not known.
+        """
+        with self._lock:
+            items = list(self._objects.get(bucketname, {}).items())
+        return {
+            key[len(prefix):]: {"Size": size, "mtime": mtime, "ETag": etag}
+            for key, (size, mtime, etag) in items
+            if key.startswith(prefix)
+        }
+
+    def record(self, bucketname: str, key: str, size: int, mtime: float,
+               etag: Optional[str]=None):
+        """
+        Record that a local file of `size` bytes and modification time
+        `mtime` was uploaded to `key`.
+        """
+        with self._lock:
+            if self._objects.get(bucketname, {}).get(key) == (size, mtime, etag):
+                return None
+            self._write({
+                "bucket": bucketname, "key": key,
+                "size": size, "mtime": mtime, "etag": etag
+            })
+        return None
+
+    def forget(self, bucketname: str, key: str):
+        """
+        Record that `key` no longer exists.
+        """
+        with self._lock:
+            if key not in self._objects.get(bucketname, {}):
+                return None
+            self._write({"bucket": bucketname, "key": key, "deleted": True})
+        return None
+
+    def etag(self, path: str, size: int, mtime: float):
+        """
+        The ETag computed from the local file `path` when it had this `size`
+        and `mtime`, or None.
+        """
+        with self._lock:
+            cached = self._etags.get(os.path.abspath(path))
+        if cached is None or cached[:2] != (size, mtime):
+            return None
+        return cached[2]
+
+    def record_etag(self, path: str, size: int, mtime: float, etag: str):
+        """
+        Cache the ETag computed from the local file `path`.
+        """
+        with self._lock:
+            self._write({
+                "path": os.path.abspath(path),
+                "size": size, "mtime": mtime, "etag": etag
+            })
+        return None
+
+    def compact(self):
+        """
+        Rewrite the file with one line per object and per cached ETag.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for bucketname, objects in self._objects.items():
+                    for key, (size, mtime, etag) in objects.items():
+                        f.write(json.dumps({
+                            "bucket": bucketname, "key": key,
+                            "size": size, "mtime": mtime, "etag": etag
+                        }) + "\n")
+                for path, (size, mtime, etag) in self._etags.items():
+                    f.write(json.dumps({
+                        "path": path, "size": size, "mtime": mtime, "etag": etag
+                    }) + "\n")
+            os.replace(tmp_path, self.path)
+
+            self._file = open(self.path, "a")
+        return None
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+        return None
@@ -0,0 +1,922 @@
+import json
+import os
+import posixpath
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional, Union
+import botocore
+import boto3
+import boto3.s3.transfer as s3transfer
+from s3transfer.futures import (
+    IN_MEMORY_DOWNLOAD_TAG, IN_MEMORY_UPLOAD_TAG, BoundedExecutor
+)
+from s3transfer.manager import TransferManager
+from s3transfer.utils import SlidingWindowSemaphore, TaskSemaphore
+from tqdm import tqdm
+from ..ratelimit import limiter
+from ..utils import scan_tree, s3_etag
+from .manifest import Manifest
+from .shards import _INDEX_SUFFIX, _SHARD_SIZE, pack, shard_key
+from .tuning import TransferTuner
+
+
+# How many of the objects in a manifest are checked against the bucket before
+# a sync trusts it instead of listing
+_CHECK_SAMPLE = 64
+
+# How many listed pages may wait for the consumer of a listing
+_LISTING_QUEUE = 64
+
+
+class S3TransferSession:
+    """
+    A long lived S3 client, connection pool and transfer managers that many
+    uploads, downloads and syncs reuse, so that only the first call pays for
+    the TLS handshakes and for starting the worker threads. One session may
+    be shared by any number of threads.
+
+    The multipart threshold, part size and I/O queue of every object are
+    chosen from its size by `self.tuner`, a `TransferTuner`, and there is a
+    transfer manager for each distinct choice. The managers send their
+    requests through one shared pool of `workers` threads, so that the
+    number of connections stays bounded however many of them are in use.
+
+    Parameters
+    ----------
+    session: boto3.Session
+        The boto3 session the client is made from.
+
+    workers: int, default=20
+        The number of connections in the pool and of transfer threads,
+        shared by every call.
+
+    weight: float, default=1.0
+        The share of the process wide cap of
+        `shwrap.transfer.ratelimit.limiter` that the transfers of this
+        session get, relative to the other running jobs of the same priority.
+
+    priority: int, default=0
+        Jobs of a higher priority are served first under the cap.
+
+    adaptive: bool, default=False
+        Also adjust the part sizes to the throughput measured while the
+        session runs.
+
+    Example
+    -------
+    >>> import boto3
+    >>> from shwrap.transfer.aws import S3TransferSession
+    >>>
+    >>> with S3TransferSession(boto3.Session(profile_name="nick")) as s3:
+    >>>     for batch in batches:
+    >>>         s3.upload("celeba-demo-bucket", "imgs", batch)
+    """
+    def __init__(self, session: boto3.Session, workers: int = 20,
+                 weight: float = 1.0, priority: int = 0, 
+                 adaptive: bool = False):
+        self.workers = workers
+
+        # the submission threads also make a request each, to start an upload
+        defaults = s3transfer.TransferConfig(max_concurrency=workers)
+        botocore_config = botocore.config.Config(
+            max_pool_connections=workers + defaults.max_submission_concurrency
+        )
+        self.client = session.client('s3', config=botocore_config)
+        self.tuner = TransferTuner(workers, adaptive)
+        self._managers = {}
+        self._request_executor = _SharedExecutor(
+            max_size=defaults.max_request_queue_size,
+            max_num_threads=workers,
+            tag_semaphores={
+                IN_MEMORY_UPLOAD_TAG: TaskSemaphore(
+                    defaults.max_in_memory_upload_chunks
+                ),
+                IN_MEMORY_DOWNLOAD_TAG: SlidingWindowSemaphore(
+                    defaults.max_in_memory_download_chunks
+                ),
+            },
+        )
+        self._submission_executor = _SharedExecutor(
+            max_size=defaults.max_submission_queue_size,
+            max_num_threads=defaults.max_submission_concurrency,
+        )
+        self.job = limiter.job("s3", weight, priority)
+
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        """
+        Wait for every transfer of the session and stop its threads.
+        Closing a closed session does nothing.
+        """
+        with self._lock:
+            if self._closed:
+                return None
+            self._closed = True
+            managers = list(self._managers.values())
+        for manager in managers:
+            manager.shutdown()
+        self._submission_executor.close()
+        self._request_executor.close()
+        return None
+
+    def upload(self,
+               bucketname: str,
+               s3dir: str,
+               filelist: Union[str, Iterable[str]],
+               progress_func: Optional[tqdm]=None,
+               root: Optional[str]=None,
+               verify: bool = False,
+               max_in_flight: Optional[int]=None):
+        """
+        Upload files to `s3dir` in the bucket `bucketname` and wait for them.
+        The parameters are the same as for `fast_upload`.
+
+        Returns
+        -------
+        Optional[list]
+            With `verify`, the files that could not be uploaded intact, else
+            None.
+        """
+        self._check_open()
+        extra_args = {"ChecksumAlgorithm": "SHA256"} if verify else None
+
+        # the sizes of scanned files come from the scan, and are dropped 
+        # once their upload starts
+        sizes = {}
+        if isinstance(filelist, str):
+            if root is None:
+                root = filelist
+
+            def scanned(folder):
+                for entry in scan_tree(folder):
+                    sizes[entry.path] = entry.size
+                    yield entry.path
+
+            filelist = scanned(filelist)
+
+        def upload(src, subscribers):
+            dst = posixpath.join(s3dir, _name(src, root))
+            size = sizes.pop(src, None)
+            if size is None:
+                size = os.path.getsize(src)
+            manager, extra = self._transfer(size, progress_func)
+            return manager.upload(
+                src, bucketname, dst, extra_args=extra_args,
+                subscribers=extra + subscribers,
+            )
+
+        max_in_flight = max_in_flight or 8 * self.workers
+        with self.job.active():
+            failed = _submit_bounded(upload, filelist, max_in_flight)
+            if verify and failed:
+                print(f"\n \n Uploading {len(failed)} files again")
+                failed = _submit_bounded(
+                    upload, [src for src, _ in failed], max_in_flight
+                )
+
+        if not verify:
+            return None
+
+        for src, error in failed:
+            print(f"\n \n {src}: {error}")
+        return [src for src, _ in failed]
+
+    def upload_shards(self,
+                      bucketname: str,
+                      s3dir: str,
+                      filelist: Union[str, Iterable[str]],
+                      progress_func: Optional[tqdm]=None,
+                      root: Optional[str]=None,
+                      shard_size: int = _SHARD_SIZE,
+                      verify: bool = False,
+                      max_in_flight: Optional[int]=None):
+        """
+        Pack the files into uncompressed tar shards of about `shard_size` 
+        bytes and upload them to `s3dir` in the bucket `bucketname`, which 
+        should be empty. Each shard is followed by a sidecar index of the 
+        offsets of its files, so that `ShardReader` can fetch a single file 
+        with a ranged GET. The shards are packed in the temporary folder, with
+        at most `max_in_flight` (4 by default) of them on disk at a time.
+        The other parameters are the same as for `fast_upload`, and the 
+        files are named in the shards as they would be keyed by it.
+
+        Returns
+        -------
+        list
+            The names of the files in the shards that could not be uploaded.
+        """
+        self._check_open()
+        extra_args = {"ChecksumAlgorithm": "SHA256"} if verify else None
+
+        if isinstance(filelist, str):
+            if root is None:
+                root = filelist
+            filelist = (entry.path for entry in scan_tree(filelist, stat=False))
+
+        shards = (
+            (tar_path, shard_key(s3dir, number), index)
+            for number, (tar_path, index) in enumerate(
+                pack(((src, _name(src, root)) for src in filelist), shard_size)
+            )
+        )
+
+        def upload(shard, subscribers):
+            tar_path, key, _ = shard
+            manager, extra = self._transfer(
+                os.path.getsize(tar_path), progress_func
+            )
+            return manager.upload(
+                tar_path, bucketname, key, extra_args=extra_args,
+                # the shard is removed before its slot is given back
+                subscribers=(
+                    extra + [_RemoveSubscriber(tar_path)] + subscribers
+                ),
+            )
+
+        def uploaded(shard):
+            _, key, index = shard
+            self.client.put_object(
+                Bucket=bucketname, Key=key + _INDEX_SUFFIX,
+                Body=json.dumps(index).encode(),
+            )
+
+        with self.job.active():
+            failed = _submit_bounded(
+                upload, shards, max_in_flight or 4, uploaded
+            )
+
+        for (_, key, _), error in failed:
+            print(f"\n \n {key}: {error}")
+        return [name for (_, _, index), _ in failed for name in index]
+
+    def download(self,
+                 bucketname: str,
+                 keylist: Union[str, Iterable[str]],
+                 localdir: str,
+                 progress_func: Optional[tqdm]=None,
+                 root: Optional[str]=None,
+                 max_in_flight: Optional[int]=None):
+        """
+        Download the keys of `keylist` from the bucket `bucketname` into
+        `localdir` and wait for them. The parameters are the same as for
+        `fast_download`.
+
+        Returns
+        -------
+        list
+            `(key, error)` for each key that could not be downloaded.
+        """
+        self._check_open()
+
+        if isinstance(keylist, str):
+            prefix = keylist.rstrip("/") + "/" if keylist else ""
+            if root is None:
+                root = prefix
+            # the listing has the sizes and ETags, which saves a HEAD 
+            # request per key
+            keys = (
+                (obj["Key"], obj["Size"], obj["ETag"]) 
+                for obj in self._iter_objects(bucketname, prefix)
+                if not obj["Key"].endswith("/")
+            )
+        else:
+            keys = ((key, None, None) for key in keylist)
+
+        localdir = os.path.abspath(localdir)
+
+        def download(item, subscribers):
+            key, size, etag = item
+            if root is None:
+                dst = os.path.join(localdir, os.path.basename(key))
+            else:
+                rel_path = posixpath.relpath(key, root.rstrip("/") or ".")
+                dst = os.path.normpath(
+                    os.path.join(localdir, *rel_path.split("/"))
+                )
+                if not dst.startswith(localdir + os.sep):
+                    raise Exception(f"{key} is not below {root}")
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            manager, extra = self._transfer(size, progress_func, etag)
+            return manager.download(
+                bucketname, key, dst, subscribers=extra + subscribers,
+            )
+
+        with self.job.active():
+            failed = _submit_bounded(
+                download, keys, max_in_flight or 8 * self.workers
+            )
+        return [(key, error) for (key, _, _), error in failed]
+
+    def sync(self,
+             source_dir: str,
+             bucketname: str,
+             s3dir: str,
+             progress_func: Optional[tqdm]=None,
+             delete: bool = False,
+             dry_run: bool = False,
+             checksum: bool = False,
+             manifest: Optional[Union[str, Manifest]]=None,
+             trusted: bool = False,
+             max_in_flight: Optional[int]=None,
+             on_done: Optional[Callable]=None):
+        """
+        Make `s3dir` in the bucket `bucketname` a copy of the local folder 
+        `source_dir`. The remote listing is paged on several threads and 
+        compared with one scan of the local folder, and only the files that
+        are missing or differ are uploaded, keeping the structure of the 
+        folder in the keys.
+
+        Parameters
+        ----------
+        source_dir: str
+            The local folder to sync.
+
+        bucketname: str
+            Just the name of the bucket, not the full bucket path.
+
+        s3dir: str
+            The folder path within the bucket.
+
+        progress_func: Optional[tqdm]=None
+            An instance of a tqdm class, updated with the uploaded bytes. If
+            it has no total, the total is set to the bytes to upload once 
+            they are known.
+
+        delete: bool, default=False
+            Also delete the objects below `s3dir` that have no local file.
+
+        dry_run: bool, default=False
+            Only work out the plan, nothing is uploaded or deleted.
+
+        checksum: bool, default=False
+            Compare files of equal size by their ETag, computed from the 
+            local file the way S3 does, instead of by modification time.
+
+        manifest: Optional[Union[str, Manifest]]=None
+            A `Manifest`, or the path of one, that records what was uploaded
+            and caches the ETags of local files. When it has objects below 
+            `s3dir`, a sample of them is checked with HEAD requests and, if 
+            they match, the sync diffs against the manifest instead of listing
+            the bucket. Otherwise the bucket is listed and the manifest is 
+            brought up to date.
+
+        trusted: bool, default=False
+            Diff against the manifest without checking it against the bucket 
+            at all. Only use this when nothing else writes below `s3dir`.
+
+        max_in_flight: Optional[int]=None
+            The same as for `upload`.
+
+        on_done: Optional[Callable]=None
+            Called as `on_done(action, rel_path, error)` as soon as each 
+            upload or deletion is finished, where `action` is "upload" or 
+            "delete" and `error` is None unless it failed. It may be called 
+            from several threads at once.
+
+        Returns
+        -------
+        dict
+            The plan. "new" and "changed" hold the relative paths that are 
+            (or would be) uploaded, "unchanged" the ones that are skipped and
+            "remote_only" the ones that only exist in the bucket, which are 
+            deleted with `delete`.
+
+        Example
+        -------
+        >>> with S3TransferSession(session) as s3:
+        >>>     plan = s3.sync(source_dir, bucketname, "imgs", dry_run=True)
+        >>>     print(len(plan["new"]) + len(plan["changed"]), "to upload")
+        >>>     s3.sync(source_dir, bucketname, "imgs", delete=True)
+        >>>
+        >>> # hourly, without listing the bucket
+        >>> s3.sync(source_dir, bucketname, "imgs", manifest="imgs.manifest")
+        """
+        self._check_open()
+        if isinstance(manifest, str):
+            with Manifest(manifest) as opened:
+                return self.sync(
+                    source_dir, bucketname, s3dir, progress_func, delete, 
+                    dry_run, checksum, opened, trusted, max_in_flight, on_done
+                )
+        if trusted and manifest is None:
+            raise Exception("A trusted sync needs a manifest")
+
+        prefix = s3dir.rstrip("/") + "/" if s3dir else ""
+        local = {
+            entry.rel_path: entry for entry in scan_tree(source_dir)
+        }
+
+        remote = None
+        if manifest is not None:
+            remote = manifest.objects(bucketname, prefix)
+            if not trusted and not self._consistent(bucketname, prefix, remote):
+                remote = None
+        listed = remote is None
+        if listed:
+            remote = self._list(bucketname, prefix)
+
+        plan = self._diff(local, remote, checksum, manifest)
+
+        if listed and manifest is not None:
+            # the listing is the truth, so the manifest is brought in line 
+            # with it and the next sync can skip the listing
+            recorded = manifest.objects(bucketname, prefix)
+            for rel_path in recorded.keys() - remote.keys():
+                manifest.forget(bucketname, prefix + rel_path)
+            for rel_path in plan["unchanged"]:
+                entry = local[rel_path]
+                manifest.record(
+                    bucketname, prefix + rel_path, entry.size, entry.mtime, 
+                    remote[rel_path]["ETag"].strip('"')
+                )
+
+        if dry_run:
+            return plan
+
+        if progress_func is not None and progress_func.total is None:
+            progress_func.total = sum(
+                local[rel_path].size 
+                for rel_path in plan["new"] + plan["changed"]
+            )
+            progress_func.refresh()
+
+        # the settings each file was uploaded with, which decide its ETag
+        configs = {}
+
+        def upload(rel_path, subscribers):
+            entry = local[rel_path]
+            manager, extra = self._transfer(entry.size, progress_func)
+            configs[rel_path] = manager.config
+            return manager.upload(
+                entry.path, bucketname, prefix + rel_path,
+                subscribers=extra + subscribers,
+            )
+
+        def uploaded(rel_path):
+            config = configs.pop(rel_path)
+            if manifest is not None:
+                # the ETag is computed for the parts the file was sent in, so
+                # that a checksum sync can still compare it once the file is
+                # touched
+                entry = local[rel_path]
+                etag = s3_etag(
+                    entry.path, config.multipart_threshold, 
+                    config.multipart_chunksize
+                )
+                manifest.record(
+                    bucketname, prefix + rel_path, entry.size, entry.mtime, 
+                    etag
+                )
+            if on_done is not None:
+                on_done("upload", rel_path, None)
+
+        def upload_failed(rel_path, error):
+            configs.pop(rel_path, None)
+            if on_done is not None:
+                on_done("upload", rel_path, error)
+
+        with self.job.active():
+            failed = _submit_bounded(
+                upload, plan["new"] + plan["changed"], 
+                max_in_flight or 8 * self.workers, uploaded, upload_failed
+            )
+        if on_done is None:
+            for rel_path, error in failed:
+                print(f"\n \n {rel_path}: {error}")
+
+        if delete:
+            keys = [prefix + rel_path for rel_path in plan["remote_only"]]
+            for i in range(0, len(keys), 1000):
+                response = self.client.delete_objects(
+                    Bucket=bucketname, 
+                    Delete={
+                        "Objects": [{"Key": key} for key in keys[i: i + 1000]],
+                        "Quiet": True,
+                    },
+                )
+                # quietly, only the keys that could not be deleted are listed
+                errors = {
+                    error["Key"]: error.get("Message", error.get("Code"))
+                    for error in response.get("Errors", [])
+                }
+                for key in keys[i: i + 1000]:
+                    if manifest is not None and key not in errors:
+                        manifest.forget(bucketname, key)
+                    if on_done is not None:
+                        on_done("delete", key[len(prefix):], errors.get(key))
+        return plan
+
+    def _diff(self, local, remote, checksum, manifest):
+        """
+        The plan of `sync` for the local `ScanEntry`s and the remote objects,
+        both by relative path. The remote
+        objects come either from a listing or from a `Manifest`, whose local
+        "mtime" at upload is compared exactly.
+        """
+        plan = {"new": [], "changed": [], "unchanged": [], "remote_only": []}
+        compare = []
+        for rel_path, entry in local.items():
+            obj = remote.get(rel_path)
+            if obj is None:
+                plan["new"].append(rel_path)
+            elif obj["Size"] != entry.size:
+                plan["changed"].append(rel_path)
+            elif obj.get("mtime") == entry.mtime:
+                plan["unchanged"].append(rel_path)
+            elif checksum and obj["ETag"] is not None:
+                compare.append(rel_path)
+            elif "mtime" in obj:
+                plan["changed"].append(rel_path)
+            # S3 keeps the time of an upload to the second
+            elif obj["LastModified"].timestamp() < int(entry.mtime):
+                plan["changed"].append(rel_path)
+            else:
+                plan["unchanged"].append(rel_path)
+
+        # hashing is the slow part of a checksum sync, so the files are 
+        # hashed on several threads
+        def matches(rel_path):
+            remote_etag = remote[rel_path]["ETag"].strip('"')
+            etag = self._etag(local[rel_path], remote_etag, manifest)
+            return etag == remote_etag
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for rel_path, match in zip(compare, executor.map(matches, compare)):
+                if match:
+                    plan["unchanged"].append(rel_path)
+                else:
+                    plan["changed"].append(rel_path)
+
+        plan["remote_only"] = [
+            rel_path for rel_path in remote if rel_path not in local
+        ]
+        return plan
+
+    def _consistent(self, bucketname, prefix, recorded):
+        """
+        Whether a sample of the objects a manifest recorded below `prefix`
+        still exist in the bucket as recorded. An empty record is never 
+        trusted.
+        """
+        if not recorded:
+            return False
+
+        def check(rel_path):
+            try:
+                head = self.client.head_object(
+                    Bucket=bucketname, Key=prefix + rel_path
+                )
+            except botocore.exceptions.ClientError:
+                return False
+            obj = recorded[rel_path]
+            if head["ContentLength"] != obj["Size"]:
+                return False
+            return obj["ETag"] is None or head["ETag"].strip('"') == obj["ETag"]
+
+        sample = random.sample(
+            list(recorded), min(_CHECK_SAMPLE, len(recorded))
+        )
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            if all(executor.map(check, sample)):
+                return True
+        print("\n \n The manifest is out of date, listing the bucket")
+        return False
+
+    def _list(self, bucketname, prefix):
+        """
+        Every object below `prefix`, by the rest of its key.
+        """
+        # keys ending in "/" are folder markers made by the console
+        return {
+            obj["Key"][len(prefix):]: obj 
+            for obj in self._iter_objects(bucketname, prefix)
+            if not obj["Key"].endswith("/")
+        }
+
+    def _iter_objects(self, bucketname, prefix):
+        """
+        Lazily yield every object below `prefix`, in no fixed order, while 
+        the listing goes on. Every folder is listed with a delimiter on a 
+        thread of its own, which hands the folders it finds to further 
+        threads, so the listing spreads over the tree as it is discovered.
+        """
+        pages = queue.Queue(maxsize=_LISTING_QUEUE)
+        stop = threading.Event()
+        lock = threading.Lock()
+        shards = [0]
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return None
+                except queue.Full:
+                    continue
+
+        def list_shard(shard):
+            try:
+                paginator = self.client.get_paginator("list_objects_v2")
+                for page in paginator.paginate(
+                    Bucket=bucketname, Prefix=shard, Delimiter="/"
+                ):
+                    if stop.is_set():
+                        break
+                    for folder in page.get("CommonPrefixes", []):
+                        submit(folder["Prefix"])
+                    put(page.get("Contents", []))
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        def submit(shard):
+            with lock:
+                shards[0] += 1
+            executor.submit(list_shard, shard)
+
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            submit(prefix)
+            finished = 0
+            while True:
+                with lock:
+                    if finished == shards[0]:
+                        break
+                item = pages.get()
+                if item is done:
+                    finished += 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield from item
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _etag(self, entry, remote_etag, manifest=None):
+        """
+        The ETag that the local file of the `ScanEntry` gets when it is 
+        uploaded in as many parts as the object whose ETag is `remote_etag`,
+        so that objects uploaded with other part sizes, by the aws cli for 
+        example, compare too. It is taken from the cache of `manifest` when 
+        it has it.
+        """
+        parts = remote_etag.partition("-")[2]
+        if manifest is not None:
+            etag = manifest.etag(entry.path, entry.size, entry.mtime)
+            if etag is not None and etag.partition("-")[2] == parts:
+                return etag
+
+        if parts:
+            etag = s3_etag(entry.path, 0, _part_size(entry.size, int(parts)))
+        else:
+            etag = s3_etag(entry.path, entry.size + 1)
+        if manifest is not None:
+            manifest.record_etag(entry.path, entry.size, entry.mtime, etag)
+        return etag
+
+    def _transfer(self, size, progress_func, etag=None):
+        """
+        The transfer manager for an object of `size` bytes, or of unknown 
+        size with None, and the subscribers its transfer needs. The `etag` 
+        of an object that is downloaded may be given along with its size. 
+        Managers are made the first time their settings are chosen.
+        """
+        settings = self.tuner.settings(size)
+        with self._lock:
+            self._check_open()
+            manager = self._managers.get(settings)
+            if manager is None:
+                config = s3transfer.TransferConfig(
+                    use_threads=True,
+                    max_concurrency=self.workers,
+                    **settings._asdict(),
+                )
+                manager = _SharedManager(
+                    self.client, config,
+                    self._request_executor, self._submission_executor
+                )
+                self._managers[settings] = manager
+
+        subscribers = [_PacingSubscriber(self.job)]
+        if progress_func is not None:
+            subscribers.append(
+                s3transfer.ProgressCallbackInvoker(progress_func.update)
+            )
+        if size is not None:
+            subscribers.append(_SizeSubscriber(size, etag))
+            if self.tuner.adaptive:
+                streams = 1
+                if size >= settings.multipart_threshold:
+                    streams = min(
+                        -(-size // settings.multipart_chunksize), self.workers
+                    )
+                subscribers.append(_TimingSubscriber(self.tuner, size, streams))
+        return manager, subscribers
+
+    def _check_open(self):
+        if self._closed:
+            raise Exception("The S3TransferSession is closed")
+
+
+class _SharedExecutor(BoundedExecutor):
+    """
+    A `BoundedExecutor` that the transfer managers of a session share, which
+    they cannot shut down. The session does with `close` once every manager
+    is done.
+    """
+    def shutdown(self, wait=True):
+        return None
+
+    def close(self):
+        super().shutdown()
+        return None
+
+
+class _SharedManager(TransferManager):
+    """
+    A `TransferManager` that makes its requests and submits its transfers on
+    the executors of the session, and only writes downloads to disk on a
+    thread of its own.
+    """
+    def __init__(self, client, config, request_executor, submission_executor):
+        super().__init__(client, config)
+        self._request_executor = request_executor
+        self._submission_executor = submission_executor
+
+
+def _name(src, root):
+    """
+    The name of the local file `src` below an S3 folder, its path relative 
+    to `root`, or its basename without a `root`.
+    """
+    if root is None:
+        return os.path.basename(src)
+    return os.path.relpath(src, root).replace(os.sep, "/")
+
+
+def _part_size(size, parts):
+    """
+    The part size that splits `size` bytes into `parts` parts, preferring the
+    powers of two that boto3 and the aws cli use, then whole MiB.
+    """
+    for shift in range(20, 34):
+        if -(-size // (1 << shift)) == parts:
+            return 1 << shift
+    chunk = -(-size // parts)
+    whole = -(-chunk // (1 << 20)) * (1 << 20)
+    if -(-size // whole) == parts:
+        return whole
+    return chunk
+
+
+def _submit_bounded(submit, items, max_in_flight, on_success=None, 
+                    on_failure=None):
+    """
+    Call `submit(item, subscribers)` for every item, which hands a transfer
+    to a transfer manager, with at most `max_in_flight` of them unfinished
+    at any time. The next item is only read from `items` once a transfer 
+    finished and left a free slot, `on_success` is
+    called with each item whose transfer succeeded and `on_failure` with 
+    each item whose transfer failed and the error. Returns `(item, error)` 
+    for each transfer that failed, once all are done.
+    """
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    failed = []
+    lock = threading.Lock()
+
+    def on_done(item, future):
+        try:
+            future.result()
+            if on_success is not None:
+                on_success(item)
+        except Exception as e:
+            with lock:
+                failed.append((item, str(e)))
+            if on_failure is not None:
+                on_failure(item, str(e))
+        finally:
+            in_flight.release()
+
+    # a slot is taken before the next item is read, since reading it may
+    # already cost disk space, like a shard that is packed
+    items = iter(items)
+    try:
+        while True:
+            in_flight.acquire()
+            try:
+                item = next(items)
+            except StopIteration:
+                in_flight.release()
+                break
+            except BaseException:
+                in_flight.release()
+                raise
+            try:
+                submit(item, [_DoneSubscriber(item, on_done)])
+            except BaseException:
+                in_flight.release()
+                raise
+    finally:
+        # wait for the last transfers, also when a submission failed, so 
+        # that none is left running behind the caller
+        for _ in range(max_in_flight):
+            in_flight.acquire()
+    return failed
+
+
+class _DoneSubscriber(s3transfer.BaseSubscriber):
+    """
+    Calls `on_done(item, future)` once the transfer of `item` is finished,
+    whether it succeeded or not.
+    """
+    def __init__(self, item, callback):
+        self.item = item
+        self.callback = callback
+
+    def on_done(self, future, **kwargs):
+        self.callback(self.item, future)
+
+
+class _RemoveSubscriber(s3transfer.BaseSubscriber):
+    """
+    Removes the temporary file `path` once its transfer is finished.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def on_done(self, future, **kwargs):
+        os.remove(self.path)
+
+
+class _SizeSubscriber(s3transfer.BaseSubscriber):
+    """
+    Tells the transfer manager the size of the object, and its ETag when it
+    is known, which saves it a HEAD request or a stat.
+    """
+    def __init__(self, size, etag=None):
+        self.size = size
+        self.etag = etag
+
+    def on_queued(self, future, **kwargs):
+        future.meta.provide_transfer_size(self.size)
+        # older versions of s3transfer only need the size
+        etag_known = hasattr(future.meta, "provide_object_etag")
+        if self.etag is not None and etag_known:
+            future.meta.provide_object_etag(self.etag)
+
+
+class _TimingSubscriber(s3transfer.BaseSubscriber):
+    """
+    Reports to the `TransferTuner` how long the transfer of `size` bytes 
+    over `streams` connections took, from its first bytes on.
+    """
+    def __init__(self, tuner, size, streams):
+        self.tuner = tuner
+        self.size = size
+        self.streams = streams
+        self.start = None
+
+    def on_progress(self, future, bytes_transferred, **kwargs):
+        if self.start is None:
+            self.start = time.monotonic()
+
+    def on_done(self, future, **kwargs):
+        if self.start is None:
+            return None
+        try:
+            future.result()
+        except Exception:
+            return None
+        self.tuner.observe(
+            self.size, time.monotonic() - self.start, self.streams
+        )
+        return None
+
+
+class _PacingSubscriber(s3transfer.BaseSubscriber):
+    """
+    Holds back the thread that moves the bytes of a transfer until the
+    `shwrap.transfer.ratelimit` job may send them.
+    """
+    def __init__(self, job):
+        self.job = job
+
+    def on_progress(self, future, bytes_transferred, **kwargs):
+        self.job.acquire(bytes_transferred)
@@ -0,0 +1,164 @@
+import json
+import os
+import posixpath
+import random
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Tuple
+from ..ratelimit import PacedStream
+
+
+# The size a shard is closed at, before the header of the next member
+_SHARD_SIZE = 256 << 20
+
+# The suffix of the sidecar index uploaded next to each shard
+_INDEX_SUFFIX = ".index"
+
+
+def shard_key(s3dir: str, number: int):
+    """
+    The key of the `number`-th shard in `s3dir`. Its index is at the same key
+    followed by ".index".
+    """
+    return posixpath.join(s3dir, f"shard-{number:06d}.tar")
+
+
+def pack(files: Iterable[Tuple[str, str]], shard_size: int = _SHARD_SIZE):
+    """
+    Lazily pack `(path, name)` pairs into uncompressed tar files of about
+    `shard_size` bytes each, written to the temporary folder. Yields
+    `(tar_path, index)` for each shard once it is closed, where `index` maps
+    the name of each member to `[offset, size]` of its data in the tar file.
+    The caller removes the tar files.
+    """
+    tar, tar_path, index = None, None, {}
+    try:
+        for path, name in files:
+            if tar is None:
+                fd, tar_path = tempfile.mkstemp(suffix=".tar")
+                os.close(fd)
+                tar, index = tarfile.open(tar_path, "w"), {}
+
+            info = tar.gettarinfo(path, arcname=name)
+            with open(path, "rb") as f:
+                tar.addfile(info, f)
+            # the data ends the member, padded to whole blocks
+            blocks = -(-info.size // tarfile.BLOCKSIZE)
+            index[name] = [tar.offset - blocks * tarfile.BLOCKSIZE, info.size]
+
+            if tar.offset >= shard_size:
+                tar.close()
+                tar = None
+                yield tar_path, index
+
+        if tar is not None:
+            tar.close()
+            tar = None
+            yield tar_path, index
+
+    finally:
+        # only left open when the packing stopped part way
+        if tar is not None:
+            tar.close()
+            os.remove(tar_path)
+
+
+class ShardReader:
+    """
+    Reads the files that `S3TransferSession.upload_shards` packed into tar
+    shards, either one file at a time with a ranged GET, or shard by shard
+    as a stream for passes over the whole dataset.
+
+    Parameters
+    ----------
+    s3: S3TransferSession
+        The session whose client and rate limit job are used.
+
+    bucketname: str
+        Just the name of the bucket, not the full bucket path.
+
+    s3dir: str
+        The folder path within the bucket that the shards were uploaded to.
+
+    Example
+    -------
+    >>> with S3TransferSession(session) as s3:
+    >>>     reader = ShardReader(s3, "celeba-demo-bucket", "imgs")
+    >>>     img = reader.read("000001.jpg")
+    >>>     for name, data in reader.iter(shuffle=True):
+    >>>         ...
+    """
+    def __init__(self, s3, bucketname: str, s3dir: str):
+        self.s3 = s3
+        self.bucketname = bucketname
+        self.s3dir = s3dir
+
+        prefix = s3dir.rstrip("/") + "/" if s3dir else ""
+        index_keys = [
+            obj["Key"] for obj in s3._iter_objects(bucketname, prefix)
+            if obj["Key"].endswith(".tar" + _INDEX_SUFFIX)
+        ]
+
+        def load(index_key):
+            body = s3.client.get_object(
+                Bucket=bucketname, Key=index_key
+            )["Body"]
+            return index_key[:-len(_INDEX_SUFFIX)], json.loads(body.read())
+
+        self.members = {}
+        with ThreadPoolExecutor(max_workers=s3.workers) as executor:
+            for key, index in executor.map(load, index_keys):
+                for name, (offset, size) in index.items():
+                    self.members[name] = (key, offset, size)
+
+        self.shards = sorted({key for key, _, _ in self.members.values()})
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def read(self, name: str):
+        """
+        The contents of the packed file `name`, fetched with one ranged GET.
+        """
+        if name not in self.members:
+            raise Exception(f"{name} is not in any shard of {self.s3dir}")
+
+        key, offset, size = self.members[name]
+        if size == 0:
+            return b""
+        self.s3.job.acquire(size)
+        return self.s3.client.get_object(
+            Bucket=self.bucketname, Key=key,
+            Range=f"bytes={offset}-{offset + size - 1}",
+        )["Body"].read()
+
+    def iter_shard(self, key: str):
+        """
+        Stream the shard `key` and yield `(name, data)` for each of its files.
+        """
+        body = self.s3.client.get_object(
+            Bucket=self.bucketname, Key=key
+        )["Body"]
+        stream = PacedStream(body, self.s3.job)
+        with tarfile.open(fileobj=stream, mode="r|") as tar:
+            for info in tar:
+                if info.isfile():
+                    yield info.name, tar.extractfile(info).read()
+
+    def iter(self, shuffle: bool = False):
+        """
+        Yield `(name, data)` for every packed file, one whole shard at a time,
+        with the order of the shards shuffled when `shuffle`.
+        """
+        shards = list(self.shards)
+        if shuffle:
+            random.shuffle(shards)
+        for key in shards:
+            yield from self.iter_shard(key)
+
+    def __iter__(self):
+        return self.iter()
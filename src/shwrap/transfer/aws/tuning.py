@@ -0,0 +1,127 @@
+import math
+import threading
+from typing import NamedTuple, Optional
+
+
+# Parts are never smaller or larger than this
+_MIN_CHUNK = 8 << 20
+_MAX_CHUNK = 512 << 20
+
+# S3 allows at most this many parts per object
+_MAX_PARTS = 10000
+
+# The size of the reads and writes of a transfer, between these bounds
+_MIN_IO_CHUNK = 256 << 10
+_MAX_IO_CHUNK = 4 << 20
+
+# How many bytes of a download may wait to be written to disk
+_IO_QUEUE_BYTES = 256 << 20
+
+# With adaptive tuning, a part should take at least this many seconds on one
+# connection, so that the time of each request is small next to its transfer
+_PART_SECONDS = 2.0
+
+# Transfers smaller than this take as long as a request, whatever the
+# bandwidth, so they are not used to measure it
+_MIN_OBSERVED = 1 << 20
+
+# The weight of a new measurement in the running average
+_SMOOTHING = 0.2
+
+
+class TransferSettings(NamedTuple):
+    """
+    The `TransferConfig` settings `TransferTuner` chooses for one object.
+    """
+    multipart_threshold: int
+    multipart_chunksize: int
+    io_chunksize: int
+    max_io_queue: int
+
+
+def _pow2(n):
+    """
+    The smallest power of two that is at least `n`.
+    """
+    return 1 << max(0, math.ceil(math.log2(max(n, 1))))
+
+
+def _clamp(n, low, high):
+    return max(low, min(n, high))
+
+
+class TransferTuner:
+    """
+    Chooses the multipart threshold, part size and I/O queue of each object
+    from its size. Objects are split so that one of them alone keeps every
+    worker busy, in parts of 8 to 512 MiB, and the reads and writes grow
+    with the parts. Every value is a power of two, so only a few distinct
+    settings are ever used.
+
+    With `adaptive`, the throughput of a single connection is measured from
+    the transfers that finish, and parts and the threshold are raised until
+    a part takes at least two seconds on one connection. Fast links then
+    use fewer, larger requests.
+
+    Parameters
+    ----------
+    workers: int
+        The number of connections the transfers share.
+
+    adaptive: bool, default=False
+        Adjust the settings to the measured throughput.
+    """
+    def __init__(self, workers: int, adaptive: bool = False):
+        self.workers = workers
+        self.adaptive = adaptive
+        self._rate = None
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        """
+        The measured throughput of one connection in bytes per second, or
+        None before anything was measured.
+        """
+        return self._rate
+
+    def settings(self, size: Optional[int]=None):
+        """
+        The `TransferSettings` for an object of `size` bytes. Without a size
+        they are the ones for an object of unknown size, which is decided by
+        the threshold alone.
+        """
+        # parts below this size spend too much of their time on the request
+        smallest = _MIN_CHUNK
+        if self.adaptive and self._rate is not None:
+            smallest = _clamp(
+                _pow2(self._rate * _PART_SECONDS), _MIN_CHUNK, _MAX_CHUNK
+            )
+        threshold = 2 * smallest
+
+        if size is None or size < threshold:
+            return TransferSettings(
+                threshold, smallest, _MIN_IO_CHUNK,
+                _IO_QUEUE_BYTES // _MIN_IO_CHUNK
+            )
+
+        chunk = _clamp(_pow2(size / (4 * self.workers)), smallest, _MAX_CHUNK)
+        chunk = max(chunk, _pow2(size / _MAX_PARTS))
+        io_chunk = _clamp(chunk // 64, _MIN_IO_CHUNK, _MAX_IO_CHUNK)
+        return TransferSettings(
+            threshold, chunk, io_chunk, _IO_QUEUE_BYTES // io_chunk
+        )
+
+    def observe(self, num_bytes: int, seconds: float, streams: int = 1):
+        """
+        Record that `num_bytes` took `seconds` over `streams` connections.
+        """
+        if num_bytes < _MIN_OBSERVED or seconds <= 0:
+            return None
+        rate = num_bytes / seconds / max(1, streams)
+        with self._lock:
+            if self._rate is None:
+                self._rate = rate
+            else:
+                self._rate += _SMOOTHING * (rate - self._rate)
+        return None
@@ -0,0 +1,176 @@
+import re
+import time
+from typing import NamedTuple, Optional
+
+
+class FileStarted(NamedTuple):
+    """
+    `scp` started on a file of `size` bytes.
+    """
+    name: str
+    size: int
+    time: float
+
+
+class FileFinished(NamedTuple):
+    """
+    A file of `size` bytes is done. `seconds` is the time between the file
+    starting and finishing and `bytes_per_second` the resulting throughput.
+    """
+    name: str
+    size: int
+    seconds: float
+    bytes_per_second: float
+    time: float
+
+
+class AuthFailed(NamedTuple):
+    """
+    The remote machine refused the credentials.
+    """
+    message: str
+    time: float
+
+
+class ConnectionFailed(NamedTuple):
+    """
+    The remote machine could not be reached or the connection was lost.
+    """
+    message: str
+    time: float
+
+
+class CompressionChosen(NamedTuple):
+    """
+    The `files` with the given `extensions` are sent with `codec`, one of 
+    "none", "zlib" (ssh compression) or "zstd". `ratio` is the sampled size 
+    after compression over the size before.
+    """
+    codec: str
+    extensions: tuple
+    files: int
+    ratio: float
+    time: float
+
+
+class ChecksumMismatch(NamedTuple):
+    """
+    The copy of `name` on the other side does not have the sha256 of the 
+    original. `remote_sha256` is None if the copy is missing, and 
+    `local_sha256` is None if a byte range could not be sent at all.
+    """
+    name: str
+    local_sha256: Optional[str]
+    remote_sha256: Optional[str]
+    time: float
+
+
+_FAILURES = (
+    r"|(?P<auth>Permission denied.*)"
+    r"|(?P<connection>Could not resolve hostname.*|connect to host.*"
+    r"|Connection (?:refused|timed out|closed).*|lost connection.*"
+    r"|No route to host.*)"
+)
+
+# linux follows the verbose output of `scp -v`, which announces a file with
+# "Sending file modes" when sending and with "Sink" when receiving
+_LINUX = re.compile(
+    r"^(?:Sending file modes|Sink): C\d+ (?P<size>\d+) (?P<name>.*)$" 
+    + _FAILURES
+)
+
+# darwin follows the progress meter that `scp` draws on the tty of `script`
+_DARWIN = re.compile(
+    r"^(?P<name>\S.*?)\s+100%\s+(?P<amount>\d+(?:\.\d+)?)(?P<unit>[KMGTP]?)B?\b"
+    + _FAILURES
+)
+
+_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40, "P": 1 << 50}
+
+
+def file_finished(name: str, size: int, start: float, end: float):
+    """
+    The `FileFinished` event of a file that took from `start` to `end`.
+    """
+    seconds = end - start
+    bytes_per_second = size / seconds if seconds > 0 else float("inf")
+    return FileFinished(name, size, seconds, bytes_per_second, end)
+
+
+class TransferParser:
+    """
+    Turns the output of `send.sh` and `receive.sh` into typed events with a
+    single regex match per line.
+
+    On linux, `scp -v` only announces when a file starts, so a file is
+    reported as finished when the next one starts, or by `close` once `scp`
+    has exited successfully. On darwin only finished files are visible and a
+    file is timed from the end of the one before it.
+
+    Parameters
+    ----------
+    system: str
+        The operating system, "Linux" or "Darwin".
+
+    Example
+    -------
+    >>> parser = TransferParser("Linux")
+    >>> for line in p.stderr:
+    >>>     for event in parser.feed(line):
+    >>>         print(event)
+    >>> for event in parser.close(p.wait() == 0):
+    >>>     print(event)
+    """
+    def __init__(self, system: str):
+        self.system = system
+        self._pattern = _DARWIN if system == "Darwin" else _LINUX
+        self._current = None
+        self._last = time.time()
+
+    def feed(self, line: str):
+        """
+        The events reported by one line of output.
+        """
+        if self.system == "Darwin":
+            # the progress meter redraws itself with carriage returns
+            line = line.rstrip("\r\n").rpartition("\r")[2]
+        else:
+            line = line.rstrip("\r\n")
+
+        match = self._pattern.search(line)
+        if match is None:
+            return []
+
+        now = time.time()
+        if match["auth"] is not None:
+            return [AuthFailed(match["auth"], now)]
+        if match["connection"] is not None:
+            return [ConnectionFailed(match["connection"], now)]
+
+        if self.system == "Darwin":
+            size = int(float(match["amount"]) * _UNITS[match["unit"]])
+            event = file_finished(match["name"], size, self._last, now)
+            self._last = now
+            return [event]
+
+        events = self._finish_current(now)
+        self._current = (match["name"], int(match["size"]), now)
+        events.append(FileStarted(*self._current))
+        return events
+
+    def close(self, success: bool):
+        """
+        The events left once `scp` has exited. The file in flight only counts
+        as finished if `scp` succeeded.
+        """
+        if not success:
+            self._current = None
+            return []
+        return self._finish_current(time.time())
+
+    def _finish_current(self, now):
+        if self._current is None:
+            return []
+        name, size, start = self._current
+        self._current = None
+        return [file_finished(name, size, start, now)]
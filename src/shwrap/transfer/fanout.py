@@ -0,0 +1,175 @@
+import inspect
+import os
+import posixpath
+import shlex
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional
+from .transfer import SecureCopyProtocol
+
+
+def fan_out(
+    hosts: list,
+    source_path: str,
+    save_path: str,
+    concurrency: int = 8,
+    relay: bool = False,
+    relay_pem: Optional[str]=None,
+    **put_kwargs,
+    ):
+    """
+    Send the same file or folder to many remote machines at once.
+
+    At most `concurrency` transfers leave this machine at a time. With
+    `relay`, every host that has received and verified the data also sends it
+    on to one of the hosts that are still waiting, so the number of hosts
+    with the data roughly doubles each round and the rollout time grows with
+    log(hosts). A host whose relayed copy fails is retried from this machine.
+
+    Parameters
+    ----------
+    hosts: list[SecureCopyProtocol]
+        The remote machines. `AsyncSecureCopyProtocol` hosts are not 
+        supported, since their transfers have to be awaited.
+
+    source_path: str
+        The local file or folder to send.
+
+    save_path: str
+        The remote folder, the same on every host, that `source_path` is
+        placed in. It is created if it does not exist.
+
+    concurrency: int, default=8
+        The most transfers that leave this machine at the same time.
+
+    relay: bool, default=False
+        Let hosts that already have the data forward it to the rest. The
+        hosts must be able to `scp` to each other.
+
+    relay_pem: Optional[str]=None
+        The pem key, as a path on the relaying hosts, used for host to host
+        transfers.
+
+    **put_kwargs
+        Passed on to `SecureCopyProtocol.put` for the transfers from this
+        machine.
+
+    Returns
+    -------
+    dict
+        For every host, keyed by "user@ip:port", a dict with "ok", "error",
+        "source" ("local" or the host it was relayed from) and "seconds".
+
+    Example
+    -------
+    >>> from shwrap.transfer import SecureCopyProtocol
+    >>> from shwrap.transfer.fanout import fan_out
+    >>>
+    >>> hosts = [SecureCopyProtocol(user, ip, "22", pem) for ip in ips]
+    >>> results = fan_out(
+    >>>     hosts, "/path/to/model", "/srv/models", concurrency=4, relay=True,
+    >>>     relay_pem="/home/user/.ssh/fleet.pem", with_tqdm=False
+    >>> )
+    >>> failed = [host for host, result in results.items() if not result["ok"]]
+    """
+    for host in hosts:
+        if inspect.iscoroutinefunction(host.put):
+            raise Exception(
+                f"{_label(host)} is asynchronous, fan_out needs "
+                "SecureCopyProtocol hosts"
+            )
+
+    source_path = os.path.normpath(source_path)
+    remote_path = posixpath.join(save_path, os.path.basename(source_path))
+    expected = _local_listing(source_path)
+
+    def send(source, host):
+        start = time.time()
+        try:
+            host.run(f"mkdir -p {shlex.quote(save_path)}")
+            if source is None:
+                host.put(source_path, save_path, **put_kwargs)
+            else:
+                _relay(source, host, remote_path, save_path, relay_pem)
+
+            listing = host._list_remote(remote_path)
+            received = {rel_path: entry[0] for rel_path, entry in listing.items()}
+            if received != expected:
+                raise Exception("The files on the host do not match the source")
+
+            error = None
+        except Exception as e:
+            error = str(e)
+
+        return {
+            "ok": error is None,
+            "error": error,
+            "source": "local" if source is None else _label(source),
+            "seconds": time.time() - start,
+        }
+
+    results = {}
+    pending = deque(hosts)
+    local_only = deque()
+
+    # free sending slots, None stands for this machine. relays are appended
+    # last and popped first so that they take load off this machine.
+    slots = [None] * max(1, concurrency)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, len(hosts))) as executor:
+        while pending or local_only or running:
+            for i in reversed(range(len(slots))):
+                if slots[i] is None and (local_only or pending):
+                    host = (local_only or pending).popleft()
+                elif slots[i] is not None and pending:
+                    host = pending.popleft()
+                else:
+                    continue
+                source = slots.pop(i)
+                running[executor.submit(send, source, host)] = (source, host)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                source, host = running.pop(future)
+                result = future.result()
+                slots.append(source)
+
+                if result["ok"]:
+                    results[_label(host)] = result
+                    if relay:
+                        slots.append(host)
+                elif source is not None:
+                    local_only.append(host)
+                else:
+                    results[_label(host)] = result
+
+    return {_label(host): results[_label(host)] for host in hosts}
+
+
+def _label(host: SecureCopyProtocol):
+    return f"{host.user}@{host.ip}:{host.port}"
+
+
+def _local_listing(source_path: str):
+    """
+    The relative paths and sizes that a copy of `source_path` should have,
+    in the form returned by `SecureCopyProtocol._list_remote`.
+    """
+    if not os.path.isdir(source_path):
+        return {"": os.path.getsize(source_path)}
+    files, _ = SecureCopyProtocol._scan_local(source_path)
+    return {rel_path: entry[1] for rel_path, entry in files.items()}
+
+
+def _relay(source: SecureCopyProtocol, host: SecureCopyProtocol,
+           remote_path: str, save_path: str, relay_pem: Optional[str]):
+    """
+    Have `source` copy its `remote_path` into `save_path` on `host`.
+    """
+    command = ["scp", "-r", "-q", "-o", "BatchMode=yes", "-P", str(host.port)]
+    if relay_pem is not None:
+        command += ["-i", relay_pem]
+    command += [remote_path, f"{host.user}@{host.ip}:{save_path}"]
+    source.run(" ".join(shlex.quote(arg) for arg in command))
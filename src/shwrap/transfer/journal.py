@@ -0,0 +1,63 @@
+import json
+import os
+import threading
+
+
+class Journal:
+    """
+    An append only record of the files a transfer has finished, so that an
+    interrupted transfer can skip them when it is run again.
+
+    Each line of the file is a json object with the relative `path` and the
+    `size` of one finished file. A line cut short by the interruption is
+    ignored.
+
+    Parameters
+    ----------
+    path: str
+        Where the journal is kept.
+
+    resume: bool, default=False
+        Load the files recorded by an earlier run. Otherwise the journal is
+        started over.
+    """
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.done = {}
+
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.done[entry["path"]] = entry["size"]
+
+        self._file = open(path, "a" if resume else "w")
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def is_done(self, rel_path: str, size: int):
+        """
+        Whether `rel_path` was finished with the same size.
+        """
+        return self.done.get(rel_path) == size
+
+    def record(self, rel_path: str, size: int):
+        """
+        Mark `rel_path` as finished. The line is flushed straight away so it
+        survives the process being killed.
+        """
+        with self._lock:
+            self._file.write(json.dumps({"path": rel_path, "size": size}) + "\n")
+            self._file.flush()
+            self.done[rel_path] = size
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from typing import Optional
+
+
+class LogWriter:
+    """
+    A log file that is opened once and written in batches, so that the loops
+    that follow the output of `scp` and `aws` never wait on the disk.
+
+    Lines are collected in memory and written out once `buffer_size`
+    characters have piled up or `flush_interval` seconds have passed. By
+    default that happens on a background thread. `write` is safe to call from
+    several threads at once.
+
+    Parameters
+    ----------
+    path: str
+        The log file. New lines are appended to it.
+
+    buffer_size: int, default=65536
+        How many characters to collect before they are written out.
+
+    flush_interval: float, default=1.0
+        The most seconds a line waits before it is written out.
+
+    max_bytes: Optional[int]=None
+        Rotate the log once it would grow past this many bytes. `path` is
+        renamed to `path.1`, `path.1` to `path.2` and so on.
+
+    backup_count: int, default=1
+        How many rotated logs to keep.
+
+    background: bool, default=True
+        Write on a background thread. Otherwise the call to `write` that
+        crosses a threshold writes the batch itself.
+
+    Example
+    -------
+    >>> from shwrap.transfer.logfile import LogWriter
+    >>>
+    >>> with LogWriter("/path/to/transfer.log", max_bytes=100_000_000) as log:
+    >>>     for line in lines:
+    >>>         log.write(line + "\\n")
+    """
+    def __init__(self,
+                 path: str,
+                 buffer_size: int = 1 << 16,
+                 flush_interval: float = 1.0,
+                 max_bytes: Optional[int]=None,
+                 backup_count: int = 1,
+                 background: bool = True):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self._file = open(path, "a")
+        self._size = os.path.getsize(path)
+
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._closed = False
+
+        # `_lock` guards the buffer and is only held for an append or a swap.
+        # `_file_lock` keeps batches in order while they are written out.
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._wake = threading.Event()
+
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, text: str):
+        """
+        Queue `text` to be written to the log.
+        """
+        with self._lock:
+            self._buffer.append(text)
+            self._buffered += len(text)
+            full = self._buffered >= self.buffer_size
+
+        if self._thread is not None:
+            if full:
+                self._wake.set()
+        elif full or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write everything that is queued to the log.
+        """
+        with self._file_lock:
+            with self._lock:
+                chunk = "".join(self._buffer)
+                self._buffer = []
+                self._buffered = 0
+
+            if chunk:
+                if self.max_bytes is None:
+                    self._file.write(chunk)
+                    self._size += len(chunk.encode())
+                else:
+                    # a batch may cross the limit part way, so every line is
+                    # checked, and a line longer than the limit gets a file
+                    # of its own
+                    for line in chunk.splitlines(keepends=True):
+                        size = len(line.encode())
+                        if self._size > 0 and self._size + size > self.max_bytes:
+                            self._rotate()
+                        self._file.write(line)
+                        self._size += size
+                self._file.flush()
+
+            self._last_flush = time.monotonic()
+
+    def close(self):
+        """
+        Write out what is left and close the log.
+        """
+        if self._closed:
+            return None
+
+        self._closed = True
+        if self._thread is not None:
+            self._wake.set()
+            self._thread.join()
+
+        self.flush()
+        self._file.close()
+        return None
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def _rotate(self):
+        self._file.close()
+
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+
+        self._file = open(self.path, "w")
+        self._size = 0
+
+
+def open_log(generate_logfile_to: Optional[str],
+             max_bytes: Optional[int]=None):
+    """
+    A `LogWriter` for `generate_logfile_to` that rotates past `max_bytes`,
+    or None when no log is wanted.
+    """
+    if generate_logfile_to is None:
+        return None
+    return LogWriter(generate_logfile_to, max_bytes=max_bytes)
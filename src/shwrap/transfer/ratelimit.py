@@ -0,0 +1,329 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+# How many seconds worth of the cap may go out in one burst
+_BURST_SECONDS = 0.25
+
+# The paced transfers always keep this part of the cap, however much of it
+# the running `scp` calls have reserved
+_MIN_SHARE = 0.05
+
+
+class Job:
+    """
+    One or more transfers that share the cap of a `RateLimiter` as a unit.
+    Jobs are made with `RateLimiter.job`.
+
+    Parameters
+    ----------
+    limiter: RateLimiter
+        The limiter whose cap the job shares.
+
+    name: str
+        A name to tell the jobs apart, for example "user@ip:port".
+
+    weight: float, default=1.0
+        Jobs of the same priority share the cap in proportion to their
+        weights.
+
+    priority: int, default=0
+        Jobs of a higher priority are served first. Paced transfers of a
+        lower priority only get what the higher ones leave, and `scp` calls
+        of a lower priority only start once no job of a higher priority is
+        running.
+
+    The weight and the priority can be changed while the job runs.
+    """
+    def __init__(self, limiter, name, weight=1.0, priority=0):
+        if weight <= 0:
+            raise Exception("The weight of a job has to be positive")
+
+        self.limiter = limiter
+        self.name = name
+        self._weight = weight
+        self._priority = priority
+
+        # the bytes served so far divided by the weight, which the limiter
+        # keeps even between jobs of the same priority
+        self._vtime = 0.0
+        self._active = 0
+
+    def __repr__(self):
+        return (
+            f"Job({self.name!r}, weight={self._weight}, "
+            f"priority={self._priority})"
+        )
+
+    @property
+    def weight(self):
+        return self._weight
+
+    @weight.setter
+    def weight(self, weight):
+        if weight <= 0:
+            raise Exception("The weight of a job has to be positive")
+        with self.limiter._cond:
+            self._weight = weight
+            self.limiter._cond.notify_all()
+
+    @property
+    def priority(self):
+        return self._priority
+
+    @priority.setter
+    def priority(self, priority):
+        with self.limiter._cond:
+            self._priority = priority
+            self.limiter._cond.notify_all()
+
+    @property
+    def is_active(self):
+        return self._active > 0
+
+    @contextmanager
+    def active(self):
+        """
+        Count the job as running for the duration of the block. Blocks may
+        be nested and run from several threads.
+        """
+        self.limiter._enter(self)
+        try:
+            yield self
+        finally:
+            self.limiter._exit(self)
+
+    def acquire(self, num_bytes: int):
+        """
+        Wait until `num_bytes` may be sent under the cap.
+        """
+        self.limiter._acquire(self, num_bytes)
+
+    def reserve(self, streams: int = 1):
+        """
+        Reserve a fixed rate for each of `streams` processes, such as `scp`,
+        that can only be capped when they start. Returns a `Reservation`
+        whose `rate` is in bytes per second, or None when there is no cap.
+        """
+        return self.limiter._reserve(self, streams)
+
+
+class Reservation:
+    """
+    A fixed part of the cap held by a running process. Release it, or use it
+    as a context manager, once the process is done.
+    """
+    def __init__(self, limiter, rate):
+        self.limiter = limiter
+        self.rate = rate
+        self._released = rate is None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def release(self):
+        with self.limiter._cond:
+            if self._released:
+                return None
+            self._released = True
+            self.limiter._reserved -= self.rate
+            self.limiter._cond.notify_all()
+        return None
+
+
+class RateLimiter:
+    """
+    A cap on the combined throughput of every transfer that uses it, shared
+    by jobs according to their priorities and weights.
+
+    Transfers whose bytes pass through python, like the "sftp-pipelined"
+    backend, "tarstream" and `fast_upload`, are paced chunk by chunk, so a
+    new cap or weight applies straight away. `scp` can only be capped when
+    it starts, so every call reserves its share of the cap at that moment.
+
+    Parameters
+    ----------
+    limit: Optional[float]=None
+        The cap in bytes per second, or None for no cap.
+
+    Example
+    -------
+    >>> from shwrap.transfer.ratelimit import limiter
+    >>>
+    >>> limiter.set_limit(100 << 20)  # 100 MiB/s for the whole process
+    >>> backup = SecureCopyProtocol(user, ip, port, pem, weight=1, priority=0)
+    >>> deploy = SecureCopyProtocol(user, ip, port, pem, weight=1, priority=1)
+    >>> deploy.job.weight = 4  # may be changed while it runs
+    """
+    def __init__(self, limit: Optional[float]=None):
+        self._check(limit)
+        self._limit = limit
+        self._cond = threading.Condition()
+        self._jobs = set()
+        self._waiting = {}
+        self._reserved = 0.0
+        self._tokens = 0.0
+        self._last = time.monotonic()
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def set_limit(self, limit: Optional[float]):
+        """
+        Change the cap, in bytes per second, or remove it with None. Paced
+        transfers follow at once, `scp` calls from their next start.
+        """
+        self._check(limit)
+        with self._cond:
+            self._refill()
+            self._limit = limit
+            if limit is not None:
+                self._tokens = min(self._tokens, self._rate() * _BURST_SECONDS)
+            self._cond.notify_all()
+
+    def job(self, name: str, weight: float = 1.0, priority: int = 0):
+        """
+        A new `Job` that shares the cap of this limiter.
+        """
+        return Job(self, name, weight, priority)
+
+    def jobs(self):
+        """
+        The jobs that are running right now.
+        """
+        with self._cond:
+            return list(self._jobs)
+
+    @staticmethod
+    def _check(limit):
+        if limit is not None and limit <= 0:
+            raise Exception("The limit has to be positive, or None")
+
+    def _enter(self, job):
+        with self._cond:
+            if job._active == 0:
+                # a job that joins does not get to catch up on the bytes the
+                # others were served while it was away
+                peers = [
+                    other._vtime for other in self._jobs
+                    if other._priority == job._priority
+                ]
+                if peers:
+                    job._vtime = max(job._vtime, min(peers))
+                self._jobs.add(job)
+            job._active += 1
+            self._cond.notify_all()
+
+    def _exit(self, job):
+        with self._cond:
+            job._active -= 1
+            if job._active == 0:
+                self._jobs.discard(job)
+            self._cond.notify_all()
+
+    def _rate(self):
+        """
+        The rate the paced transfers share, what the `scp` calls leave.
+        """
+        return max(self._limit - self._reserved, self._limit * _MIN_SHARE)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self._limit is not None:
+            burst = self._rate() * _BURST_SECONDS
+            self._tokens = min(
+                self._tokens + (now - self._last) * self._rate(), burst
+            )
+        self._last = now
+
+    def _next(self):
+        """
+        The waiting job that is served next.
+        """
+        return max(
+            self._waiting, key=lambda job: (job._priority, -job._vtime)
+        )
+
+    def _acquire(self, job, num_bytes):
+        if self._limit is None or num_bytes <= 0:
+            return None
+
+        with self._cond:
+            self._waiting[job] = self._waiting.get(job, 0) + 1
+            try:
+                while True:
+                    self._refill()
+                    if self._limit is None:
+                        break
+                    if self._tokens > 0 and self._next() is job:
+                        self._tokens -= num_bytes
+                        break
+
+                    timeout = 0.05
+                    if self._tokens <= 0:
+                        timeout = -self._tokens / self._rate()
+                    self._cond.wait(min(max(timeout, 0.001), 0.5))
+
+                job._vtime += num_bytes / job._weight
+            finally:
+                self._waiting[job] -= 1
+                if self._waiting[job] == 0:
+                    del self._waiting[job]
+                self._cond.notify_all()
+        return None
+
+    def _top_priority(self):
+        return max((job._priority for job in self._jobs), default=None)
+
+    def _reserve(self, job, streams):
+        with self._cond:
+            while self._limit is not None:
+                top = self._top_priority()
+                if top is None or job._priority >= top:
+                    break
+                self._cond.wait(0.5)
+
+            if self._limit is None:
+                return Reservation(self, None)
+
+            peers = {
+                other for other in self._jobs
+                if other._priority == job._priority
+            }
+            peers.add(job)
+            share = job._weight / sum(other._weight for other in peers)
+            rate = self._limit * share / max(1, streams)
+            self._reserved += rate
+            return Reservation(self, rate)
+
+
+class PacedStream:
+    """
+    A file object whose reads and writes are paced by `job`.
+    """
+    def __init__(self, fileobj, job):
+        self.fileobj = fileobj
+        self.job = job
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.job.acquire(len(data))
+        return data
+
+    def write(self, data):
+        self.job.acquire(len(data))
+        return self.fileobj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+# The limiter that every transfer of the process shares. It has no cap until
+# `set_limit` is called.
+limiter = RateLimiter()
@@ -0,0 +1,212 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+import paramiko
+from .utils import HashingReader
+
+
+# paramiko's default 2 MiB window stalls every channel after one window on
+# high latency links, so each channel gets a much larger one
+_WINDOW_SIZE = 1 << 26
+
+
+class PipelinedSFTP:
+    """
+    An SFTP backend that keeps many requests in flight. Each file is written
+    with pipelined requests (and read with prefetching), and several files
+    move at once over their own SFTP channels on a single ssh connection.
+
+    Parameters
+    ----------
+    user: str
+        The user of the remote machine
+
+    ip: str
+        The ip address of the remote machine
+
+    port: str
+        The port of the ssh server
+
+    pem: Optional[str]=None
+        The pem key to access the remote machine
+
+    window_size: int, default=64 MiB
+        The ssh window of every channel, ie how many bytes may be in flight
+        on it before the remote machine has to acknowledge them.
+
+    known_hosts: Optional[str]=None
+        A known_hosts file to trust on top of ~/.ssh/known_hosts
+
+    auto_add: bool=False
+        Trust and remember the key of a host that is in no known_hosts file.
+        By default such a host is rejected, like `ssh` does.
+    """
+    def __init__(self, user, ip, port, pem=None, window_size=_WINDOW_SIZE,
+                 known_hosts=None, auto_add=False):
+        self.user = user
+        self.ip = ip
+        self.port = port
+        self.pem = pem
+        self.window_size = window_size
+        self.known_hosts = known_hosts
+        self.auto_add = auto_add
+
+        self._client = None
+        self._idle = queue.SimpleQueue()
+        self._channels = []
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self._client is not None
+
+    def connect(self):
+        """
+        Open the ssh connection. Does nothing if it is already open.
+        """
+        if self._client is not None:
+            return self
+
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        if self.known_hosts is not None:
+            client.load_host_keys(os.path.expanduser(self.known_hosts))
+        if self.auto_add:
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
+            self.ip, int(self.port), self.user, key_filename=self.pem
+        )
+        client.get_transport().default_window_size = self.window_size
+        self._client = client
+        return self
+
+    def close(self):
+        """
+        Close every SFTP channel and the ssh connection.
+        """
+        for sftp in self._channels:
+            sftp.close()
+        self._channels = []
+        self._idle = queue.SimpleQueue()
+
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def exec(self, command: str, stdin: Optional[str]=None):
+        """
+        Run `command` on the remote machine over the open connection and
+        return its stdout.
+        """
+        channel_stdin, stdout, stderr = self._client.exec_command(command)
+
+        # stdout and stderr are read while stdin is written, since a command
+        # stops once the window of either output is full
+        outputs = {}
+        readers = [
+            threading.Thread(
+                target=lambda name, f: outputs.__setitem__(name, f.read()),
+                args=(name, f), daemon=True
+            )
+            for name, f in [("stdout", stdout), ("stderr", stderr)]
+        ]
+        for reader in readers:
+            reader.start()
+
+        if stdin is not None:
+            channel_stdin.write(stdin)
+        channel_stdin.channel.shutdown_write()
+        for reader in readers:
+            reader.join()
+
+        if stdout.channel.recv_exit_status() != 0:
+            raise Exception(
+                f"Remote command failed: {outputs['stderr'].decode().strip()}"
+            )
+        return outputs["stdout"].decode()
+
+    def put(self, files, workers=1, on_bytes=None, on_file=None, 
+            hashes=None):
+        """
+        Send `(local_path, remote_path, size)` files, `workers` at a time.
+
+        `on_bytes(n)` is called as every chunk of `n` bytes is acknowledged
+        and `on_file(name, size, start, end)` once a file is done. When 
+        `hashes` is a dict, the sha256 of every sent file is computed while 
+        it is read and stored in it by local path. Returns a list of 
+        `(local_path, error)` for the files that failed.
+        """
+        def send(sftp, local_path, remote_path, callback):
+            with open(local_path, "rb") as f:
+                reader = f if hashes is None else HashingReader(f)
+                sftp.putfo(reader, remote_path, callback=callback, confirm=True)
+            if hashes is not None:
+                hashes[local_path] = reader.hexdigest()
+
+        return self._run(send, files, workers, on_bytes, on_file)
+
+    def get(self, files, workers=1, on_bytes=None, on_file=None):
+        """
+        Receive `(remote_path, local_path, size)` files, `workers` at a time.
+        The callbacks and the return value are the same as for `put`.
+        """
+        def receive(sftp, remote_path, local_path, callback):
+            with open(local_path, "wb") as f:
+                sftp.getfo(remote_path, f, callback=callback, prefetch=True)
+
+        return self._run(receive, files, workers, on_bytes, on_file)
+
+    def _run(self, move, files, workers, on_bytes, on_file):
+        def run(file):
+            source, destination, size = file
+            sent = 0
+
+            def callback(transferred, total):
+                nonlocal sent
+                if on_bytes is not None:
+                    on_bytes(transferred - sent)
+                sent = transferred
+
+            start = time.time()
+            try:
+                with self._channel() as sftp:
+                    move(sftp, source, destination, callback)
+            except Exception as e:
+                return source, str(e)
+
+            if on_file is not None:
+                on_file(os.path.basename(source), size, start, time.time())
+            return None
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = executor.map(run, files)
+            return [result for result in results if result is not None]
+
+    @contextmanager
+    def _channel(self):
+        """
+        Borrow an idle SFTP channel, opening a new one if there is none.
+        """
+        try:
+            sftp = self._idle.get_nowait()
+        except queue.Empty:
+            sftp = paramiko.SFTPClient.from_transport(
+                self._client.get_transport(), window_size=self.window_size
+            )
+            with self._lock:
+                self._channels.append(sftp)
+
+        try:
+            yield sftp
+        except BaseException:
+            # a request may have been cut short, so the channel is not reused
+            with self._lock:
+                if sftp in self._channels:
+                    self._channels.remove(sftp)
+            sftp.close()
+            raise
+        self._idle.put(sftp)
@@ -1,13 +1,78 @@
 import subprocess
+import functools
+import hashlib
+import math
 import os
+import posixpath
+import shlex
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Optional
 from tqdm import tqdm
-from .utils import count_all_files
+from .utils import (
+    count_all_files, scan_tree, shard_by_size, sha256sum, sample_compression,
+    HashingReader, COMPRESSED_EXTENSIONS
+)
+from .journal import Journal
+from .ratelimit import limiter, PacedStream
+from .logfile import open_log
+from .events import (
+    TransferParser, FileFinished, AuthFailed, ConnectionFailed, 
+    CompressionChosen, ChecksumMismatch, file_finished
+)
 from platform import system
 import importlib.resources as pkg
 import re
 
 
+# The most files handed to a single `scp` call in parallel mode
+_MAX_FILES_PER_CALL = 1000
+
+# Partial files at least this large are continued instead of sent again
+_RESUME_MIN_SIZE = 1 << 20
+
+# A single file at least this large is split into byte ranges that are sent 
+# over concurrent streams
+_SPLIT_MIN_SIZE = 1 << 30
+
+# Sampled files that shrink below this ratio are worth compressing
+_COMPRESS_BELOW = 0.8
+
+# How many files of each extension are sampled, and how much of each
+_SAMPLES_PER_EXTENSION = 4
+_SAMPLE_BYTES = 1 << 16
+
+# The ciphers `autotune` tries, if the local ssh has them
+_CIPHERS = [
+    "aes128-gcm@openssh.com", "chacha20-poly1305@openssh.com", "aes128-ctr"
+]
+
+# The settings found by `autotune`, shared by every instance for the same
+# (ip, port)
+_TUNINGS = {}
+_TUNINGS_LOCK = threading.Lock()
+
+# Whether the remote machine at (ip, port) has the GNU `dd` and `truncate`
+# that byte ranges are written with
+_GNU_DD = {}
+
+
+def _as_job(method):
+    """
+    Count the instance's job as running for the duration of `method`.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.job.active():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class SecureCopyProtocol:
     """
     A call to `scp`.
@@ -26,25 +91,367 @@ class SecureCopyProtocol:
     pem: Optional[str]=None
         The pem key to access the remote machine
 
+    persist: str, default="yes"
+        How long an open session's master connection stays up while idle. 
+        This is passed to ssh as `ControlPersist`, so "yes" keeps it up until
+        `close` is called and values like "10m" let it expire on its own.
+
+    backend: str, default="scp"
+        Either "scp" or "sftp-pipelined". "sftp-pipelined" moves files with
+        paramiko, which has to be installed, over a single ssh connection. 
+        Every file is sent with many write requests in flight, or received
+        with prefetching, `streams` files move at once over their own SFTP 
+        channels and the progress bar moves per chunk instead of per file 
+        when measuring by "KiB" or "MiB". The `mode`, `journal` and `resume`
+        options of `put` and `get` are not available with it.
+
+    listing_ttl: float, default=30.0
+        How many seconds a listing of a remote folder, made by `list_remote` 
+        or `get`, is reused before the folder is listed again. The cached 
+        listings are dropped whenever a session is opened or closed and by 
+        every `put` and `sync`.
+
+    weight: float, default=1.0
+        The share of the process wide cap of `shwrap.transfer.ratelimit.limiter`
+        that the transfers of this instance get, relative to the other
+        running jobs of the same priority.
 
+    priority: int, default=0
+        Transfers of a higher priority are served first under the cap. The
+        weight and the priority can be changed while transfers run through
+        `self.job`.
+
+    log_max_bytes: Optional[int]=None
+        Rotate the log files asked for with `generate_logfile_to` once they
+        would grow past this many bytes, keeping the last one as `.1`.
+
+    ssh_options: Optional[dict]=None
+        Extra ssh options, such as `{"UserKnownHostsFile": path}`, handed to
+        every `ssh` and `scp` call as `-o key=value`. The "sftp-pipelined"
+        backend only reads `UserKnownHostsFile`, and trusts unknown hosts
+        when `StrictHostKeyChecking` is "no" or "accept-new". Otherwise it
+        rejects hosts that are in no known_hosts file.
+
+    Example
+    -------
+    >>> from shwrap.transfer import SecureCopyProtocol
+    >>> 
+    >>> # one handshake for every transfer and remote command in the block
+    >>> with SecureCopyProtocol(user, ip, port, pem) as scp:
+    >>>     for source_path in source_paths:
+    >>>         scp.put(source_path, save_path)
+    >>>     print(scp.run("ls " + save_path))
     """
-    def __init__(self, user, ip, port, pem=None):
+    def __init__(self, user, ip, port, pem=None, persist="yes", 
+                 backend="scp", listing_ttl=30.0, weight=1.0, priority=0,
+                 log_max_bytes=None, ssh_options=None):
         self.user = user
         self.ip = ip
         self.port = port
         self.pem = pem
+        self.persist = persist
+        self.backend = backend
+        self.listing_ttl = listing_ttl
+        self.log_max_bytes = log_max_bytes
+        self.ssh_options = dict(ssh_options or {})
         
         self._system = system()
 
         if self._system not in ["Linux", "Darwin"]:
             raise Exception("Operating system in not supported")
 
+        if backend not in ["scp", "sftp-pipelined"]:
+            raise Exception(f"Unknown backend: {backend}")
+
+        self._control_dir = None
+        self._sftp = None
+        self._listings = {}
+        self._listings_lock = threading.Lock()
+        self.opened_at = None
+        self._subscribers = []
+        self.job = limiter.job(f"{user}@{ip}:{port}", weight, priority)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def control_path(self):
+        """
+        The socket of the master connection, or None if no session is open.
+        """
+        if self._control_dir is None:
+            return None
+        return os.path.join(self._control_dir, "master")
+
+    @property
+    def is_open(self):
+        """
+        Whether the master connection of the session is still alive.
+        """
+        if self.backend == "sftp-pipelined":
+            return self._sftp is not None and self._sftp.connected
+        if self._control_dir is None:
+            return False
+        return self._control("check").returncode == 0
+
+    @property
+    def uptime(self):
+        """
+        Seconds since the session was opened, or None if it is not open.
+        """
+        if self.opened_at is None:
+            return None
+        return time.time() - self.opened_at
+
+    def open(self):
+        """
+        Start a master connection that every later `put`, `get` and `run` 
+        reuses, so the ssh handshake and key exchange happen only once.
+        Calling `open` on an open session does nothing.
+        """
+        if not self.is_open:
+            self._listings.clear()
+
+        if self.backend == "sftp-pipelined":
+            if not self.is_open:
+                self._sftp_backend().connect()
+                self.opened_at = time.time()
+            return self
+
+        if self._control_dir is not None:
+            return self
+
+        self._control_dir = tempfile.mkdtemp(prefix="shwrap-")
+        result = self._control("start")
+        if result.returncode != 0:
+            shutil.rmtree(self._control_dir, ignore_errors=True)
+            self._control_dir = None
+            raise Exception(
+                f"Could not open the master connection: {result.stderr.strip()}"
+            )
+
+        self.opened_at = time.time()
+        return self
+
+    def close(self):
+        """
+        Shut down the master connection of the session, if there is one.
+        """
+        self._listings.clear()
+
+        if self._sftp is not None:
+            self._sftp.close()
+            self.opened_at = None
+
+        if self._control_dir is None:
+            return None
+
+        self._control("exit")
+        shutil.rmtree(self._control_dir, ignore_errors=True)
+        self._control_dir = None
+        self.opened_at = None
+        return None
+
+    def run(self, command: str):
+        """
+        Run `command` on the remote machine and return what it printed. This 
+        goes over the master connection when a session is open.
+        """
+        return self._ssh(command)
+
+    def list_remote(self, source_path: str, refresh: bool = False):
+        """
+        Enumerate the remote `source_path` in a single round trip. The 
+        listing is reused for `listing_ttl` seconds unless `refresh` is set.
+
+        Returns
+        -------
+        dict
+            "count", the number of files, "total_bytes", their total size, 
+            and "sizes", mapping the relative path of each file to its size,
+            from the largest file to the smallest. A `source_path` that is a 
+            file gives a single entry with an empty relative path.
+
+        Example
+        -------
+        >>> tree = scp.list_remote("/path/to/remote/folder")
+        >>> print(tree["count"], tree["total_bytes"])
+        """
+        sizes = {
+            rel_path: entry[0] 
+            for rel_path, entry 
+            in self._cached_listing(source_path, refresh).items()
+        }
+        return {
+            "count": len(sizes), 
+            "total_bytes": sum(sizes.values()), 
+            "sizes": sizes
+        }
+
+    def autotune(self, refresh: bool = False, probe_bytes: int = 8 << 20,
+                 max_streams: int = 8):
+        """
+        Measure the link to the remote machine and pick the settings that 
+        move data over it fastest. The result is kept for every instance 
+        with the same ip and port, so later calls return it straight away 
+        unless `refresh` is set.
+
+        The round trip time is the median of a few remote no-ops. Then 
+        `probe_bytes` are pushed to the remote machine over a fresh ssh 
+        connection with each of the fast ciphers the local ssh has, and again
+        over 2, 4, ... `max_streams` connections at once until more 
+        connections stop adding at least 20% to the total throughput.
+
+        Afterwards `put`, `get` and `sync` default to the picked number of 
+        streams, every `ssh` and `scp` call uses the picked cipher and the 
+        "sftp-pipelined" backend sizes its windows to twice the bandwidth 
+        delay product. A session opened before tuning keeps the cipher of 
+        its master connection.
+
+        Parameters
+        ----------
+        refresh: bool, default=False
+            Measure again even if this host was already tuned.
+
+        probe_bytes: int, default=8 MiB
+            How many bytes each probe connection sends.
+
+        max_streams: int, default=8
+            The most concurrent streams to try.
+
+        Returns
+        -------
+        dict
+            "rtt", the round trip time in seconds, "bandwidth", the total 
+            throughput in bytes per second, "cipher" (None if no cipher 
+            could be picked), "streams", "window_size" in bytes and "time", 
+            when the link was measured.
+
+        Example
+        -------
+        >>> scp = SecureCopyProtocol(user, ip, port, pem)
+        >>> print(scp.autotune())
+        >>> scp.put("/path/to/folder", save_path)  # with the tuned streams
+        """
+        key = self._host_key()
+        with _TUNINGS_LOCK:
+            if not refresh and key in _TUNINGS:
+                return dict(_TUNINGS[key])
+
+        opened_here = not self.is_open
+        if opened_here:
+            self.open()
+        try:
+            rtts = []
+            for _ in range(5):
+                start = time.time()
+                self._ssh("true")
+                rtts.append(time.time() - start)
+            rtt = sorted(rtts)[len(rtts) // 2]
+        finally:
+            if opened_here:
+                self.close()
+
+        cipher, per_stream = None, 0.0
+        for candidate in self._local_ciphers() or [None]:
+            elapsed = self._probe(probe_bytes, candidate)
+            if elapsed is not None and probe_bytes / elapsed > per_stream:
+                cipher, per_stream = candidate, probe_bytes / elapsed
+        if per_stream == 0.0:
+            raise Exception(f"Could not send any data to {self.ip}")
+
+        # the handshake is paid once per connection, whatever the streams
+        handshake = self._probe(0, cipher) or 0.0
+        bandwidth = probe_bytes / max(probe_bytes / per_stream - handshake, 1e-6)
+
+        streams = 1
+        while streams * 2 <= max_streams:
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=streams * 2) as executor:
+                elapsed = list(executor.map(
+                    lambda _: self._probe(probe_bytes, cipher), 
+                    range(streams * 2)
+                ))
+            if None in elapsed:
+                break
+            total = streams * 2 * probe_bytes / max(
+                time.time() - start - handshake, 1e-6
+            )
+            if total < 1.2 * bandwidth:
+                break
+            streams, bandwidth = streams * 2, total
+
+        window_size = min(max(int(2 * bandwidth * rtt), 2 << 20), 256 << 20)
+
+        tuning = {
+            "rtt": rtt,
+            "bandwidth": bandwidth,
+            "cipher": cipher,
+            "streams": streams,
+            "window_size": window_size,
+            "time": time.time(),
+        }
+        with _TUNINGS_LOCK:
+            _TUNINGS[key] = tuning
+
+        print(
+            f"\n \n Tuned {self.ip}: {streams} streams, cipher {cipher}, "
+            f"window {window_size >> 20} MiB, rtt {rtt * 1000:.1f} ms, "
+            f"{bandwidth / (1 << 20):.1f} MiB/s"
+        )
+        return dict(tuning)
+
+    def subscribe(self, callback, *event_types):
+        """
+        Call `callback(event)` for every event of every later transfer, or 
+        only for events of the given types. The events are defined in 
+        `shwrap.transfer.events`. With several streams the callback is called
+        from the thread of each stream.
+
+        Example
+        -------
+        >>> from shwrap.transfer.events import FileFinished
+        >>>
+        >>> def report(event):
+        >>>     print(event.name, event.bytes_per_second)
+        >>>
+        >>> scp.subscribe(report, FileFinished)
+        """
+        self._subscribers.append((callback, event_types))
+        return callback
+
+    def unsubscribe(self, callback):
+        """
+        Stop calling `callback`.
+        """
+        self._subscribers = [
+            (subscriber, event_types) 
+            for subscriber, event_types in self._subscribers 
+            if subscriber is not callback
+        ]
+
+    def _publish(self, event):
+        for callback, event_types in self._subscribers:
+            if not event_types or isinstance(event, event_types):
+                callback(event)
+
+    @_as_job
     def put(self,
             source_path: str, 
             save_path: str,
             with_tqdm: bool = True,
             measure_by: Optional[str]="count",
-            generate_logfile_to: Optional[str]=None):
+            generate_logfile_to: Optional[str]=None,
+            streams: Optional[int]=None,
+            mode: str = "scp",
+            journal: Optional[str]=None,
+            resume: bool = False,
+            compression: str = "off",
+            verify: bool = False):
         """
         Parameters
         ----------
@@ -66,6 +473,72 @@ class SecureCopyProtocol:
         generate_logfile_to: Optional[str]=None
             The path you would like a complete log file of the output of `scp`.
 
+        streams: Optional[int]=None
+            The number of concurrent `scp` streams, by default the number 
+            picked by `autotune` for this host, or 1 if it was not tuned. 
+            When `source_path` is a folder and `streams` > 1, the files are 
+            split into groups of roughly equal total size, each group is 
+            sent over its own connection and all of them update the same 
+            progress bar. The folder is recreated at 
+            `save_path/<folder name>`. With the 
+            "sftp-pipelined" backend it is the number of files in flight.
+            A file of at least 1 GiB is split into `streams` byte ranges that
+            are sent at once and written at their offsets of the remote copy,
+            which is then checked range by range. This needs GNU `dd` and 
+            `truncate` on the remote machine, and without them the file is 
+            sent with a single `scp`.
+
+        mode: str, default="scp"
+            Either "scp" or "tarstream". With "tarstream" everything is sent 
+            as one tar archive through a single ssh channel and unpacked on 
+            the remote machine, which avoids the per file round trips of 
+            `scp -r` for folders with many small files. With `streams` > 1
+            the files are split into that many archives of roughly equal 
+            size, each over its own channel. `source_path` is recreated at 
+            `save_path/<name>` and progress is reported per file from the 
+            archive member headers.
+
+        journal: Optional[str]=None
+            A file in which every finished file is recorded. `source_path` is
+            then recreated at `save_path/<name>`, whether it is a file or a 
+            folder.
+
+        resume: bool, default=False
+            Continue an interrupted transfer that used the same `journal`. 
+            Files recorded in the journal are skipped and partially sent 
+            files of at least 1 MiB are continued from where they stopped.
+
+        compression: str, default="off"
+            Either "off", "on" or "auto". With "auto" a few files of every 
+            extension are sampled first and only what compresses well is 
+            compressed. When the files are split over several `scp` calls 
+            the choice is made per extension, otherwise for the whole 
+            transfer. `scp` can only use the zlib compression of ssh, which 
+            has no effect on calls that go over the master connection of a 
+            session, while "tarstream" uses zstd when both machines have it.
+            The choice is printed and published as a `CompressionChosen` 
+            event.
+
+        verify: bool, default=False
+            Check that every file arrived intact. The sha256 of each file is
+            computed while it is read for sending, so the disk is read once.
+            `scp` reads the files itself, so with the scp backend they are 
+            sent as in "tarstream" instead, over `streams` archives. The 
+            hashes of the remote copies are computed in one remote command. 
+            Files that differ are published as `ChecksumMismatch` events and
+            sent once more, and only those are checked again. A large file 
+            that is split into byte ranges is checked range by range as it 
+            is sent instead. With a `journal`, `scp` is kept and the files 
+            are hashed after it, which reads them a second time. 
+            `source_path` has to arrive at `save_path/<name>`.
+
+        Returns
+        -------
+        Optional[dict]
+            With `verify`, "verified", the relative paths of the files that 
+            match, "resent", the ones that were sent again, and "mismatched",
+            the ones that still differ. None otherwise.
+
         Example
         -------
         >>> from shwrap.transfer import SecureCopyProtocol
@@ -87,43 +560,121 @@ class SecureCopyProtocol:
         >>> )
         """
 
-        if self._system == "Linux":
-            path_to_bash = None
-            with pkg.path('shwrap.transfer._scripts.linux', 'send.sh') as p:
-                path_to_bash = str(p)
+        # the remote folders are about to change
+        self._listings.clear()
+        streams = self._tuned_streams(streams)
 
-        elif self._system == "Darwin":
-            path_to_bash = None
-            with pkg.path('shwrap.transfer._scripts.darwin', 'send.sh') as p:
-                path_to_bash = str(p)
-        else:
-            raise Exception("Operating system in not supported")
+        if not verify:
+            self._put(
+                source_path, save_path, with_tqdm, measure_by, 
+                generate_logfile_to, streams, mode, journal, resume, 
+                compression
+            )
+            return None
+
+        if self.backend == "scp" and mode == "scp" and journal is None:
+            if self._splits(source_path, streams, compression):
+                # the byte ranges are checked as they are sent
+                return self._put(
+                    source_path, save_path, with_tqdm, measure_by, 
+                    generate_logfile_to, streams, mode, journal, resume, 
+                    compression
+                )
+            # scp reads the files itself, so they go through tar instead, 
+            # which hashes them as it reads them
+            mode = "tarstream"
+
+        hashes = {}
+        self._put(
+            source_path, save_path, with_tqdm, measure_by, 
+            generate_logfile_to, streams, mode, journal, resume, 
+            compression, hashes
+        )
+        return self._verify_put(
+            source_path, save_path, hashes, streams, with_tqdm, measure_by, 
+            generate_logfile_to
+        )
+
+    def _put(self, source_path, save_path, with_tqdm, measure_by, 
+             generate_logfile_to, streams, mode, journal, resume, compression,
+             hashes=None):
+        """
+        Send `source_path` the way `put` was asked to. With the 
+        "sftp-pipelined" backend and "tarstream", the sha256 of every file 
+        is stored in `hashes`, if it is given, as the file is read. A file 
+        that is split into byte ranges returns the result of `put` with 
+        `verify`, otherwise None is returned.
+        """
+        if self.backend == "sftp-pipelined":
+            if (
+                mode != "scp" or journal is not None or resume 
+                or compression != "off"
+            ):
+                raise Exception(
+                    "`mode`, `journal`, `resume` and `compression` need the "
+                    "scp backend"
+                )
+            return self._put_sftp(
+                source_path, save_path, streams, with_tqdm, measure_by, 
+                generate_logfile_to, hashes
+            )
+
+        if compression not in ["off", "on", "auto"]:
+            raise Exception(f"Unknown compression: {compression}")
+
+        if mode == "tarstream":
+            return self._put_tarstream(
+                source_path, save_path, with_tqdm, measure_by, 
+                generate_logfile_to, compression, hashes, streams
+            )
+        elif mode != "scp":
+            raise Exception(f"Unknown mode: {mode}")
+
+        path_to_bash = self._path_to_bash('send.sh')
 
+        if journal is not None:
+            return self._put_journaled(
+                path_to_bash, source_path, save_path, journal, resume, streams,
+                with_tqdm, measure_by, generate_logfile_to, compression
+            )
+        elif resume:
+            raise Exception("`resume` needs the `journal` of the earlier run")
+
+        if streams > 1 and os.path.isdir(source_path):
+            return self._put_parallel(
+                path_to_bash, source_path, save_path, streams, with_tqdm, 
+                measure_by, generate_logfile_to, compression
+            )
+
+        if self._splits(source_path, streams, compression):
+            return self._put_ranges(
+                source_path, save_path, streams, with_tqdm, measure_by, 
+                generate_logfile_to
+            )
 
         num_files = 1
         if os.path.isdir(source_path):
             num_files = count_all_files(source_path)
+
+        scp_options = ()
+        if compression != "off":
+            if os.path.isdir(source_path):
+                files = [
+                    (entry.path, entry.size) 
+                    for entry in scan_tree(source_path)
+                ]
+            else:
+                files = [(source_path, os.path.getsize(source_path))]
+            if self._plan_compression(files, compression, per_extension=False):
+                scp_options = ("-C",)
         
-        if self.pem is not None:
-            command = [
-                path_to_bash, 
-                "--port", self.port, 
-                "--source-path", source_path, 
-                "--save-path", save_path, 
-                "--user", self.user, 
-                "--ip", self.ip,
-                "--pem", self.pem
-            ]
-        else:
-            command = [
-                path_to_bash, 
-                "--port", self.port, 
-                "--source-path", source_path, 
-                "--save-path", save_path, 
-                "--user", self.user, 
-                "--ip", self.ip, 
-            ]
+        reservation = self.job.reserve()
+        command = self._scp_command(
+            path_to_bash, [source_path], save_path, 
+            scp_options=(*scp_options, *self._limit_options(reservation.rate))
+        )
 
+        log = open_log(generate_logfile_to, self.log_max_bytes)
         try:
             with subprocess.Popen(
                 command,
@@ -142,20 +693,14 @@ class SecureCopyProtocol:
 
                 count = 1
                 
-                if self._system == 'Darwin':
-                    if with_tqdm is False:
-                        raise Exception("At the momemnt, Darwin OS requires tqdm")
-
-                    success = self._darwin(p.stdout, progress_bar, generate_logfile_to,
-                                 count, num_files, measure_by, with_tqdm)
+                if self._system == 'Darwin' and with_tqdm is False:
+                    raise Exception("At the momemnt, Darwin OS requires tqdm")
 
-                elif self._system == "Linux":
-                    success = self._linux(p.stderr, progress_bar, generate_logfile_to,
-                                 count, num_files, measure_by, with_tqdm)
+                success = self._follow(
+                    p, progress_bar, log, count, num_files, measure_by, 
+                    with_tqdm
+                )
 
-                else:
-                    success = "Operating system not supported"
-                    
                 if success:
                     print(f"\n \n {success}")
                 else:
@@ -167,14 +712,25 @@ class SecureCopyProtocol:
         except FileNotFoundError as e:
             print(f"Bash script not found: {e}")
 
+        finally:
+            reservation.release()
+            if log is not None:
+                log.close()
+
         return None
 
+    @_as_job
     def get(self,
             source_path: str, 
             save_path: str,
             with_tqdm: bool = True,
             measure_by: Optional[str]="count",
-            generate_logfile_to: Optional[str]=None):
+            generate_logfile_to: Optional[str]=None,
+            streams: Optional[int]=None,
+            mode: str = "scp",
+            journal: Optional[str]=None,
+            resume: bool = False,
+            compression: str = "off"):
         """
         Parameters
         ----------
@@ -196,6 +752,45 @@ class SecureCopyProtocol:
         generate_logfile_to: Optional[str]=None
             The path you would like a complete log file of the output of `scp`.
 
+        streams: Optional[int]=None
+            The number of concurrent `scp` streams, by default the number 
+            picked by `autotune` for this host, or 1 if it was not tuned. 
+            When `source_path` is a folder and `streams` > 1, the files are 
+            split into groups of roughly equal total size, each group is 
+            sent over its own connection and all of them update the same 
+            progress bar. The folder is recreated at 
+            `save_path/<folder name>`. With the 
+            "sftp-pipelined" backend it is the number of files in flight.
+
+        mode: str, default="scp"
+            Either "scp" or "tarstream". With "tarstream" the remote machine 
+            packs everything into one tar archive that is streamed through a
+            single ssh channel and unpacked here as it arrives, which avoids
+            the per file round trips of `scp -r` for folders with many small
+            files. `source_path` is recreated at `save_path/<name>` and 
+            progress is reported per file from the archive member headers.
+
+        journal: Optional[str]=None
+            A file in which every finished file is recorded. `source_path` is
+            then recreated at `save_path/<name>`, whether it is a file or a 
+            folder.
+
+        resume: bool, default=False
+            Continue an interrupted transfer that used the same `journal`. 
+            Files recorded in the journal are skipped and partially received 
+            files of at least 1 MiB are continued from where they stopped.
+
+        compression: str, default="off"
+            Either "off", "on" or "auto". With "auto" a few files of every 
+            extension are sampled first and only what compresses well is 
+            compressed. When the files are split over several `scp` calls 
+            the choice is made per extension, otherwise for the whole 
+            transfer. `scp` can only use the zlib compression of ssh, which 
+            has no effect on calls that go over the master connection of a 
+            session, while "tarstream" uses zstd when both machines have it.
+            The choice is printed and published as a `CompressionChosen` 
+            event.
+
         Example
         -------
         >>> from shwrap.transfer import SecureCopyProtocol
@@ -217,43 +812,95 @@ class SecureCopyProtocol:
         >>> )
         """
 
-        if self._system == "Linux":
-            path_to_bash = None
-            with pkg.path('shwrap.transfer._scripts.linux', 'receive.sh') as p:
-                path_to_bash = str(p)
+        streams = self._tuned_streams(streams)
 
-        elif self._system == "Darwin":
-            path_to_bash = None
-            with pkg.path('shwrap.transfer._scripts.darwin', 'receive.sh') as p:
-                path_to_bash = str(p)
+        if self.backend == "sftp-pipelined":
+            if (
+                mode != "scp" or journal is not None or resume 
+                or compression != "off"
+            ):
+                raise Exception(
+                    "`mode`, `journal`, `resume` and `compression` need the "
+                    "scp backend"
+                )
+            return self._get_sftp(
+                source_path, save_path, streams, with_tqdm, measure_by, 
+                generate_logfile_to
+            )
 
-        else:
-            raise Exception("Operating system in not supported")
+        if compression not in ["off", "on", "auto"]:
+            raise Exception(f"Unknown compression: {compression}")
 
-        num_files = 1
-        if os.path.isdir(source_path):
-            num_files = count_all_files(source_path)
-        
-        if self.pem is not None:
-            command = [
-                path_to_bash, 
-                "--port", self.port, 
-                "--source-path", source_path, 
-                "--save-path", save_path, 
-                "--user", self.user, 
-                "--ip", self.ip,
-                "--pem", self.pem
-            ]
-        else:
-            command = [
-                path_to_bash, 
-                "--port", self.port, 
-                "--source-path", source_path, 
-                "--save-path", save_path, 
-                "--user", self.user, 
-                "--ip", self.ip, 
+        if mode == "tarstream":
+            return self._get_tarstream(
+                source_path, save_path, with_tqdm, measure_by, 
+                generate_logfile_to, compression
+            )
+        elif mode != "scp":
+            raise Exception(f"Unknown mode: {mode}")
+
+        path_to_bash = self._path_to_bash('receive.sh')
+
+        if journal is not None:
+            return self._get_journaled(
+                path_to_bash, source_path, save_path, journal, resume, streams,
+                with_tqdm, measure_by, generate_logfile_to, compression
+            )
+        elif resume:
+            raise Exception("`resume` needs the `journal` of the earlier run")
+
+        if streams > 1:
+            return self._get_parallel(
+                path_to_bash, source_path, save_path, streams, with_tqdm, 
+                measure_by, generate_logfile_to, compression
+            )
+
+        return self._get_single(
+            path_to_bash, source_path, save_path, with_tqdm, measure_by, 
+            generate_logfile_to, compression
+        )
+
+    def _get_single(self, path_to_bash, source_path, save_path, with_tqdm, 
+                    measure_by, generate_logfile_to, compression="off"):
+        """
+        Receive `source_path` with a single `scp` call.
+        """
+        # the sizes of the remote files give the bar an accurate total, and
+        # without a bar or compression they are not worth a round trip
+        listing = None
+        if with_tqdm or compression != "off":
+            try:
+                listing = self._cached_listing(source_path)
+            except Exception as e:
+                print(f"\n \n Could not list {source_path}: {e}")
+
+        sizes, num_files = None, None
+        if listing is not None:
+            sizes = [entry[0] for entry in listing.values()]
+            num_files = len(sizes)
+
+        scp_options = ()
+        if listing is None:
+            if compression == "on":
+                scp_options = ("-C",)
+        elif compression != "off":
+            files = [
+                (posixpath.join(source_path, rel_path) if rel_path 
+                 else source_path, entry[0])
+                for rel_path, entry in listing.items()
             ]
+            if self._plan_compression(
+                files, compression, remote=True, per_extension=False
+            ):
+                scp_options = ("-C",)
+        
+        reservation = self.job.reserve()
+        command = self._scp_command(
+            path_to_bash, [source_path], save_path, 
+            scp_options=(*scp_options, *self._limit_options(reservation.rate))
+        )
 
+        log = open_log(generate_logfile_to, self.log_max_bytes)
         try:
             with subprocess.Popen(
                 command,
@@ -266,26 +913,24 @@ class SecureCopyProtocol:
                 progress_bar = None
                 if with_tqdm:
                     progress_bar = tqdm(
-                        desc='upload', ncols=60, total=num_files, 
+                        desc='download', ncols=60, 
+                        total=(
+                            None if sizes is None 
+                            else self._progress_total(sizes, measure_by)
+                        ), 
                         unit='files', unit_scale=1, leave=True
                     )
 
                 count = 1
 
-                if self._system == 'Darwin':
-                    if with_tqdm is False:
-                        raise Exception("At the momemnt, Darwin OS requires tqdm")
+                if self._system == 'Darwin' and with_tqdm is False:
+                    raise Exception("At the momemnt, Darwin OS requires tqdm")
 
-                    success = self._darwin(p.stdout, progress_bar, generate_logfile_to,
-                                 count, num_files, measure_by, with_tqdm)
+                success = self._follow(
+                    p, progress_bar, log, count, num_files, measure_by, 
+                    with_tqdm
+                )
 
-                elif self._system == "Linux":
-                    success = self._linux(p.stderr, progress_bar, generate_logfile_to,
-                                 count, num_files, measure_by, with_tqdm)
-
-                else:
-                    success = "Operating system not supported"
-                
                 if success:
                     print(f"\n \n {success}")
                 else:
@@ -297,66 +942,1740 @@ class SecureCopyProtocol:
         except FileNotFoundError as e:
             print(f"Bash script not found: {e}")
 
+        finally:
+            reservation.release()
+            if log is not None:
+                log.close()
+
         return None
     
+    @_as_job
+    def sync(self,
+             source_path: str, 
+             save_path: str,
+             dry_run: bool = False,
+             checksum: bool = False,
+             with_tqdm: bool = True,
+             measure_by: Optional[str]="count",
+             generate_logfile_to: Optional[str]=None,
+             streams: Optional[int]=None):
+        """
+        Send only the files of the local folder `source_path` that are missing
+        or out of date in `save_path/<folder name>` on the remote machine. The
+        remote listing is fetched in a single round trip and compared with a
+        scan of the local folder.
+
+        Parameters
+        ----------
+        source_path: str
+            The local folder to sync.
+
+        save_path: str
+            The remote folder that holds (or will hold) the copy of 
+            `source_path`.
+
+        dry_run: bool, default=False
+            Only work out the plan, nothing is transfered.
+
+        checksum: bool, default=False
+            Compare files of equal size by their sha256 instead of their 
+            modification time. The remote hashes are computed in the same 
+            round trip as the listing.
+
+        with_tqdm, measure_by, generate_logfile_to, streams
+            The same as for `put`.
+
+        Returns
+        -------
+        dict
+            The plan. "new" and "changed" hold the relative paths that are 
+            (or would be) sent, "unchanged" the ones that are skipped and 
+            "remote_only" the ones that only exist on the remote machine.
+
+        Example
+        -------
+        >>> scp = SecureCopyProtocol(user, ip , port, pem)
+        >>> plan = scp.sync(source_path, save_path, dry_run=True)
+        >>> print(len(plan["new"]) + len(plan["changed"]), "files to send")
+        >>> scp.sync(source_path, save_path)
+        """
+        if not os.path.isdir(source_path):
+            raise Exception("`source_path` must be a folder to sync it")
+
+        self._listings.clear()
+        streams = self._tuned_streams(streams)
+
+        source_path = os.path.normpath(source_path)
+        remote_root = posixpath.join(save_path, os.path.basename(source_path))
+        files, dirs = self._scan_local(source_path)
+        remote = self._list_remote(remote_root, checksum=checksum)
+
+        plan = {"new": [], "changed": [], "unchanged": [], "remote_only": []}
+        for rel_path, (path, size, mtime) in files.items():
+            if rel_path not in remote:
+                plan["new"].append(rel_path)
+            elif self._is_changed(path, size, mtime, remote[rel_path], checksum):
+                plan["changed"].append(rel_path)
+            else:
+                plan["unchanged"].append(rel_path)
+        plan["remote_only"] = [
+            rel_path for rel_path in remote if rel_path not in files
+        ]
+
+        if dry_run:
+            return plan
+
+        to_send = plan["new"] + plan["changed"]
+        if not to_send:
+            print("\n \n Everything is up to date")
+            return plan
+
+        # -p keeps the modification times so the next sync can compare them
+        self._send_files(
+            self._path_to_bash('send.sh'), remote_root, 
+            [(rel_path, files[rel_path]) for rel_path in to_send], dirs, 
+            streams, with_tqdm, measure_by, generate_logfile_to, 
+            scp_options=("-p",)
+        )
+        return plan
+
     @staticmethod
-    def _darwin(stdout, progress_bar, generate_logfile_to, count, 
-                num_files, measure_by, with_tqdm):
+    def _is_changed(path, size, mtime, remote_entry, checksum):
         """
-        darwin logic
+        Whether the local file differs from its remote `(size, mtime, sha256)`
+        entry. Without `checksum` a file only counts as changed when it was
+        modified after the remote copy was written.
         """
+        remote_size, remote_mtime, remote_sha256 = remote_entry
+        if size != remote_size:
+            return True
+        if checksum:
+            return sha256sum(path) != remote_sha256
+        # scp -p keeps whole seconds only
+        return mtime >= remote_mtime + 1
 
-        for line in stdout:
-            if "100%" in line:
-                s_line = line.strip().split()
-                current_file = s_line[0]
-                file_size = float(s_line[2])
+    def _path_to_bash(self, script: str):
+        """
+        The path to one of the bundled bash scripts for the current operating
+        system.
+        """
+        if self._system == "Linux":
+            package = 'shwrap.transfer._scripts.linux'
+        elif self._system == "Darwin":
+            package = 'shwrap.transfer._scripts.darwin'
+        else:
+            raise Exception("Operating system in not supported")
 
-                if not with_tqdm:
-                    print(f"{count} / {num_files} : {current_file}", end="")
-                    print('\033[1A', end='\x1b[2K')
-                    count += 1
+        with pkg.path(package, script) as p:
+            return str(p)
 
-                else:
-                    if measure_by == "count":
-                        progress_bar.update(1)
-                    elif measure_by == "KiB":
-                        progress_bar.update(file_size / 1000)
-                    elif measure_by == "MiB":
-                        progress_bar.update(file_size / 1000000)
+    def _scp_command(self, path_to_bash: str, source_paths: list, 
+                     save_path: str, multiplex: bool = True, 
+                     scp_options=()):
+        """
+        The arguments for a call to `send.sh` or `receive.sh`. With 
+        `multiplex` the call goes over the master connection of an open 
+        session. `scp_options` are extra flags handed to `scp` as they are.
+        """
+        command = [path_to_bash, "--port", self.port]
+        for option in scp_options:
+            command += ["--scp-option", option]
+        for source_path in source_paths:
+            command += ["--source-path", source_path]
+        command += ["--save-path", save_path, "--user", self.user, "--ip", self.ip]
+        if self.pem is not None:
+            command += ["--pem", self.pem]
+        if multiplex:
+            command += self._ssh_options()
+        return command + self._cipher_options() + self._extra_options()
+
+    @staticmethod
+    def _limit_options(rate):
+        """
+        The `scp` flags that cap it at `rate` bytes per second, or none if 
+        `rate` is None. `scp -l` takes Kbit/s.
+        """
+        if rate is None:
+            return ()
+        return ("-l", str(max(1, int(rate * 8 / 1000))))
+
+    def _ssh_options(self):
+        """
+        The `--ssh-option` arguments that route a call through the master
+        connection of an open session.
+        """
+        if self._control_dir is None:
+            return []
+        return [
+            "--ssh-option", f"ControlPath={self.control_path}",
+            "--ssh-option", "ControlMaster=no",
+        ]
+
+    def _ssh_command(self, *args, tuned=True):
+        """
+        The arguments for a call to `ssh.sh`. With `tuned` the cipher picked
+        by `autotune` is used.
+        """
+        command = [
+            self._path_to_bash('ssh.sh'), 
+            "--port", self.port, 
+            "--user", self.user, 
+            "--ip", self.ip,
+            *args
+        ]
+        if tuned:
+            command += self._cipher_options()
+        if self.pem is not None:
+            command += ["--pem", self.pem]
+        return command + self._extra_options()
+
+    def _extra_options(self):
+        """
+        The `--ssh-option` arguments for `self.ssh_options`.
+        """
+        command = []
+        for key, value in self.ssh_options.items():
+            command += ["--ssh-option", f"{key}={value}"]
+        return command
+
+    def _cipher_options(self):
+        """
+        The `--ssh-option` arguments for the cipher picked by `autotune`.
+        """
+        tuning = _TUNINGS.get(self._host_key())
+        if tuning is None or tuning["cipher"] is None:
+            return []
+        return ["--ssh-option", f"Ciphers={tuning['cipher']}"]
+
+    def _host_key(self):
+        """
+        The key of this host in the settings found by `autotune`.
+        """
+        return (self.ip, str(self.port))
+
+    @staticmethod
+    def _local_ciphers():
+        """
+        The ciphers of `_CIPHERS` that the local ssh supports.
+        """
+        try:
+            result = subprocess.run(
+                ["ssh", "-Q", "cipher"], capture_output=True, text=True
+            )
+        except FileNotFoundError:
+            return []
+        available = result.stdout.split()
+        return [cipher for cipher in _CIPHERS if cipher in available]
+
+    def _probe(self, num_bytes: int, cipher: Optional[str]=None):
+        """
+        Send `num_bytes` to the remote machine over a new ssh connection with
+        `cipher` and return how many seconds it took, or None if it failed.
+        """
+        command = self._ssh_command("--command", "cat > /dev/null", tuned=False)
+        if cipher is not None:
+            command += ["--ssh-option", f"Ciphers={cipher}"]
+
+        # random data, so that ssh compression can not help
+        chunk = os.urandom(min(num_bytes, 1 << 20))
+        start = time.time()
+        p = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, 
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            sent = 0
+            while sent < num_bytes:
+                p.stdin.write(chunk[:num_bytes - sent])
+                sent += len(chunk)
+            p.stdin.close()
+        except BrokenPipeError:
+            pass
+        if p.wait() != 0:
+            return None
+        return time.time() - start
+
+    def _tuned_streams(self, streams):
+        """
+        `streams`, or when it is None the number picked by `autotune`.
+        """
+        if streams is not None:
+            return streams
+        tuning = _TUNINGS.get(self._host_key())
+        return 1 if tuning is None else tuning["streams"]
+
+    def _control(self, action: str, control_path: Optional[str]=None):
+        """
+        Start ("start"), query ("check") or stop ("exit") the master 
+        connection of the session, or the one at `control_path`. The 
+        backgrounded master keeps stderr open, so it is collected in a file 
+        rather than a pipe.
+        """
+        command = self._ssh_command(
+            "--control", action,
+            "--ssh-option", f"ControlPath={control_path or self.control_path}",
+            "--ssh-option", f"ControlPersist={self.persist}",
+        )
+        with tempfile.TemporaryFile(mode="w+") as stderr:
+            result = subprocess.run(
+                command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, 
+                stderr=stderr
+            )
+            stderr.seek(0)
+            result.stderr = stderr.read()
+        return result
+
+    @contextmanager
+    def _stream_connection(self):
+        """
+        A master connection of its own for one of several streams, so that
+        the `scp` calls of the stream share one handshake but no tcp 
+        connection with the other streams. Yields the `--ssh-option` 
+        arguments that route a call through it, or none if it could not be
+        started.
+        """
+        control_dir = tempfile.mkdtemp(prefix="shwrap-")
+        control_path = os.path.join(control_dir, "master")
+        try:
+            if self._control("start", control_path).returncode != 0:
+                yield []
+                return
+            try:
+                yield [
+                    "--ssh-option", f"ControlPath={control_path}",
+                    "--ssh-option", "ControlMaster=no",
+                ]
+            finally:
+                self._control("exit", control_path)
+        finally:
+            shutil.rmtree(control_dir, ignore_errors=True)
+
+    def _ssh(self, remote_command: str, stdin: Optional[str]=None):
+        """
+        Run `remote_command` on the remote machine and return its stdout.
+        """
+        if self._sftp is not None and self._sftp.connected:
+            return self._sftp.exec(remote_command, stdin)
+
+        command = self._ssh_command(
+            "--command", remote_command, *self._ssh_options()
+        )
+
+        if stdin is None:
+            result = subprocess.run(
+                command, stdin=subprocess.DEVNULL, capture_output=True, 
+                text=True
+            )
+        else:
+            result = subprocess.run(
+                command, input=stdin, capture_output=True, text=True
+            )
+
+        if result.returncode != 0:
+            raise Exception(f"Remote command failed: {result.stderr.strip()}")
+
+        return result.stdout
+
+    def _list_remote(self, source_path: str, checksum: bool = False):
+        """
+        List every file below `source_path` on the remote machine in a single
+        round trip. Returns a dict mapping each relative path to a 
+        `(size, mtime, sha256)` tuple, where `sha256` is None unless 
+        `checksum` is set. A `source_path` that is a file gives a single 
+        entry with an empty relative path and a missing `source_path` gives
+        an empty dict.
+
+        GNU `find` and `sha256sum` are used when the remote machine has them.
+        Otherwise, on macOS and the BSDs, the files are listed with `stat` 
+        and hashed with `shasum`, one line each, and the modification times 
+        are whole seconds.
+        """
+        root = shlex.quote(source_path)
+        remote_command = (
+            f"if [ -e {root} ]; then "
+            f"if find {root} -maxdepth 0 -printf '' 2>/dev/null; then "
+            f"find {root} -type f -printf '%s\\t%T@\\t%P\\0'; "
+            f"else printf '\\2'; "
+            f"find {root} -type f -exec stat -f '%z%t%m%t%N' {{}} +; fi; fi"
+        )
+        if checksum:
+            remote_command += (
+                f"; printf '\\1'; if [ -d {root} ]; then cd {root} && "
+                f"if command -v sha256sum >/dev/null; then "
+                f"find . -type f -print0 | xargs -0 -r sha256sum -z; "
+                f"else find . -type f -exec shasum -a 256 {{}} + | tr '\\n' '\\0'; "
+                f"fi; fi"
+            )
+        out = self._ssh(remote_command)
+
+        hashes = {}
+        if checksum:
+            out, hashed = out.split("\1", 1)
+            for entry in hashed.split("\0"):
+                if entry:
+                    hashes[entry[66:].removeprefix("./")] = entry[:64]
+
+        # `stat` gives the paths as found, one per line
+        separator, full_paths = "\0", out.startswith("\2")
+        if full_paths:
+            separator, out = "\n", out[1:]
+
+        listing = {}
+        for entry in out.split(separator):
+            if not entry:
+                continue
+            size, mtime, rel_path = entry.split("\t", 2)
+            if full_paths:
+                rel_path = rel_path[len(source_path):].lstrip("/")
+            listing[rel_path] = (int(size), float(mtime), hashes.get(rel_path))
+        return listing
+
+    def _cached_listing(self, source_path: str, refresh: bool = False):
+        """
+        `_list_remote` of `source_path`, ordered from the largest file to the
+        smallest and reused for `listing_ttl` seconds.
+        """
+        source_path = posixpath.normpath(source_path)
+
+        with self._listings_lock:
+            cached = self._listings.get(source_path)
+        if (
+            refresh or cached is None 
+            or time.monotonic() - cached[0] > self.listing_ttl
+        ):
+            listing = self._list_remote(source_path)
+            listing = dict(
+                sorted(listing.items(), key=lambda item: -item[1][0])
+            )
+            cached = (time.monotonic(), listing)
+            with self._listings_lock:
+                self._listings[source_path] = cached
+        return cached[1]
+
+    @staticmethod
+    def _scan_local(source_path: str):
+        """
+        Walk the local folder `source_path` once. Returns a dict mapping each
+        file's relative posix path to a `(path, size, mtime)` tuple, and the
+        relative posix paths of all folders.
+        """
+        files, dirs = {}, [""]
+        for entry in scan_tree(source_path, include_dirs=True):
+            if entry.is_dir:
+                dirs.append(entry.rel_path)
+            else:
+                files[entry.rel_path] = (entry.path, entry.size, entry.mtime)
+        return files, dirs
+
+    @classmethod
+    def _local_tree(cls, source_path: str, save_path: str):
+        """
+        Where the local `source_path` goes when it is recreated at 
+        `save_path/<name>`. Returns the remote folder that the relative paths
+        start from, the files as `_scan_local` gives them and the relative 
+        folders to create.
+        """
+        source_path = os.path.normpath(source_path)
+        name = os.path.basename(source_path)
 
-            if generate_logfile_to is not None:
-                with open(generate_logfile_to, "a") as log:
-                    _ = log.write(line + "\n")
+        if os.path.isdir(source_path):
+            files, dirs = cls._scan_local(source_path)
+            return posixpath.join(save_path, name), files, dirs
+
+        stat = os.stat(source_path)
+        files = {name: (source_path, stat.st_size, stat.st_mtime)}
+        return save_path, files, [""]
+
+    def _splits(self, source_path: str, streams: int, compression: str):
+        """
+        Whether `put` sends the file `source_path` as byte ranges, which 
+        needs GNU `dd` and `truncate` on the remote machine.
+        """
+        if not (
+            streams > 1 and compression == "off" 
+            and not os.path.isdir(source_path)
+            and os.path.getsize(source_path) >= _SPLIT_MIN_SIZE
+        ):
+            return False
+
+        if not self._has_gnu_dd():
+            print(
+                f"\n \n {self.ip} has no GNU dd, {source_path} is sent as a "
+                f"single stream"
+            )
+            return False
+        return True
+
+    def _has_gnu_dd(self):
+        """
+        Whether the remote machine has GNU `dd` and `truncate`. It is asked 
+        once per host.
+        """
+        key = self._host_key()
+        if key not in _GNU_DD:
+            try:
+                out = self._ssh(
+                    "command -v truncate >/dev/null && "
+                    "dd if=/dev/null of=/dev/null bs=1M count=0 "
+                    "iflag=skip_bytes,count_bytes oflag=seek_bytes "
+                    "conv=notrunc status=none 2>/dev/null && echo gnu; true"
+                )
+                _GNU_DD[key] = out.strip() == "gnu"
+            except Exception:
+                # asked again next time, the failure may have been passing
+                return False
+        return _GNU_DD[key]
+
+    def _remote_hashes(self, remote_paths: list):
+        """
+        The sha256 of each of the remote files, computed in one remote 
+        command with `sha256sum`, or `shasum` on macOS and the BSDs. Files 
+        that are missing are left out. Raises an Exception if the remote 
+        machine has neither.
+        """
+        out = self._ssh(
+            "if command -v sha256sum >/dev/null; then "
+            "xargs -0 -r sha256sum -z 2>/dev/null; "
+            "elif command -v shasum >/dev/null; then "
+            "xargs -0 shasum -a 256 2>/dev/null | tr '\\n' '\\0'; "
+            "else echo 'neither sha256sum nor shasum is installed' >&2; exit 1; "
+            "fi; exit 0", 
+            "\0".join(remote_paths)
+        )
+        hashes = {}
+        for entry in out.split("\0"):
+            if entry:
+                hashes[entry[66:]] = entry[:64]
+        return hashes
+
+    def _verify_put(self, source_path, save_path, hashes, streams, with_tqdm,
+                    measure_by, generate_logfile_to, retries=1):
+        """
+        Compare the `hashes` of the files of `source_path` with those of 
+        their copies below `save_path/<name>` and send the ones that differ 
+        again, up to `retries` times. Returns the result of `put`.
+        """
+        remote_root, files, _ = self._local_tree(source_path, save_path)
+        remote_paths = {
+            rel_path: posixpath.join(remote_root, rel_path) 
+            for rel_path in files
+        }
+        # the backends store the paths as they joined them
+        hashes = {
+            os.path.normpath(path): sha256 for path, sha256 in hashes.items()
+        }
+        for path, *_ in files.values():
+            # files that were not read for sending, like those skipped on 
+            # resume or sent by `scp` with a journal, are hashed now
+            path = os.path.normpath(path)
+            if path not in hashes:
+                hashes[path] = sha256sum(path)
+
+        pending, resent = list(files), []
+        for attempt in range(retries + 1):
+            remote = self._remote_hashes(
+                [remote_paths[rel_path] for rel_path in pending]
+            )
+            mismatched = []
+            for rel_path in pending:
+                local_sha256 = hashes[os.path.normpath(files[rel_path][0])]
+                remote_sha256 = remote.get(remote_paths[rel_path])
+                if remote_sha256 != local_sha256:
+                    mismatched.append(rel_path)
+                    self._publish(ChecksumMismatch(
+                        rel_path, local_sha256, remote_sha256, time.time()
+                    ))
+
+            if not mismatched or attempt == retries:
+                break
+
+            print(f"\n \n Sending {len(mismatched)} files again")
+            self._resend(
+                remote_root, 
+                [(rel_path, files[rel_path]) for rel_path in mismatched],
+                streams, with_tqdm, measure_by, generate_logfile_to
+            )
+            resent += [
+                rel_path for rel_path in mismatched if rel_path not in resent
+            ]
+            pending = mismatched
+
+        if mismatched:
+            print(
+                f"\n \n {len(mismatched)} files failed verification: "
+                + ", ".join(mismatched)
+            )
+        else:
+            print(f"\n \n Verified {len(files)} files")
+
+        return {
+            "verified": [
+                rel_path for rel_path in files if rel_path not in mismatched
+            ],
+            "resent": resent,
+            "mismatched": mismatched,
+        }
+
+    def _resend(self, remote_root, files, streams, with_tqdm, measure_by, 
+                generate_logfile_to):
+        """
+        Send the `(relative_path, (path, size, ...))` files below 
+        `remote_root` again with the backend of this instance.
+        """
+        dirs = sorted({posixpath.dirname(rel_path) for rel_path, _ in files})
+        if self.backend == "scp":
+            return self._send_files(
+                self._path_to_bash('send.sh'), remote_root, files, dirs, 
+                streams, with_tqdm, measure_by, generate_logfile_to
+            )
+
+        def prepare():
+            self._ssh(
+                "xargs -0 mkdir -p", 
+                "\0".join(posixpath.join(remote_root, d) for d in dirs)
+            )
+            return [
+                (path, posixpath.join(remote_root, rel_path), size)
+                for rel_path, (path, size, *_) in files
+            ]
+
+        return self._run_sftp(
+            "put", prepare, streams, 'upload', with_tqdm, measure_by, 
+            generate_logfile_to
+        )
+
+    def _plan_compression(self, files, compression, remote=False, 
+                          per_extension=True, codec="zlib"):
+        """
+        Decide which of the `(path, size)` files, local ones or remote ones, 
+        are compressed with `codec`. With "auto" a few files of every 
+        extension are sampled, and the choice is made for every extension or,
+        without `per_extension`, once for all files. The choice is printed 
+        and published. Returns the set of paths to compress.
+        """
+        if compression == "off" or not files:
+            return set()
+
+        groups = {}
+        for path, size in files:
+            extension = posixpath.splitext(path)[1].lower()
+            groups.setdefault(extension, []).append((path, size))
 
+        if compression == "auto":
+            ratios = self._sample_ratios(groups, remote)
+        else:
+            ratios = {extension: float("nan") for extension in groups}
+
+        def weighted_ratio(extensions):
+            sizes = [
+                (size, ratios[extension]) 
+                for extension in extensions for _, size in groups[extension]
+            ]
+            total = sum(size for size, _ in sizes)
+            if total == 0:
+                return sum(ratio for _, ratio in sizes) / len(sizes)
+            return sum(size * ratio for size, ratio in sizes) / total
+
+        if compression == "on":
+            chosen = set(groups)
+        elif per_extension:
+            chosen = {
+                extension for extension, ratio in ratios.items() 
+                if ratio <= _COMPRESS_BELOW
+            }
+        elif weighted_ratio(groups) <= _COMPRESS_BELOW:
+            chosen = set(groups)
+        else:
+            chosen = set()
+
+        report = []
+        for name, extensions in [
+            (codec, sorted(chosen)), ("none", sorted(set(groups) - chosen))
+        ]:
+            if not extensions:
+                continue
+            ratio = weighted_ratio(extensions)
+            num_files = sum(len(groups[extension]) for extension in extensions)
+            self._publish(CompressionChosen(
+                name, tuple(extensions), num_files, ratio, time.time()
+            ))
+            sampled = "" if math.isnan(ratio) else f", sampled ratio {ratio:.2f}"
+            report.append(f"{name} for {num_files} files{sampled}")
+        print(f"\n \n Compression: {'; '.join(report)}")
+
+        return {
+            path for extension in chosen for path, _ in groups[extension]
+        }
+
+    def _sample_ratios(self, groups, remote):
+        """
+        The compressed over the raw size of the start of a few files of every
+        extension in `groups`. Extensions of formats that are compressed 
+        already are not sampled.
+        """
+        samples = {}
+        for extension, group in groups.items():
+            if extension not in COMPRESSED_EXTENSIONS:
+                step = max(1, len(group) // _SAMPLES_PER_EXTENSION)
+                samples[extension] = [
+                    path for path, _ in group[::step][:_SAMPLES_PER_EXTENSION]
+                ]
+
+        paths = [path for group in samples.values() for path in group]
+        if remote:
+            sampled = self._sample_remote(paths)
+        else:
+            sampled = {
+                path: sample_compression(path, _SAMPLE_BYTES) for path in paths
+            }
+
+        ratios = {}
+        for extension in groups:
+            raw = sum(sampled[path][0] for path in samples.get(extension, []))
+            compressed = sum(
+                sampled[path][1] for path in samples.get(extension, [])
+            )
+            ratios[extension] = compressed / raw if raw else 1.0
+        return ratios
+
+    def _sample_remote(self, paths):
+        """
+        `sample_compression` of remote `paths`, with gzip, in a single round 
+        trip.
+        """
+        if not paths:
+            return {}
+
+        out = self._ssh(
+            f"xargs -0 -n 1 sh -c '"
+            f"head -c {_SAMPLE_BYTES} \"$0\" | wc -c; "
+            f"head -c {_SAMPLE_BYTES} \"$0\" | gzip -1 | wc -c'",
+            "\0".join(paths)
+        )
+        counts = [int(count) for count in out.split()]
+        return {
+            path: (counts[2 * i], counts[2 * i + 1]) 
+            for i, path in enumerate(paths)
+        }
+
+    def _tar_codec(self, files, compression, remote):
+        """
+        The codec of a tarstream of the `(path, size)` files: "zstd" when 
+        both machines have it, otherwise "zlib", or "none" when compression 
+        is off or does not pay off.
+        """
+        if compression == "off":
+            return "none"
+
+        codec = "zstd" if self._has_zstd() else "zlib"
+        if not self._plan_compression(
+            files, compression, remote=remote, per_extension=False, 
+            codec=codec
+        ):
+            return "none"
+        return codec
+
+    def _has_zstd(self):
+        """
+        Whether both machines have `zstd`.
+        """
+        if shutil.which("zstd") is None:
+            return False
+        try:
+            self._ssh("command -v zstd")
+        except Exception:
+            return False
+        return True
 
     @staticmethod
-    def _linux(stderr, progress_bar, generate_logfile_to, count, 
-                num_files, measure_by, with_tqdm):
+    def _codec_options(codec):
+        """
+        The `--ssh-option` arguments that turn on the compression of ssh.
+        """
+        if codec == "zlib":
+            return ["--ssh-option", "Compression=yes"]
+        return []
+
+    def _put_parallel(self, path_to_bash, source_path, save_path, streams, 
+                      with_tqdm, measure_by, generate_logfile_to, 
+                      compression="off"):
+        """
+        Send the folder `source_path` over `streams` concurrent `scp` calls.
+        """
+        source_path = os.path.normpath(source_path)
+        remote_root = posixpath.join(save_path, os.path.basename(source_path))
+        files, dirs = self._scan_local(source_path)
+
+        return self._send_files(
+            path_to_bash, remote_root, files.items(), dirs, streams, 
+            with_tqdm, measure_by, generate_logfile_to, 
+            compression=compression
+        )
+
+    def _send_files(self, path_to_bash, remote_root, files, dirs, streams, 
+                    with_tqdm, measure_by, generate_logfile_to, 
+                    scp_options=(), on_done=None, compression="off"):
         """
-        linux logic
+        Send `(relative_path, (path, size, ...))` files below `remote_root` 
+        over `streams` concurrent `scp` calls, after creating the relative 
+        folders `dirs` in a single round trip. `on_done` is called with the 
+        local path of every file that is known to have arrived. Files whose
+        extension is chosen for `compression` go in their own `scp` calls.
         """
+        self._ssh(
+            "xargs -0 mkdir -p", 
+            "\0".join(posixpath.join(remote_root, d) for d in dirs)
+        )
 
-        for line in stderr:
-            if "Permission denied" in line:
-                return "Permission denied. Check the pem file."
-            if line.startswith("Sending"):
-                current_file =line.split(" ")[-1]
-                file_size =float(line.split(" ")[-2])
+        paths, sizes, file_dirs = [], [], {}
+        for rel_path, (path, size, *_) in files:
+            paths.append(path)
+            sizes.append(size)
+            file_dirs[path] = posixpath.join(
+                remote_root, posixpath.dirname(rel_path)
+            )
 
-                if not with_tqdm:
-                    print(f"{count} / {num_files} : {current_file}", end="")
-                    print('\033[1A', end='\x1b[2K')
-                    count += 1
+        compressed = self._plan_compression(
+            list(zip(paths, sizes)), compression
+        )
 
+        shards = shard_by_size(paths, sizes, streams)
+        batches = [
+            self._batch_by_dir(shard, file_dirs.__getitem__, compressed) 
+            for shard in shards
+        ]
+
+        return self._run_parallel(
+            path_to_bash, batches, self._progress_total(sizes, measure_by),
+            'upload', with_tqdm, measure_by, generate_logfile_to, scp_options,
+            on_done
+        )
+
+    def _get_parallel(self, path_to_bash, source_path, save_path, streams, 
+                      with_tqdm, measure_by, generate_logfile_to, 
+                      compression="off"):
+        """
+        Receive the remote folder `source_path` over `streams` concurrent 
+        `scp` calls.
+        """
+        source_path = posixpath.normpath(source_path)
+        listing = self._cached_listing(source_path)
+        if list(listing) == [""]:
+            return self._get_single(
+                path_to_bash, source_path, save_path, with_tqdm, measure_by, 
+                generate_logfile_to, compression
+            )
+
+        local_root = os.path.join(save_path, posixpath.basename(source_path))
+        return self._receive_files(
+            path_to_bash, source_path, local_root, listing.items(), streams,
+            with_tqdm, measure_by, generate_logfile_to, 
+            compression=compression
+        )
+
+    def _receive_files(self, path_to_bash, remote_root, local_root, files, 
+                       streams, with_tqdm, measure_by, generate_logfile_to,
+                       on_done=None, compression="off"):
+        """
+        Receive `(relative_path, (size, ...))` files from below `remote_root`
+        into `local_root` over `streams` concurrent `scp` calls. `on_done` is
+        called with the remote path of every file that is known to have 
+        arrived. Files whose extension is chosen for `compression` go in 
+        their own `scp` calls.
+        """
+        remote_files, sizes, file_dirs = [], [], {}
+        for rel_path, (size, *_) in files:
+            remote_file = posixpath.join(remote_root, rel_path)
+            local_dir = os.path.join(
+                local_root, *posixpath.dirname(rel_path).split("/")
+            )
+            os.makedirs(local_dir, exist_ok=True)
+            remote_files.append(remote_file)
+            sizes.append(size)
+            file_dirs[remote_file] = local_dir
+
+        compressed = self._plan_compression(
+            list(zip(remote_files, sizes)), compression, remote=True
+        )
+
+        shards = shard_by_size(remote_files, sizes, streams)
+        batches = [
+            self._batch_by_dir(shard, file_dirs.__getitem__, compressed) 
+            for shard in shards
+        ]
+
+        return self._run_parallel(
+            path_to_bash, batches, self._progress_total(sizes, measure_by),
+            'download', with_tqdm, measure_by, generate_logfile_to,
+            on_done=on_done
+        )
+
+    def _put_journaled(self, path_to_bash, source_path, save_path, journal, 
+                       resume, streams, with_tqdm, measure_by, 
+                       generate_logfile_to, compression="off"):
+        """
+        Send `source_path` to `save_path/<name>` while recording every 
+        finished file in `journal`.
+        """
+        remote_root, files, dirs = self._local_tree(source_path, save_path)
+
+        with Journal(journal, resume=resume) as log:
+            pending = {
+                rel_path: entry for rel_path, entry in files.items()
+                if not log.is_done(rel_path, entry[1])
+            }
+
+            if resume and pending:
+                remote = self._list_remote(remote_root)
+                for rel_path, (path, size, _) in list(pending.items()):
+                    remote_size = remote.get(rel_path, (0,))[0]
+                    if _RESUME_MIN_SIZE <= remote_size < size:
+                        self._append_remote(
+                            path, remote_size, 
+                            posixpath.join(remote_root, rel_path)
+                        )
+                        log.record(rel_path, size)
+                        del pending[rel_path]
+
+            if not pending:
+                print("\n \n Nothing left to send")
+                return None
+
+            rel_paths = {path: rel_path for rel_path, (path, *_) in files.items()}
+
+            def on_done(path):
+                rel_path = rel_paths[path]
+                log.record(rel_path, files[rel_path][1])
+
+            return self._send_files(
+                path_to_bash, remote_root, pending.items(), dirs, streams, 
+                with_tqdm, measure_by, generate_logfile_to, on_done=on_done,
+                compression=compression
+            )
+
+    def _get_journaled(self, path_to_bash, source_path, save_path, journal, 
+                       resume, streams, with_tqdm, measure_by, 
+                       generate_logfile_to, compression="off"):
+        """
+        Receive `source_path` into `save_path/<name>` while recording every 
+        finished file in `journal`.
+        """
+        source_path = posixpath.normpath(source_path)
+        name = posixpath.basename(source_path)
+
+        listing = self._cached_listing(source_path)
+        if list(listing) == [""]:
+            remote_root = posixpath.dirname(source_path)
+            local_root = save_path
+            listing = {name: listing[""]}
+        else:
+            remote_root = source_path
+            local_root = os.path.join(save_path, name)
+
+        with Journal(journal, resume=resume) as log:
+            pending = {
+                rel_path: entry for rel_path, entry in listing.items()
+                if not log.is_done(rel_path, entry[0])
+            }
+
+            if resume and pending:
+                for rel_path, (size, *_) in list(pending.items()):
+                    local_path = os.path.join(local_root, *rel_path.split("/"))
+                    local_size = 0
+                    if os.path.isfile(local_path):
+                        local_size = os.path.getsize(local_path)
+                    if _RESUME_MIN_SIZE <= local_size < size:
+                        self._append_local(
+                            posixpath.join(remote_root, rel_path), local_size, 
+                            local_path
+                        )
+                        log.record(rel_path, size)
+                        del pending[rel_path]
+
+            if not pending:
+                print("\n \n Nothing left to receive")
+                return None
+
+            def on_done(remote_file):
+                rel_path = posixpath.relpath(remote_file, remote_root)
+                log.record(rel_path, listing[rel_path][0])
+
+            return self._receive_files(
+                path_to_bash, remote_root, local_root, pending.items(), 
+                streams, with_tqdm, measure_by, generate_logfile_to, 
+                on_done=on_done, compression=compression
+            )
+
+    def _put_ranges(self, source_path, save_path, streams, with_tqdm, 
+                    measure_by, generate_logfile_to, retries=1):
+        """
+        Send the large file `source_path` to `save_path` as `streams` byte
+        ranges, each over its own ssh connection and written at its 
+        offset of a temporary remote file. Every range is hashed as it is 
+        read and the remote machine hashes the same ranges in one command. 
+        Ranges that differ are published as `ChecksumMismatch` events, 
+        named `<name>[<start>:<end>]`, and sent again, up to `retries` times,
+        and the file is moved in place once all of them match. Like `scp`,
+        the file goes into `save_path` when it is an existing folder and is 
+        saved as `save_path` otherwise. Returns the result of `put` with 
+        `verify`.
+        """
+        name = os.path.basename(os.path.normpath(source_path))
+        size = os.path.getsize(source_path)
+
+        step = -(-size // streams)
+        ranges = [
+            (offset, min(step, size - offset)) 
+            for offset in range(0, size, step)
+        ]
+
+        remote_path = self._ssh(
+            f"if [ -d {shlex.quote(save_path)} ]; "
+            f"then target={shlex.quote(posixpath.join(save_path, name))}; "
+            f"else target={shlex.quote(save_path)}; fi; "
+            f'truncate -s {size} "$target.shwrap-partial" && printf %s "$target"'
+        )
+        partial = remote_path + ".shwrap-partial"
+
+        if self._system == 'Darwin' and with_tqdm is False:
+            raise Exception("At the momemnt, Darwin OS requires tqdm")
+
+        # the bar follows the bytes as they go out when measuring by size
+        by_bytes = with_tqdm and measure_by in ["KiB", "MiB"]
+        scale = 1000 if measure_by == "KiB" else 1000000
+
+        progress_bar = None
+        if with_tqdm:
+            progress_bar = _LockedProgress(tqdm(
+                desc='upload', ncols=60, 
+                total=self._progress_total([size], measure_by), unit='files', 
+                unit_scale=1, leave=True
+            ))
+
+        def on_bytes(n):
+            # ranges that are sent again were counted the first time
+            if by_bytes and attempt == 0:
+                progress_bar.update(n / scale)
+
+        def send(byte_range):
+            offset, length = byte_range
+            return self._send_range(
+                source_path, offset, length, partial, on_bytes
+            )
+
+        start = time.time()
+        pending = ranges
+        for attempt in range(retries + 1):
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                local = dict(zip(pending, executor.map(send, pending)))
+            remote = self._remote_range_hashes(partial, pending)
+            pending = [
+                byte_range for byte_range in pending 
+                if local[byte_range] is None 
+                or remote.get(byte_range) != local[byte_range]
+            ]
+            for offset, length in pending:
+                self._publish(ChecksumMismatch(
+                    f"{name}[{offset}:{offset + length}]", 
+                    local[(offset, length)], remote.get((offset, length)), 
+                    time.time()
+                ))
+            if not pending or attempt == retries:
+                break
+            print(f"\n \n Sending {len(pending)} byte ranges again")
+
+        resent = [name] if attempt > 0 else []
+        if pending:
+            print(f"\n \n {len(pending)} byte ranges of {name} did not arrive")
+            return {"verified": [], "resent": resent, "mismatched": [name]}
+
+        self._ssh(f"mv {shlex.quote(partial)} {shlex.quote(remote_path)}")
+        self._publish(file_finished(name, size, start, time.time()))
+        if not by_bytes:
+            self._advance(
+                progress_bar, 1, 1, name, size, measure_by, with_tqdm
+            )
+
+        if generate_logfile_to is not None:
+            with open_log(generate_logfile_to, self.log_max_bytes) as log:
+                log.write(name + "\n")
+
+        print("\n \n Process successfully completed")
+        return {"verified": [name], "resent": resent, "mismatched": []}
+
+    def _send_range(self, path, offset, length, remote_path, on_bytes):
+        """
+        Write `length` bytes of the local `path`, from `offset` on, at the 
+        same offset of `remote_path` over a new ssh connection. Returns the 
+        sha256 of the bytes, or None if the connection failed.
+        """
+        command = self._ssh_command(
+            "--command", 
+            f"dd of={shlex.quote(remote_path)} bs=1M seek={offset} "
+            f"oflag=seek_bytes conv=notrunc status=none"
+        )
+        digest = hashlib.sha256()
+        with open(path, "rb") as f, subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, 
+            stderr=subprocess.DEVNULL
+        ) as p:
+            f.seek(offset)
+            remaining = length
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(1 << 20, remaining))
+                    if not chunk:
+                        break
+                    self.job.acquire(len(chunk))
+                    digest.update(chunk)
+                    p.stdin.write(chunk)
+                    remaining -= len(chunk)
+                    on_bytes(len(chunk))
+                p.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        if p.returncode != 0:
+            return None
+        return digest.hexdigest()
+
+    def _remote_range_hashes(self, remote_path, ranges):
+        """
+        The sha256 of each `(offset, length)` byte range of `remote_path`, 
+        all hashed at once in one remote command.
+        """
+        path = shlex.quote(remote_path)
+        remote_command = " ".join(
+            f"printf '%s %s\\n' {offset} \"$(dd if={path} bs=1M "
+            f"skip={offset} count={length} iflag=skip_bytes,count_bytes "
+            f"status=none | sha256sum)\" &"
+            for offset, length in ranges
+        ) + " wait"
+
+        hashes = {}
+        for line in self._ssh(remote_command).splitlines():
+            offset, digest = line.split()[:2]
+            hashes[int(offset)] = digest
+        return {
+            (offset, length): hashes.get(offset) 
+            for offset, length in ranges
+        }
+
+    def _append_remote(self, path, offset, remote_path):
+        """
+        Continue a partially sent file by appending everything after the 
+        first `offset` bytes of the local `path` to `remote_path`.
+        """
+        command = self._ssh_command(
+            "--command", f"cat >> {shlex.quote(remote_path)}", 
+            *self._ssh_options()
+        )
+        with open(path, "rb") as f:
+            f.seek(offset)
+            with subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL
+            ) as p:
+                shutil.copyfileobj(f, p.stdin, 1 << 20)
+                p.stdin.close()
+
+        if p.returncode != 0:
+            raise Exception(f"Could not continue sending {path}")
+
+    def _append_local(self, remote_path, offset, path):
+        """
+        Continue a partially received file by appending everything after the
+        first `offset` bytes of `remote_path` to the local `path`.
+        """
+        command = self._ssh_command(
+            "--command", f"tail -c +{offset + 1} {shlex.quote(remote_path)}", 
+            *self._ssh_options()
+        )
+        with open(path, "ab") as f:
+            with subprocess.Popen(
+                command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE
+            ) as p:
+                shutil.copyfileobj(p.stdout, f, 1 << 20)
+
+        if p.returncode != 0:
+            raise Exception(f"Could not continue receiving {remote_path}")
+
+    def _sftp_backend(self):
+        """
+        The `PipelinedSFTP` of the "sftp-pipelined" backend. paramiko is only
+        imported once it is needed.
+        """
+        if self._sftp is None:
+            try:
+                from .sftp import PipelinedSFTP
+            except ImportError:
+                raise Exception(
+                    'The "sftp-pipelined" backend needs paramiko. '
+                    'Install it with `pip install paramiko`.'
+                )
+            self._sftp = PipelinedSFTP(
+                self.user, self.ip, self.port, self.pem,
+                known_hosts=self.ssh_options.get("UserKnownHostsFile"),
+                auto_add=self.ssh_options.get("StrictHostKeyChecking")
+                in ["no", "accept-new"]
+            )
+
+        # new channels pick up a window found by `autotune` after connecting
+        tuning = _TUNINGS.get(self._host_key())
+        if tuning is not None:
+            self._sftp.window_size = tuning["window_size"]
+        return self._sftp
+
+    def _put_sftp(self, source_path, save_path, streams, with_tqdm, 
+                  measure_by, generate_logfile_to, hashes=None):
+        """
+        Send `source_path` to `save_path/<name>` with the "sftp-pipelined" 
+        backend.
+        """
+        def prepare():
+            remote_root, files, dirs = self._local_tree(source_path, save_path)
+            self._ssh(
+                "xargs -0 mkdir -p", 
+                "\0".join(posixpath.join(remote_root, d) for d in dirs)
+            )
+            return [
+                (path, posixpath.join(remote_root, rel_path), size)
+                for rel_path, (path, size, *_) in files.items()
+            ]
+
+        return self._run_sftp(
+            "put", prepare, streams, 'upload', with_tqdm, measure_by, 
+            generate_logfile_to, hashes
+        )
+
+    def _get_sftp(self, source_path, save_path, streams, with_tqdm, 
+                  measure_by, generate_logfile_to):
+        """
+        Receive `source_path` into `save_path/<name>` with the 
+        "sftp-pipelined" backend.
+        """
+        source_path = posixpath.normpath(source_path)
+        name = posixpath.basename(source_path)
+
+        def prepare():
+            listing = self._cached_listing(source_path)
+            if list(listing) == [""]:
+                remote_root, local_root = posixpath.dirname(source_path), save_path
+                listing = {name: listing[""]}
+            else:
+                remote_root = source_path
+                local_root = os.path.join(save_path, name)
+
+            transfers = []
+            for rel_path, (size, *_) in listing.items():
+                local_path = os.path.join(local_root, *rel_path.split("/"))
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                transfers.append(
+                    (posixpath.join(remote_root, rel_path), local_path, size)
+                )
+            return transfers
+
+        return self._run_sftp(
+            "get", prepare, streams, 'download', with_tqdm, measure_by, 
+            generate_logfile_to
+        )
+
+    def _run_sftp(self, direction, prepare, streams, desc, with_tqdm, 
+                  measure_by, generate_logfile_to, hashes=None):
+        """
+        Connect the "sftp-pipelined" backend, unless a session is open, and 
+        move the `(source, destination, size)` files returned by `prepare` 
+        with `streams` files in flight. `hashes` is handed to `put`.
+        """
+        backend = self._sftp_backend()
+        connected_here = not backend.connected
+
+        log = open_log(generate_logfile_to, self.log_max_bytes)
+        try:
+            backend.connect()
+            transfers = prepare()
+
+            # the bar follows the bytes as they go out when measuring by size
+            by_bytes = with_tqdm and measure_by in ["KiB", "MiB"]
+            scale = 1000 if measure_by == "KiB" else 1000000
+
+            progress_bar = None
+            if with_tqdm:
+                progress_bar = _LockedProgress(tqdm(
+                    desc=desc, ncols=60, 
+                    total=self._progress_total(
+                        [size for *_, size in transfers], measure_by
+                    ), 
+                    unit='files', unit_scale=1, leave=True
+                ))
+
+            def on_bytes(n):
+                self.job.acquire(n)
+                if by_bytes:
+                    progress_bar.update(n / scale)
+
+            count = 1
+            lock = threading.Lock()
+
+            def on_file(name, size, start, end):
+                nonlocal count
+                self._publish(file_finished(name, size, start, end))
+                with lock:
+                    if log is not None:
+                        log.write(name + "\n")
+                    if not by_bytes:
+                        count = self._advance(
+                            progress_bar, count, len(transfers), name, size,
+                            measure_by, with_tqdm
+                        )
+
+            options = {} if hashes is None else {"hashes": hashes}
+            failures = getattr(backend, direction)(
+                transfers, workers=streams, 
+                on_bytes=on_bytes, on_file=on_file, **options
+            )
+
+            if failures:
+                path, error = failures[0]
+                print(f"\n \n {path}: {error}")
+            else:
+                print("\n \n Process successfully completed")
+
+        finally:
+            if connected_here:
+                backend.close()
+            if log is not None:
+                log.close()
+
+        return None
+
+    def _put_tarstream(self, source_path, save_path, with_tqdm, measure_by, 
+                       generate_logfile_to, compression="off", hashes=None,
+                       streams=1):
+        """
+        Send `source_path` as a tar archive that is written straight into the
+        stdin of a remote `tar -x`. With `streams` > 1 the files of a folder 
+        are split into that many archives of roughly equal size, each sent 
+        over its own connection. The sha256 of every file is stored in 
+        `hashes`, if it is given, as the file is read into the archive.
+        """
+        source_path = os.path.normpath(source_path)
+        name = os.path.basename(source_path)
+
+        folders, files = [], []
+        if os.path.isdir(source_path):
+            folders.append((source_path, name))
+            for entry in scan_tree(source_path, include_dirs=True):
+                member = (entry.path, f"{name}/{entry.rel_path}")
+                if entry.is_dir:
+                    folders.append(member)
                 else:
-                    if measure_by == "count":
-                        progress_bar.update(1)
-                    elif measure_by == "KiB":
-                        progress_bar.update(file_size / 1000)
-                    elif measure_by == "MiB":
-                        progress_bar.update(file_size / 1000000)
-
-            if generate_logfile_to is not None:
-                with open(generate_logfile_to, "a") as log:
-                    _ = log.write(line + "\n")
+                    files.append((member, entry.size))
+        else:
+            files.append(
+                ((source_path, name), os.path.getsize(source_path))
+            )
+        sizes = [size for _, size in files]
+        num_files = len(sizes)
+
+        codec = self._tar_codec(
+            [(path, size) for (path, _), size in files], compression, 
+            remote=False
+        )
+
+        # the folders go with the first archive, `tar -x` makes the parents
+        # of the files of the other archives as it needs them
+        groups = [[member for member, _ in files]]
+        if streams > 1 and num_files > 1:
+            groups = shard_by_size(groups[0], sizes, streams)
+        groups[0] = folders + groups[0]
+
+        progress_bar = None
+        if with_tqdm:
+            progress_bar = _LockedProgress(tqdm(
+                desc='upload', ncols=60, 
+                total=self._progress_total(sizes, measure_by), unit='files', 
+                unit_scale=1, leave=True
+            ))
+
+        unpack = f"tar -xf - -C {shlex.quote(save_path)}"
+        if codec == "zstd":
+            unpack = f"zstd -q -d -c | {unpack}"
+        # several archives each open their own connection so that they do 
+        # not share one tcp connection through the master
+        ssh_options = self._ssh_options() if len(groups) == 1 else []
+        command = self._ssh_command(
+            "--command", f"mkdir -p {shlex.quote(save_path)} && {unpack}", 
+            *ssh_options, *self._codec_options(codec)
+        )
+
+        count = 1
+        lock = threading.Lock()
+        log = open_log(generate_logfile_to, self.log_max_bytes)
+
+        def send(members):
+            nonlocal count
+            with tempfile.TemporaryFile() as stderr:
+                with subprocess.Popen(
+                    command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, 
+                    stderr=stderr
+                ) as p:
+                    archive, compressor = p.stdin, None
+                    if codec == "zstd":
+                        compressor = subprocess.Popen(
+                            ["zstd", "-q", "-1", "-T0", "-c"], 
+                            stdin=subprocess.PIPE, stdout=p.stdin
+                        )
+                        archive = compressor.stdin
+                    archive = PacedStream(archive, self.job)
+
+                    try:
+                        with tarfile.open(fileobj=archive, mode="w|") as tar:
+                            for path, arcname in members:
+                                info = tar.gettarinfo(path, arcname)
+                                if info.isreg():
+                                    start = time.time()
+                                    with open(path, "rb") as f:
+                                        reader = f
+                                        if hashes is not None:
+                                            reader = HashingReader(f)
+                                        tar.addfile(info, reader)
+                                    if hashes is not None:
+                                        hashes[path] = reader.hexdigest()
+                                    self._publish(file_finished(
+                                        arcname, info.size, start, time.time()
+                                    ))
+                                    with lock:
+                                        count = self._advance(
+                                            progress_bar, count, num_files, 
+                                            arcname, info.size, measure_by, 
+                                            with_tqdm
+                                        )
+                                else:
+                                    tar.addfile(info)
+
+                                if log is not None:
+                                    with lock:
+                                        log.write(arcname + "\n")
+                    except BrokenPipeError:
+                        pass
+                    finally:
+                        if compressor is not None:
+                            compressor.stdin.close()
+                            compressor.wait()
+                        p.stdin.close()
+
+                stderr.seek(0)
+                message = stderr.read().decode(errors="replace").strip()
+
+            if p.returncode != 0:
+                return message or f"tar exited with status {p.returncode}"
+            return None
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+                failures = [
+                    message for message in executor.map(send, groups) 
+                    if message is not None
+                ]
+        finally:
+            if log is not None:
+                log.close()
+
+        if failures:
+            print(f"\n \n {failures[0]}")
+        else:
+            print("\n \n Process successfully completed")
+
+        return None
+
+    def _get_tarstream(self, source_path, save_path, with_tqdm, measure_by, 
+                       generate_logfile_to, compression="off"):
+        """
+        Receive `source_path` as a tar archive read straight from the stdout 
+        of a remote `tar -c`, unpacking each member as it arrives.
+        """
+        source_path = posixpath.normpath(source_path)
+        parent, name = posixpath.split(source_path)
+        os.makedirs(save_path, exist_ok=True)
+
+        files = []
+        if compression != "off":
+            files = [
+                (posixpath.join(source_path, rel_path) if rel_path 
+                 else source_path, entry[0])
+                for rel_path, entry in self._cached_listing(source_path).items()
+            ]
+        codec = self._tar_codec(files, compression, remote=True)
+
+        progress_bar = None
+        if with_tqdm:
+            progress_bar = tqdm(
+                desc='download', ncols=60, unit='files', unit_scale=1, 
+                leave=True
+            )
+
+        remote_command = (
+            f"tar -cf - -C {shlex.quote(parent or '/')} {shlex.quote(name)}"
+        )
+        if codec == "zstd":
+            remote_command += " | zstd -q -1 -T0 -c"
+        command = self._ssh_command(
+            "--command", remote_command, *self._ssh_options(), 
+            *self._codec_options(codec)
+        )
+
+        extract_kwargs = {}
+        if hasattr(tarfile, "data_filter"):
+            extract_kwargs["filter"] = "data"
+
+        count = 1
+        log = open_log(generate_logfile_to, self.log_max_bytes)
+        with tempfile.TemporaryFile() as stderr:
+            with subprocess.Popen(
+                command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, 
+                stderr=stderr
+            ) as p:
+                archive, decompressor = p.stdout, None
+                if codec == "zstd":
+                    decompressor = subprocess.Popen(
+                        ["zstd", "-q", "-d", "-c"], 
+                        stdin=p.stdout, stdout=subprocess.PIPE
+                    )
+                    archive = decompressor.stdout
+                archive = PacedStream(archive, self.job)
+
+                try:
+                    with tarfile.open(fileobj=archive, mode="r|") as tar:
+                        last = time.time()
+                        for member in tar:
+                            tar.extract(member, save_path, **extract_kwargs)
+                            if member.isreg():
+                                now = time.time()
+                                self._publish(file_finished(
+                                    member.name, member.size, last, now
+                                ))
+                                last = now
+                                count = self._advance(
+                                    progress_bar, count, None, member.name, 
+                                    member.size, measure_by, with_tqdm
+                                )
+
+                            if log is not None:
+                                log.write(member.name + "\n")
+                except tarfile.ReadError:
+                    pass
+                finally:
+                    if decompressor is not None:
+                        decompressor.stdout.close()
+                        decompressor.wait()
+
+            stderr.seek(0)
+            message = stderr.read().decode(errors="replace").strip()
+
+        if log is not None:
+            log.close()
+
+        if p.returncode != 0:
+            print(f"\n \n {message}")
+        else:
+            print("\n \n Process successfully completed")
+
+        return None
+
+    @staticmethod
+    def _advance(progress_bar, count, num_files, current_file, file_size, 
+                 measure_by, with_tqdm):
+        """
+        Report one finished file, either on the tqdm bar or as a line that 
+        overwrites itself. Returns the updated count.
+        """
+        if not with_tqdm:
+            print(f"{count} / {num_files or '?'} : {current_file}", end="")
+            print('\033[1A', end='\x1b[2K')
+            return count + 1
+
+        if measure_by == "count":
+            progress_bar.update(1)
+        elif measure_by == "KiB":
+            progress_bar.update(file_size / 1000)
+        elif measure_by == "MiB":
+            progress_bar.update(file_size / 1000000)
+        return count + 1
+
+    @staticmethod
+    def _batch_by_dir(paths, destination_of, compressed=()):
+        """
+        Group `paths` by their destination folder, and by whether they are 
+        in `compressed`, so that each group can be moved with a single `scp`
+        call. Returns `(source_paths, save_path, scp_options)` tuples.
+        """
+        groups = {}
+        for path in paths:
+            key = (destination_of(path), path in compressed)
+            groups.setdefault(key, []).append(path)
+
+        batches = []
+        for (save_path, compress), group in groups.items():
+            scp_options = ("-C",) if compress else ()
+            for i in range(0, len(group), _MAX_FILES_PER_CALL):
+                batches.append(
+                    (group[i: i + _MAX_FILES_PER_CALL], save_path, scp_options)
+                )
+        return batches
+
+    @staticmethod
+    def _progress_total(sizes, measure_by):
+        """
+        The total of the tqdm bar for files of the given sizes.
+        """
+        if measure_by == "KiB":
+            return sum(sizes) / 1000
+        elif measure_by == "MiB":
+            return sum(sizes) / 1000000
+        return len(sizes)
+
+    def _run_parallel(self, path_to_bash, batches, total, desc, with_tqdm, 
+                      measure_by, generate_logfile_to, scp_options=(), 
+                      on_done=None):
+        """
+        Run each list of `(source_paths, save_path, scp_options)` batches on
+        its own thread, one `scp` call at a time over one connection per
+        thread, while sharing one progress bar. `on_done` is called with each
+        source path once it has arrived.
+        """
+        if self._system == 'Darwin' and with_tqdm is False:
+            raise Exception("At the momemnt, Darwin OS requires tqdm")
+
+        progress_bar = None
+        if with_tqdm:
+            progress_bar = _LockedProgress(tqdm(
+                desc=desc, ncols=60, total=total, unit='files', 
+                unit_scale=1, leave=True
+            ))
+
+        # several streams each open their own connection so that they do not 
+        # share one tcp connection through the master of the session, and a
+        # stream of several calls keeps its connection open between them
+        multiplex = len(batches) == 1 and self._control_dir is not None
+
+        def run(stream_batches):
+            if multiplex or len(stream_batches) < 2:
+                return send(stream_batches, [])
+            with self._stream_connection() as stream_options:
+                return send(stream_batches, stream_options)
+
+        def send(stream_batches, stream_options):
+            for source_paths, save_path, batch_options in stream_batches:
+                # each call takes its share of the cap as it starts, so a new
+                # cap applies from the next call of every stream
+                reservation = self.job.reserve(len(batches))
+                command = self._scp_command(
+                    path_to_bash, source_paths, save_path, multiplex=multiplex,
+                    scp_options=(
+                        *scp_options, *batch_options, 
+                        *self._limit_options(reservation.rate)
+                    )
+                ) + stream_options
+
+                # scp works through its arguments in order, so the n-th file
+                # that finishes is the n-th source path
+                finished = 0
+
+                def on_finished(event):
+                    nonlocal finished
+                    if on_done is not None and finished < len(source_paths):
+                        on_done(source_paths[finished])
+                    finished += 1
+
+                with reservation, subprocess.Popen(
+                    command,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    bufsize=1,
+                    universal_newlines=True
+                ) as p:
+                    success = self._follow(
+                        p, progress_bar, log, 1, len(source_paths), measure_by,
+                        with_tqdm, on_finished
+                    )
+                if success:
+                    return success
+
+                if on_done is not None:
+                    for path in source_paths[finished:]:
+                        on_done(path)
+
+        log = open_log(generate_logfile_to, self.log_max_bytes)
+        try:
+            with ThreadPoolExecutor(max_workers=len(batches) or 1) as executor:
+                results = list(executor.map(run, batches))
+
+            failures = [result for result in results if result]
+            if failures:
+                print(f"\n \n {failures[0]}")
+            else:
+                print("\n \n Process successfully completed")
+
+        except FileNotFoundError as e:
+            print(f"Bash script not found: {e}")
+
+        finally:
+            if log is not None:
+                log.close()
+
+        return None
+
+    def _follow(self, p, progress_bar, log, count, num_files, measure_by, 
+                with_tqdm, on_finished=None):
+        """
+        Follow the output of a running `send.sh` or `receive.sh`. Every event
+        is published to the subscribers, finished files move the progress 
+        bar and every line goes to the log. Returns an error message, or None
+        if `scp` succeeded.
+        """
+        parser = TransferParser(self._system)
+
+        # darwin runs scp under `script`, which puts everything on stdout
+        stream = p.stdout if self._system == 'Darwin' else p.stderr
+        message = None
+
+        def handle(events):
+            nonlocal count, message
+            for event in events:
+                self._publish(event)
+                if isinstance(event, FileFinished):
+                    count = self._advance(
+                        progress_bar, count, num_files, event.name, event.size,
+                        measure_by, with_tqdm
+                    )
+                    if on_finished is not None:
+                        on_finished(event)
+                elif isinstance(event, AuthFailed):
+                    message = "Permission denied. Check the pem file."
+                elif isinstance(event, ConnectionFailed) and message is None:
+                    message = event.message
+
+        for line in stream:
+            handle(parser.feed(line))
+            if log is not None:
+                log.write(line + "\n")
+
+        returncode = p.wait()
+        handle(parser.close(returncode == 0))
+
+        if message is None and returncode != 0:
+            message = f"scp exited with status {returncode}"
+        return message
+
+
+class _LockedProgress:
+    """
+    A tqdm bar that can be updated from several threads at once.
+    """
+    def __init__(self, progress_bar: tqdm):
+        self.progress_bar = progress_bar
+        self._lock = threading.Lock()
+
+    def update(self, n=1):
+        with self._lock:
+            self.progress_bar.update(n)
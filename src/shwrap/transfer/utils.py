@@ -1,17 +1,183 @@
 import os
+import heapq
+import hashlib
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import NamedTuple, Optional
+
+class ScanEntry(NamedTuple):
+    """
+    a file or folder found by `scan_tree`. `rel_path` is the posix path 
+    relative to the scanned root. `size` and `mtime` are None for folders and
+    when the scan was made without `stat`.
+    """
+    path: str
+    rel_path: str
+    is_dir: bool
+    size: Optional[int]
+    mtime: Optional[float]
+
+def scan_tree(root, include_dirs=False, stat=True, workers=1):
+    """
+    lazily yield a `ScanEntry` for every file below `root`, and for every
+    folder with `include_dirs`, reading each folder once with `os.scandir`.
+    The size and mtime of files are collected in the same pass unless `stat`
+    is False. Folders come before their contents. Folders that cannot be 
+    read and files that vanish during the scan are skipped, like `os.walk`
+    does. With `workers` > 1, that many folders are read at once, which 
+    helps on network mounts, and the order of entries is not fixed.
+    """
+    if workers > 1:
+        yield from _scan_tree_parallel(root, include_dirs, stat, workers)
+        return
+
+    stack = [(root, "")]
+    while stack:
+        path, rel_path = stack.pop()
+        entries, subdirs = _scan_dir(path, rel_path, stat)
+        for entry in entries:
+            if include_dirs or not entry.is_dir:
+                yield entry
+        stack.extend(reversed(subdirs))
+
+def _scan_tree_parallel(root, include_dirs, stat, workers):
+    # folders wait in `pending` so that only a few finished reads are held 
+    # in memory ahead of the consumer
+    pending = [(root, "")]
+    running = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            while pending and len(running) < 2 * workers:
+                running.add(executor.submit(_scan_dir, *pending.pop(), stat))
+
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                entries, subdirs = future.result()
+                pending.extend(subdirs)
+                for entry in entries:
+                    if include_dirs or not entry.is_dir:
+                        yield entry
+
+def _scan_dir(path, rel_path, stat):
+    """
+    the entries of one folder and the `(path, rel_path)` of its subfolders
+    """
+    entries, subdirs = [], []
+    try:
+        it = os.scandir(path)
+    except OSError:
+        return entries, subdirs
+
+    with it:
+        for item in it:
+            item_rel_path = f"{rel_path}/{item.name}" if rel_path else item.name
+            try:
+                if item.is_dir():
+                    entries.append(
+                        ScanEntry(item.path, item_rel_path, True, None, None)
+                    )
+                    # links to folders are not followed, like `os.walk`
+                    if not item.is_symlink():
+                        subdirs.append((item.path, item_rel_path))
+                    continue
+
+                size = mtime = None
+                if stat:
+                    st = item.stat()
+                    size, mtime = st.st_size, st.st_mtime
+            except OSError:
+                continue
+            entries.append(
+                ScanEntry(item.path, item_rel_path, False, size, mtime)
+            )
+    return entries, subdirs
 
 def list_files_recursively(directory):
     """
     list all files within a directory and within all subdirectories
     """
-    all_files = []
-    for item in os.listdir(directory):
-        full_path = os.path.join(directory, item)
-        if os.path.isdir(full_path):
-            all_files.extend(list_files_recursively(full_path))
-        else:
-            all_files.append(full_path)
-    return all_files
+    return [entry.path for entry in scan_tree(directory, stat=False)]
 
 def count_all_files(root):
-    return sum(len(files) for _, _, files in os.walk(root))
+    return sum(1 for _ in scan_tree(root, stat=False))
+
+def shard_by_size(items, sizes, num_shards):
+    """
+    split `items` into `num_shards` groups whose total sizes are as close to
+    each other as possible. The largest items are placed first, each into the
+    currently lightest group. Empty groups are dropped.
+    """
+    heap = [(0, i) for i in range(max(1, num_shards))]
+    shards = [[] for _ in heap]
+    for size, item in sorted(zip(sizes, items), key=lambda x: -x[0]):
+        total, i = heapq.heappop(heap)
+        shards[i].append(item)
+        heapq.heappush(heap, (total + size, i))
+    return [shard for shard in shards if shard]
+
+def sha256sum(path, chunk_size=1 << 20):
+    """
+    the hex sha256 digest of the file at `path`, like the `sha256sum` command
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def s3_etag(path, threshold=8 << 20, chunk_size=8 << 20):
+    """
+    the ETag that S3 gives the file at `path` once it is uploaded, in parts of
+    `chunk_size` bytes when it has at least `threshold` bytes like boto3 does.
+    This is the md5 of the file, or the md5 of the md5s of its parts followed
+    by the number of parts. Objects encrypted with KMS have other ETags.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < threshold:
+            digest = hashlib.md5()
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+            return digest.hexdigest()
+
+        parts = [
+            hashlib.md5(part).digest() 
+            for part in iter(lambda: f.read(chunk_size), b"")
+        ]
+    return f"{hashlib.md5(b''.join(parts)).hexdigest()}-{len(parts)}"
+
+class HashingReader:
+    """
+    wraps a file object opened for reading and hashes everything that is read
+    from it with sha256, so a file can be verified in the same pass that 
+    sends it
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.digest.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+# extensions whose contents are compressed already, so sampling them is a waste
+COMPRESSED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".mp3", ".mp4", ".m4a",
+    ".mkv", ".mov", ".avi", ".webm", ".gz", ".tgz", ".bz2", ".xz", ".zst", 
+    ".lz4", ".zip", ".7z", ".rar", ".npz", ".parquet", ".pdf",
+}
+
+def sample_compression(path, sample_bytes=1 << 16):
+    """
+    `(raw, compressed)`, the number of bytes read from the start of the file
+    at `path` and their size after fast zlib compression
+    """
+    with open(path, "rb") as f:
+        data = f.read(sample_bytes)
+    return len(data), len(zlib.compress(data, 1))
@@ -1,6 +1,7 @@
 import json
 import boto3
 from shwrap.transfer.aws import fast_upload
+from shwrap.transfer.utils import scan_tree
 from tqdm import tqdm
 import os
 
@@ -22,9 +23,8 @@ home = os.environ["HOME"]
 root = home + "/GitRepos/bash_to_python_project/bash_to_python/tests/transfer/aws/"
 source_dir  = root + 'move/'
 
-# find the size of the files being moved for the tqdn progress bar
-filelist = [os.path.join(source_dir, f) for f in os.listdir(source_dir)]
-totalsize = sum([os.stat(f).st_size for f in filelist])
+# the total size of the files being moved, for the tqdm progress bar
+totalsize = sum(entry.size for entry in scan_tree(source_dir))
 
 with tqdm(
     desc='upload', ncols=60, total=totalsize, unit='B', unit_scale=1
@@ -33,7 +33,7 @@ with tqdm(
         session, 
         "sshtools-demo-bucket", 
         "", 
-        filelist, 
+        source_dir, 
         pbar, 
         workers=10
     )
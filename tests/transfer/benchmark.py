@@ -0,0 +1,587 @@
+"""
+An offline benchmark of every transfer path.
+
+A throwaway sshd is started on localhost and, for the aws paths, a moto S3
+server stands in for S3, so nothing leaves the machine and the numbers can be
+reproduced. Each case of the matrix (file count x file size x backend) is run
+`--repeat` times and the median is written to a JSON file. Passing the JSON
+of an earlier run with `--compare` flags every case that got slower than
+`--threshold`, and the script then exits with status 1.
+
+    python tests/transfer/benchmark.py --out bench.json
+    python tests/transfer/benchmark.py --out new.json --compare bench.json
+
+The host key of the throwaway sshd is written to a known_hosts file in the
+workdir, which ssh is pointed at, so ~/.ssh is left alone. An already running
+ssh server can be used instead with `--ssh user@host:port --pem key`, and an
+already running S3 stand-in (eg minio) with `--s3-endpoint`.
+
+Needs `sshd` and `ssh-keygen` for the ssh backends, paramiko for "paramiko"
+and "sftp-pipelined", `pip install "moto[server]"` for the S3 stand-in and
+the aws cli for "cp_recursive". Backends whose requirements are missing are
+skipped.
+"""
+
+import argparse
+import contextlib
+import getpass
+import io
+import json
+import os
+import platform
+import posixpath
+import random
+import shlex
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from tqdm import tqdm
+from shwrap.transfer import SecureCopyProtocol
+
+
+SSH_BACKENDS = ["scp", "scp-streams4", "tarstream", "sftp-pipelined", "paramiko"]
+S3_BACKENDS = ["fast_upload", "fast_download", "cp_recursive", "sync"]
+
+DEFAULT_CASES = "1000x4K,100x256K,4x32M"
+
+_SUFFIXES = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+_PROFILE = "shwrap-bench"
+_BUCKET = "shwrap-bench"
+
+
+#--------------------------------------------------
+# The matrix
+#--------------------------------------------------
+
+def parse_cases(cases: str):
+    """
+    "1000x4K,4x32M" -> [(1000, 4096), (4, 33554432)]
+    """
+    parsed = []
+    for case in cases.split(","):
+        count, size = case.strip().upper().split("X")
+        suffix = size[-1] if size[-1] in _SUFFIXES else ""
+        parsed.append(
+            (int(count), int(size.removesuffix(suffix)) * _SUFFIXES[suffix])
+        )
+    return parsed
+
+
+def case_name(count: int, size: int):
+    for suffix in ["G", "M", "K"]:
+        if size >= _SUFFIXES[suffix] and size % _SUFFIXES[suffix] == 0:
+            return f"{count}x{size // _SUFFIXES[suffix]}{suffix}"
+    return f"{count}x{size}"
+
+
+def make_dataset(workdir: str, count: int, size: int, seed: int = 0):
+    """
+    `count` files of `size` random bytes, 100 to a folder. The dataset is
+    reused by later runs with the same case.
+    """
+    root = os.path.join(workdir, "data", case_name(count, size))
+    if os.path.isdir(root):
+        return root
+
+    rng = random.Random(seed)
+    tmp = root + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    for i in range(count):
+        folder = os.path.join(tmp, f"d{i // 100:04d}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"f{i:06d}.bin"), "wb") as f:
+            f.write(rng.randbytes(size))
+    os.replace(tmp, root)
+    return root
+
+
+#--------------------------------------------------
+# The local servers
+#--------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return None
+        time.sleep(0.1)
+    raise Exception(f"Nothing is listening on port {port}")
+
+
+def start_sshd(workdir: str):
+    """
+    Start an sshd on a free localhost port that only accepts a key made for
+    the benchmark. Returns the process and the `SecureCopyProtocol`
+    arguments to reach it, with ssh options that trust its host key.
+    """
+    sshd = shutil.which("sshd") or "/usr/sbin/sshd"
+    if not os.path.exists(sshd):
+        raise Exception("sshd is not installed")
+
+    folder = os.path.join(workdir, "sshd")
+    os.makedirs(folder, exist_ok=True)
+    host_key = os.path.join(folder, "host_key")
+    user_key = os.path.join(folder, "user_key")
+    for key in [host_key, user_key]:
+        if not os.path.exists(key):
+            subprocess.run(
+                ["ssh-keygen", "-q", "-t", "ed25519", "-N", "", "-f", key],
+                check=True
+            )
+    shutil.copy(user_key + ".pub", os.path.join(folder, "authorized_keys"))
+
+    port = free_port()
+    config = os.path.join(folder, "sshd_config")
+    with open(config, "w") as f:
+        f.write(
+            f"Port {port}\n"
+            f"ListenAddress 127.0.0.1\n"
+            f"HostKey {host_key}\n"
+            f"AuthorizedKeysFile {folder}/authorized_keys\n"
+            f"PidFile {folder}/sshd.pid\n"
+            f"PasswordAuthentication no\n"
+            f"PermitRootLogin prohibit-password\n"
+            f"StrictModes no\n"
+            f"UsePAM no\n"
+            f"Subsystem sftp internal-sftp\n"
+        )
+
+    p = subprocess.Popen(
+        [sshd, "-D", "-e", "-f", config],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    try:
+        wait_for_port(port)
+    except Exception:
+        p.kill()
+        raise Exception(f"sshd did not start: {p.stderr.read().strip()}")
+
+    with open(host_key + ".pub") as f:
+        key_type, key = f.read().split()[:2]
+    known_hosts = os.path.join(folder, "known_hosts")
+    with open(known_hosts, "w") as f:
+        f.write(f"[127.0.0.1]:{port} {key_type} {key}\n")
+    ssh_options = {
+        "UserKnownHostsFile": known_hosts, "StrictHostKeyChecking": "yes"
+    }
+
+    return p, (getpass.getuser(), "127.0.0.1", str(port), user_key, ssh_options)
+
+
+def start_s3(workdir: str):
+    """
+    Start a moto S3 server on a free localhost port. Returns the process and
+    the endpoint.
+    """
+    import moto.server  # noqa: F401, only checks that moto is installed
+
+    port = free_port()
+    p = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    wait_for_port(port)
+    return p, f"http://127.0.0.1:{port}"
+
+
+def use_s3_endpoint(workdir: str, endpoint: str):
+    """
+    Write an aws config with the "shwrap-bench" profile for `endpoint` and
+    point boto3 and the aws cli at it.
+    """
+    folder = os.path.join(workdir, "aws")
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "config"), "w") as f:
+        f.write(
+            f"[profile {_PROFILE}]\n"
+            f"region = us-east-1\n"
+            f"endpoint_url = {endpoint}\n"
+        )
+    with open(os.path.join(folder, "credentials"), "w") as f:
+        f.write(
+            f"[{_PROFILE}]\n"
+            f"aws_access_key_id = testing\n"
+            f"aws_secret_access_key = testing\n"
+        )
+    os.environ["AWS_CONFIG_FILE"] = os.path.join(folder, "config")
+    os.environ["AWS_SHARED_CREDENTIALS_FILE"] = os.path.join(folder, "credentials")
+    os.environ["AWS_ENDPOINT_URL_S3"] = endpoint
+
+    import boto3
+    session = boto3.Session(profile_name=_PROFILE)
+    session.client("s3").create_bucket(Bucket=_BUCKET)
+    return session
+
+
+#--------------------------------------------------
+# The backends
+#--------------------------------------------------
+
+def ssh_case(backend: str, direction: str, host: tuple, source: str,
+             remote: str, local: str):
+    """
+    A function that runs one transfer of `backend`, and a function that
+    clears what it left behind.
+    """
+    user, ip, port, pem, ssh_options = host
+
+    if backend in ["sftp-pipelined", "paramiko"]:
+        import paramiko  # noqa: F401, both need paramiko
+
+    if backend == "paramiko":
+        return paramiko_case(direction, host, source, remote, local)
+
+    kwargs = {"with_tqdm": True}
+    if backend == "sftp-pipelined":
+        scp = SecureCopyProtocol(
+            user, ip, port, pem, backend="sftp-pipelined", 
+            ssh_options=ssh_options
+        )
+        kwargs["streams"] = 8
+    else:
+        scp = SecureCopyProtocol(user, ip, port, pem, ssh_options=ssh_options)
+        if backend == "scp-streams4":
+            kwargs["streams"] = 4
+        elif backend == "tarstream":
+            kwargs["mode"] = "tarstream"
+
+    name = os.path.basename(source)
+    if direction == "put":
+        def run():
+            scp.put(source, remote, **kwargs)
+        def clear():
+            remote_root = shlex.quote(f"{remote}/{name}")
+            scp.run(f"rm -rf {remote_root}; mkdir -p {shlex.quote(remote)}")
+    else:
+        def run():
+            scp.get(os.path.join(remote, name), local, **kwargs)
+        def clear():
+            shutil.rmtree(os.path.join(local, name), ignore_errors=True)
+            os.makedirs(local, exist_ok=True)
+    return run, clear
+
+
+def paramiko_case(direction: str, host: tuple, source: str, remote: str,
+                  local: str):
+    """
+    Plain paramiko, one file at a time over one SFTP channel, which is what
+    the pipelined backend has to beat. Like the other backends, every run 
+    makes its own connection.
+    """
+    import paramiko
+
+    user, ip, port, pem, ssh_options = host
+
+    def connect():
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        if ssh_options is not None:
+            client.load_host_keys(ssh_options["UserKnownHostsFile"])
+        client.connect(ip, int(port), user, key_filename=pem)
+        return client
+
+    name = os.path.basename(source)
+    remote_root = f"{remote}/{name}"
+
+    def run():
+        with connect() as client, client.open_sftp() as sftp:
+            for dirpath, _, filenames in os.walk(source):
+                rel_dir = os.path.relpath(dirpath, source)
+                remote_dir = posixpath.normpath(f"{remote_root}/{rel_dir}")
+                local_dir = os.path.normpath(os.path.join(local, name, rel_dir))
+                if direction == "put":
+                    with contextlib.suppress(IOError):
+                        sftp.mkdir(remote_dir)
+                else:
+                    os.makedirs(local_dir, exist_ok=True)
+
+                for filename in filenames:
+                    if direction == "put":
+                        sftp.put(
+                            os.path.join(dirpath, filename),
+                            f"{remote_dir}/{filename}"
+                        )
+                    else:
+                        sftp.get(
+                            f"{remote_dir}/{filename}",
+                            os.path.join(local_dir, filename)
+                        )
+
+    def clear():
+        if direction == "put":
+            with connect() as client:
+                _, stdout, _ = client.exec_command(
+                    f"rm -rf {shlex.quote(remote_root)}"
+                )
+                stdout.channel.recv_exit_status()
+        else:
+            shutil.rmtree(os.path.join(local, name), ignore_errors=True)
+
+    return run, clear
+
+
+def s3_case(backend: str, session, source: str, local: str):
+    """
+    A function that runs one transfer of `backend` against the S3 stand-in,
+    and a function that clears what it left behind.
+    """
+    from shwrap.transfer.aws import cp_recursive, sync, fast_upload, fast_download
+
+    name = os.path.basename(source)
+    files = [
+        os.path.join(dirpath, filename)
+        for dirpath, _, filenames in os.walk(source) for filename in filenames
+    ]
+    total = sum(os.path.getsize(path) for path in files)
+    bucket = session.resource("s3").Bucket(_BUCKET)
+
+    def clear_bucket():
+        bucket.objects.filter(Prefix=f"{name}/").delete()
+
+    if backend == "fast_upload":
+        def run():
+            with tqdm(total=total, unit="B", unit_scale=1) as pbar:
+                fast_upload(session, _BUCKET, name, files, pbar)
+        return run, clear_bucket
+
+    if backend in ["cp_recursive", "sync"]:
+        function = cp_recursive if backend == "cp_recursive" else sync
+        def run():
+            function(source, f"s3://{_BUCKET}/{name}/", _PROFILE)
+        return run, clear_bucket
+
+    # fast_download needs the objects to be there first
+    clear_bucket()
+    with quiet(), tqdm(total=total, unit="B", unit_scale=1) as pbar:
+        fast_upload(session, _BUCKET, name, files, pbar)
+    keys = [f"{name}/{os.path.basename(path)}" for path in files]
+    destination = os.path.join(local, name)
+
+    def run():
+        os.makedirs(destination, exist_ok=True)
+        with tqdm(total=total, unit="B", unit_scale=1) as pbar:
+            fast_download(session, _BUCKET, keys, destination, pbar)
+
+    def clear():
+        shutil.rmtree(destination, ignore_errors=True)
+
+    return run, clear
+
+
+#--------------------------------------------------
+# Running and comparing
+#--------------------------------------------------
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Swallow the progress output of the transfers.
+    """
+    with contextlib.redirect_stdout(io.StringIO()), \
+            contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def time_case(run, clear, repeat: int):
+    """
+    The seconds of `repeat` runs, each after a call to `clear` that is not
+    timed.
+    """
+    seconds = []
+    for _ in range(repeat):
+        clear()
+        with quiet():
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+    clear()
+    return seconds
+
+
+def compare(results: dict, previous: dict, threshold: float):
+    """
+    The cases whose median got more than `threshold` slower than in
+    `previous`, as `(case, old_seconds, new_seconds)` tuples.
+    """
+    old = {result["case"]: result for result in previous["results"]}
+    regressions = []
+    for result in results["results"]:
+        before = old.get(result["case"])
+        if before is None:
+            continue
+        if result["seconds"] > before["seconds"] * (1 + threshold):
+            regressions.append(
+                (result["case"], before["seconds"], result["seconds"])
+            )
+    return regressions
+
+
+def git_commit():
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+        text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    return result.stdout.strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--cases", default=DEFAULT_CASES,
+                        help="file count x file size, eg 1000x4K,4x32M")
+    parser.add_argument("--backends", default=",".join(SSH_BACKENDS + S3_BACKENDS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", default=os.path.join(
+        tempfile.gettempdir(), "shwrap-benchmark"
+    ))
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--compare", default=None,
+                        help="the JSON of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="the slowdown, as a fraction, that is flagged")
+    parser.add_argument("--ssh", default=None,
+                        help="user@host:port of a running ssh server")
+    parser.add_argument("--pem", default=None)
+    parser.add_argument("--s3-endpoint", default=None,
+                        help="the url of a running S3 stand-in")
+    args = parser.parse_args()
+
+    backends = args.backends.split(",")
+    cases = parse_cases(args.cases)
+    os.makedirs(args.workdir, exist_ok=True)
+
+    servers = []
+    host = session = None
+    try:
+        if any(backend in SSH_BACKENDS for backend in backends):
+            if args.ssh is not None:
+                user, _, address = args.ssh.rpartition("@")
+                ip, _, port = address.partition(":")
+                host = (
+                    user or getpass.getuser(), ip, port or "22", args.pem, None
+                )
+            else:
+                try:
+                    p, host = start_sshd(args.workdir)
+                    servers.append(p)
+                except Exception as e:
+                    print(f"Skipping the ssh backends: {e}")
+
+        if any(backend in S3_BACKENDS for backend in backends):
+            try:
+                endpoint = args.s3_endpoint
+                if endpoint is None:
+                    p, endpoint = start_s3(args.workdir)
+                    servers.append(p)
+                session = use_s3_endpoint(args.workdir, endpoint)
+            except Exception as e:
+                print(f"Skipping the S3 backends: {e}")
+
+        remote = os.path.join(args.workdir, "remote")
+        local = os.path.join(args.workdir, "local")
+        results = {
+            "meta": {
+                "time": time.time(),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeat": args.repeat,
+            },
+            "results": [],
+        }
+
+        for count, size in cases:
+            source = make_dataset(args.workdir, count, size)
+            uploaded = False
+            for backend in backends:
+                if backend in SSH_BACKENDS:
+                    if host is None:
+                        continue
+                    directions = ["put", "get"]
+                elif backend in S3_BACKENDS:
+                    if session is None:
+                        continue
+                    if backend == "cp_recursive" and not shutil.which("aws"):
+                        print(f"Skipping {backend}: the aws cli is not installed")
+                        continue
+                    directions = [
+                        "get" if backend == "fast_download" else "put"
+                    ]
+                else:
+                    raise Exception(f"Unknown backend: {backend}")
+
+                for direction in directions:
+                    name = f"{backend}/{direction}/{case_name(count, size)}"
+                    try:
+                        if backend in SSH_BACKENDS:
+                            # every `get` reads the same copy on the remote 
+                            # side, sent once per case
+                            if direction == "get" and not uploaded:
+                                upload, clear_remote = ssh_case(
+                                    "scp", "put", host, source, 
+                                    f"{remote}/get", local
+                                )
+                                with quiet():
+                                    clear_remote()
+                                    upload()
+                                uploaded = True
+                            run, clear = ssh_case(
+                                backend, direction, host, source, 
+                                f"{remote}/{direction}", local
+                            )
+                        else:
+                            run, clear = s3_case(backend, session, source, local)
+                        seconds = time_case(run, clear, args.repeat)
+                    except ImportError as e:
+                        print(f"Skipping {name}: {e}")
+                        continue
+
+                    median = statistics.median(seconds)
+                    results["results"].append({
+                        "case": name,
+                        "backend": backend,
+                        "direction": direction,
+                        "files": count,
+                        "file_size": size,
+                        "seconds": median,
+                        "runs": seconds,
+                        "mb_per_second": count * size / median / 1e6,
+                        "files_per_second": count / median,
+                    })
+                    print(
+                        f"{name:40} {median:8.3f} s "
+                        f"{count * size / median / 1e6:9.1f} MB/s"
+                    )
+
+    finally:
+        for p in servers:
+            p.terminate()
+            p.wait()
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare(results, previous, args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.3f} s -> {after:.3f} s")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 """
-A speed test of scp with subprocess vs scp with paramiko
+A speed test of scp with subprocess vs scp with paramiko vs the pipelined
+sftp backend
 """
 
 import paramiko
@@ -68,6 +69,14 @@ scp = SecureCopyProtocol(
     pem=pem_file_path
 )
 
+scp_pipelined = SecureCopyProtocol(
+    user=username,
+    ip=hostname,
+    port=str(port),
+    pem=pem_file_path,
+    backend="sftp-pipelined"
+)
+
 celebA_path = "/home/nicholas/Datasets/celebA/imgs_1000"
 
 # this took 53 seconds
@@ -90,3 +99,14 @@ scp_paramiko.put(
 )
 after = time.time() - now
 print(after)
+
+remote_path_pipelined = '/nvme1n1users/nick/Tmp/pipelined'
+now = time.time()
+scp_pipelined.put(
+    source_path=celebA_path, 
+    save_path=remote_path_pipelined, 
+    with_tqdm=True,
+    streams=8
+)
+after = time.time() - now
+print(after)